@@ -0,0 +1,101 @@
+"""
+Bytes sent and server CPU for a catalog browse session.
+
+A session opens the categories, pages through a category and looks at a
+few products, then comes back the way catalog.html does. It is replayed
+in-process through the Flask test client with the response layers turned
+on one by one:
+
+  rebuild       payload cache cleared before every request, no compression,
+                no revalidation - every request builds and encodes its JSON
+  payload cache pre-serialized payloads reused across requests
+  + gzip        the client sends Accept-Encoding: gzip, br
+  + ETag        the client revalidates with If-None-Match and gets 304s
+
+    python benchmarks/bench_catalog_http.py --sessions 200
+"""
+import argparse
+import random
+import time
+
+import common
+
+
+def session_urls(category_ids, product_ids, rng) -> list:
+    category_id = rng.choice(category_ids)
+    products = rng.sample(product_ids[category_id], 4)
+    urls = ['/api/categories', f'/api/products?category_id={category_id}&limit=50']
+    urls += [f'/api/product/{product_id}' for product_id in products[:2]]
+    urls += ['/api/categories', f'/api/products?category_id={category_id}&limit=50']
+    urls += [f'/api/product/{product_id}' for product_id in products[2:]]
+    urls += [f'/api/product/{products[0]}']
+    return urls
+
+
+def replay(client, payload_cache, sessions, compress: bool, revalidate: bool, cache_payloads: bool):
+    headers = {'Accept-Encoding': 'gzip, br'} if compress else {}
+    sent = requests = not_modified = 0
+    cpu_started = time.process_time()
+    for urls in sessions:
+        # One WebView per session: its HTTP cache starts empty
+        etags = {}
+        for url in urls:
+            if not cache_payloads:
+                payload_cache.clear()
+            request_headers = dict(headers)
+            if revalidate and url in etags:
+                request_headers['If-None-Match'] = etags[url]
+            response = client.get(url, headers=request_headers)
+            assert response.status_code in (200, 304), response.status_code
+            requests += 1
+            not_modified += response.status_code == 304
+            sent += len(response.get_data())
+            if response.headers.get('ETag'):
+                etags[url] = response.headers['ETag']
+    cpu = time.process_time() - cpu_started
+    return sent, cpu, requests, not_modified
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--products', type=int, default=200, help='products per category')
+    args = parser.parse_args()
+
+    common.setup_database()
+    category_ids = common.seed_catalog(args.categories, args.products)
+
+    from database.db import SessionLocal
+    from database.models import Product
+    from webapp.app import app, limiter, payload_cache
+
+    limiter.enabled = False
+    product_ids = {category_id: [] for category_id in category_ids}
+    with SessionLocal() as db:
+        for product_id, category_id in db.query(Product.id, Product.category_id).filter(Product.is_active == True):
+            product_ids[category_id].append(product_id)
+
+    rng = random.Random(7)
+    sessions = [session_urls(category_ids, product_ids, rng) for _ in range(args.sessions)]
+    client = app.test_client()
+    # Warm the catalog snapshot so every mode starts from the same state
+    replay(client, payload_cache, sessions[:1], compress=False, revalidate=False, cache_payloads=True)
+
+    modes = [
+        ('rebuild', False, False, False),
+        ('payload cache', False, False, True),
+        ('+ gzip', True, False, True),
+        ('+ ETag', True, True, True),
+    ]
+    print(f"{'mode':<16}{'KB/session':>12}{'CPU ms/session':>16}{'304s':>8}")
+    for name, compress, revalidate, cache_payloads in modes:
+        sent, cpu, requests, not_modified = replay(
+            client, payload_cache, sessions, compress, revalidate, cache_payloads
+        )
+        print(f"{name:<16}{sent / 1024 / len(sessions):>12.1f}{cpu * 1000 / len(sessions):>16.2f}"
+              f"{not_modified:>8}")
+
+
+if __name__ == '__main__':
+    main()
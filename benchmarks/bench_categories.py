@@ -0,0 +1,65 @@
+"""
+Product counts per category: lazy cat.products vs one GROUP BY query.
+
+The old /api/categories and admin views loaded every product of every
+category to count them; crud.get_category_product_counts aggregates in
+the database. Prints statements sent and latency for both.
+
+    python benchmarks/bench_categories.py --categories 50 --products 10000
+"""
+import argparse
+import time
+
+import common
+
+
+def lazy_counts(db):
+    """What /api/categories did before: one SELECT of all products per category"""
+    from database import crud
+
+    return {
+        cat.id: {'total': len(cat.products), 'active': len([p for p in cat.products if p.is_active])}
+        for cat in crud.get_all_categories(db)
+    }
+
+
+def grouped_counts(db):
+    from database import crud
+
+    crud.get_all_categories(db)
+    return crud.get_category_product_counts(db)
+
+
+def measure(name, func, repeats: int):
+    from database.db import SessionLocal
+
+    latencies, result = [], None
+    with common.count_statements() as statements:
+        for _ in range(repeats):
+            with SessionLocal() as db:
+                started = time.perf_counter()
+                result = func(db)
+                latencies.append(time.perf_counter() - started)
+    common.report(name, latencies)
+    print(f"{'':<28} statements per call: {statements[0] // repeats}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--products', type=int, default=10_000, help='products per category')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    common.setup_database()
+    with common.timed('seed'):
+        common.seed_catalog(args.categories, args.products)
+
+    before = measure('lazy cat.products (before)', lazy_counts, args.repeats)
+    after = measure('GROUP BY (after)', grouped_counts, args.repeats)
+    assert before == after, "both paths must count the same products"
+
+
+if __name__ == '__main__':
+    main()
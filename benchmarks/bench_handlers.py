@@ -0,0 +1,113 @@
+"""
+Handler latency under concurrent updates: sync get_db vs async_crud.
+
+Every simulated update does what the cart callback does - load the cart
+view for one user, then wait for the Telegram API round trip - and the
+script reports p50/p99 latency per update plus how late a 10 ms heartbeat
+task wakes up, which is how long the event loop was blocked.
+
+Run it against PostgreSQL (DATABASE_URL) to see the gap that matters: on a
+local SQLite file each query takes microseconds, so the thread hop of the
+async driver costs more than the blocking it saves.
+
+    python benchmarks/bench_handlers.py --updates 2000 --concurrency 100
+"""
+import argparse
+import asyncio
+import time
+
+import common
+
+
+async def _heartbeat(lags, stop: asyncio.Event, interval=0.01):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def _handle_sync(telegram_id: int, api_rtt: float):
+    from database import crud
+    from database.db import get_db
+
+    with get_db() as db:
+        view = crud.get_cart_view(db, telegram_id)
+    await asyncio.sleep(api_rtt)
+    return view
+
+
+async def _handle_async(telegram_id: int, api_rtt: float):
+    from database import async_crud
+    from database.db import get_async_db
+
+    async with get_async_db() as db:
+        view = await async_crud.get_cart_view(db, telegram_id)
+    await asyncio.sleep(api_rtt)
+    return view
+
+
+async def _run(handler, telegram_ids, updates: int, concurrency: int, api_rtt: float):
+    from database.db import dispose_async_engine
+
+    latencies, lags = [], []
+    stop = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(lags, stop))
+    gate = asyncio.Semaphore(concurrency)
+
+    async def update(n):
+        # Latency counts from the moment the update arrives, queueing included
+        arrived = time.perf_counter()
+        async with gate:
+            await handler(telegram_ids[n % len(telegram_ids)], api_rtt)
+        latencies.append(time.perf_counter() - arrived)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(update(n) for n in range(updates)))
+    wall = time.perf_counter() - started
+    stop.set()
+    await heartbeat
+    await dispose_async_engine()
+    return latencies, lags, wall
+
+
+def seed(users: int, items_per_cart: int):
+    from database import crud
+    from database.db import get_db
+
+    with get_db() as db:
+        category = crud.create_category(db, name=f'Bench {time.time_ns()}')
+        products = [
+            crud.create_product(db, category.id, f'Товар {n}', 'Описание', 100.0 + n, stock=10**6)
+            for n in range(items_per_cart)
+        ]
+        telegram_ids = []
+        for n in range(users):
+            user = crud.get_or_create_user(db, telegram_id=10**9 + n)
+            for product in products:
+                crud.add_to_cart(db, user.id, product.id, 1)
+            telegram_ids.append(user.telegram_id)
+    return telegram_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--items', type=int, default=5, help='cart lines per user')
+    parser.add_argument('--api-rtt', type=float, default=0.05, help='simulated Telegram API round trip, s')
+    args = parser.parse_args()
+
+    common.setup_database()
+    telegram_ids = seed(args.users, args.items)
+
+    for name, handler in (('sync get_db (before)', _handle_sync), ('async_crud (after)', _handle_async)):
+        latencies, lags, wall = asyncio.run(
+            _run(handler, telegram_ids, args.updates, args.concurrency, args.api_rtt)
+        )
+        common.report(name, latencies, wall)
+        common.report('  event loop lag', lags)
+
+
+if __name__ == '__main__':
+    main()
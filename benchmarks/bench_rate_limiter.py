@@ -0,0 +1,78 @@
+"""
+Memory and time per check of the in-process rate limiter with 1M users.
+
+Every distinct user makes --hits calls. The old rate_limit decorator kept
+a list of timestamps per key and never dropped keys; MemoryRateLimiter
+keeps two counters per key, sweeps idle keys and holds at most
+RATE_LIMIT_MAX_KEYS of them. Memory is the tracemalloc total left
+allocated after the run.
+
+    python benchmarks/bench_rate_limiter.py --users 1000000
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+import common
+
+
+class TimestampListLimiter:
+    """The check utils.security.rate_limit did before MemoryRateLimiter"""
+
+    def __init__(self):
+        self.storage = {}
+
+    async def hit(self, key: str, limit: int, window: float) -> bool:
+        now = time.time()
+        if key not in self.storage:
+            self.storage[key] = []
+        self.storage[key] = [t for t in self.storage[key] if now - t < window]
+        if len(self.storage[key]) >= limit:
+            return False
+        self.storage[key].append(now)
+        return True
+
+
+async def _drive(limiter, users: int, hits: int, limit: int, window: float):
+    for n in range(users):
+        key = f"catalog_callback:{n}"
+        for _ in range(hits):
+            await limiter.hit(key, limit, window)
+
+
+def measure(name, factory, users: int, hits: int, limit: int, window: float):
+    limiter = factory()
+    started = time.perf_counter()
+    asyncio.run(_drive(limiter, users, hits, limit, window))
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    limiter = factory()
+    asyncio.run(_drive(limiter, users, hits, limit, window))
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    keys = len(limiter.storage) if hasattr(limiter, 'storage') else limiter.get_stats()['keys']
+    print(f"{name:<34} {elapsed * 1e9 / (users * hits):8.0f}ns/hit "
+          f"{retained / 2**20:9.1f}MiB retained {keys:>9} keys")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--hits', type=int, default=3, help='calls per user')
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--window', type=float, default=60)
+    args = parser.parse_args()
+
+    import config
+    from utils.storage import MemoryRateLimiter
+
+    measure('timestamp lists (before)', TimestampListLimiter, args.users, args.hits, args.limit, args.window)
+    measure(f'MemoryRateLimiter ({config.RATE_LIMIT_MAX_KEYS} keys)', MemoryRateLimiter,
+            args.users, args.hits, args.limit, args.window)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+/api/search: the old ILIKE scan vs database.search.
+
+Seeds a generated catalog (100k products by default) and runs a mix of
+exact, prefix, multi-word and misspelled queries through both paths,
+printing p50/p99 latency and how many queries found anything. On SQLite
+the new path is the in-memory index; set DATABASE_URL to PostgreSQL to
+measure the tsvector/pg_trgm indexes instead. SQLite's ILIKE only folds
+ASCII case, so there it also misses lowercase Cyrillic queries.
+
+    python benchmarks/bench_search.py --products 100000
+"""
+import argparse
+import time
+
+import common
+
+QUERIES = [
+    'футболка', 'худи черная', 'кроссовки', 'джинсы синяя', 'куртк',
+    'рубашка белая', 'шорты', 'кепка серая', 'футбплка', 'кросовки',
+    'хлопок', 'модель 4242',
+]
+
+
+def ilike_search(db, query: str):
+    """The /api/search query before database.search"""
+    from database import crud
+    from database.models import Product
+
+    products = crud.apply_profile(db.query(Product), 'product_with_category').filter(
+        Product.is_active == True,
+        (Product.name.ilike(f'%{query}%') | Product.description.ilike(f'%{query}%'))
+    ).limit(20).all()
+    return [product.id for product in products]
+
+
+def indexed_search(db, query: str):
+    from database import search
+
+    return search.search_products(db, query, limit=20)
+
+
+def measure(name, func, rounds: int):
+    from database.db import SessionLocal
+
+    latencies, found = [], 0
+    with SessionLocal() as db:
+        for _ in range(rounds):
+            for query in QUERIES:
+                started = time.perf_counter()
+                hits = func(db, query)
+                latencies.append(time.perf_counter() - started)
+                found += bool(hits)
+    common.report(name, latencies)
+    print(f"{'':<28} queries with results: {found // rounds}/{len(QUERIES)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    common.setup_database()
+    with common.timed('seed'):
+        common.seed_catalog(args.categories, args.products // args.categories)
+
+    from database import search
+    from database.db import SessionLocal
+    with common.timed('first search (index warm-up)'), SessionLocal() as db:
+        search.search_products(db, 'футболка')
+
+    measure('ILIKE (before)', ilike_search, args.rounds)
+    measure('database.search (after)', indexed_search, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
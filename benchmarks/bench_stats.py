@@ -0,0 +1,107 @@
+"""
+Admin statistics: scanning orders vs the daily rollup tables.
+
+Seeds orders spread over the last year (1M by default) and times the old
+admin_statistics queries - every order of the last 30 days loaded and
+summed in Python - against stats.get_sales_summary, which reads one
+rollup row per day. Also times rebuild_rollups, the one-off backfill.
+
+    python benchmarks/bench_stats.py --orders 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import common
+
+STATUSES = ['pending', 'paid', 'processing', 'completed', 'completed', 'cancelled']
+
+
+def seed(orders: int, users: int = 1000, chunk: int = 50_000):
+    from database.db import SessionLocal
+    from database.models import Order, User
+
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        db.execute(User.__table__.insert(), [
+            {'telegram_id': 7 * 10**8 + n, 'created_at': now - timedelta(days=rng.random() * 365)}
+            for n in range(users)
+        ])
+        user_ids = [row[0] for row in db.query(User.id)]
+        for start in range(0, orders, chunk):
+            rows = []
+            for n in range(start, min(orders, start + chunk)):
+                status = rng.choice(STATUSES)
+                created_at = now - timedelta(days=rng.random() * 365)
+                rows.append({
+                    'user_id': rng.choice(user_ids),
+                    'order_number': f'BENCH-{n}',
+                    'total_amount': float(rng.randint(500, 20_000)),
+                    'status': status,
+                    'payment_status': 'succeeded' if status in ('paid', 'processing', 'completed') else 'pending',
+                    'created_at': created_at,
+                    'updated_at': created_at,
+                })
+            db.execute(Order.__table__.insert(), rows)
+        db.commit()
+
+
+def scan_orders(db):
+    """What admin_statistics ran before the rollups"""
+    from database import crud
+
+    now = datetime.utcnow()
+    total_revenue = crud.get_total_revenue(db)
+    periods = {
+        'today': now.replace(hour=0, minute=0, second=0, microsecond=0),
+        'week': now - timedelta(days=7),
+        'month': now - timedelta(days=30),
+    }
+    summary = {'all': total_revenue}
+    for name, start in periods.items():
+        orders = crud.get_orders_by_date_range(db, start, now)
+        summary[name] = sum(o.total_amount for o in orders if o.payment_status == 'succeeded')
+    return summary
+
+
+def read_rollups(db):
+    from database import crud
+
+    return crud.get_sales_summary(db)
+
+
+def measure(name, func, repeats: int):
+    from database.db import SessionLocal
+
+    latencies = []
+    for _ in range(repeats):
+        with SessionLocal() as db:
+            started = time.perf_counter()
+            func(db)
+            latencies.append(time.perf_counter() - started)
+    common.report(name, latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--orders', type=int, default=1_000_000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    common.setup_database()
+    with common.timed('seed'):
+        seed(args.orders)
+
+    from database import stats
+    from database.db import SessionLocal
+    with common.timed('rebuild_rollups (backfill)'), SessionLocal() as db:
+        stats.rebuild_rollups(db)
+
+    measure('scan orders (before)', scan_orders, args.repeats)
+    measure('daily rollups (after)', read_rollups, args.repeats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Requests per second of /api/products: Flask dev server vs gunicorn.
+
+Starts the web app the way main.py does for WEBAPP_SERVER=flask (one
+process, app.run) and WEBAPP_SERVER=gunicorn (gthread workers), with rate
+limiting switched off, then keeps --concurrency connections busy for
+--duration seconds and reports requests/s and p50/p99 latency.
+
+    python benchmarks/bench_webapp.py --products 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import common
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def create_app():
+    """webapp.app with rate limiting off; gunicorn loads it as bench_webapp:create_app()"""
+    from webapp.app import app, limiter
+
+    limiter.enabled = False
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode: str, port: int, workers: int, threads: int) -> subprocess.Popen:
+    if mode == 'flask':
+        cmd = [sys.executable, os.path.abspath(__file__), '--serve', str(port)]
+    else:
+        cmd = [
+            sys.executable, '-m', 'gunicorn',
+            '--chdir', BENCH_DIR,
+            '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers),
+            '--threads', str(threads),
+            '--worker-class', 'gthread',
+            '--log-level', 'warning',
+            'bench_webapp:create_app()',
+        ]
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+async def load(url: str, concurrency: int, duration: float):
+    import aiohttp
+
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(session):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            async with session.get(url) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(session) for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=2000, help='products in the seeded category')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per server mode')
+    parser.add_argument('--workers', type=int, default=(os.cpu_count() or 1) * 2 + 1)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        # Child process of the flask mode, like main.run_webapp
+        create_app().run(host='127.0.0.1', port=args.serve, debug=False, use_reloader=False)
+        return
+
+    common.setup_database()
+    category_id, = common.seed_catalog(1, args.products)
+
+    for mode in ('flask', 'gunicorn'):
+        if mode == 'gunicorn' and importlib.util.find_spec('gunicorn') is None:
+            print(f"{mode:<28} skipped: gunicorn is not installed")
+            continue
+        port = _free_port()
+        server = start_server(mode, port, args.workers, args.threads)
+        try:
+            url = f"http://127.0.0.1:{port}/api/products?category_id={category_id}"
+            latencies, errors, wall = asyncio.run(load(url, args.concurrency, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+        common.report(f"{mode} /api/products", latencies, wall)
+        if errors:
+            print(f"{'':<28} non-200 responses: {errors}")
+
+
+if __name__ == '__main__':
+    main()
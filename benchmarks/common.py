@@ -0,0 +1,113 @@
+"""
+Shared setup for the benchmark scripts.
+
+Benchmarks run against DATABASE_URL when it is set (point it at a scratch
+PostgreSQL database for production-like numbers) or a throwaway SQLite
+file. config and database.db build their engines at import time, so the
+environment is prepared before anything from the project is imported.
+"""
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+os.environ.setdefault('BOT_TOKEN', '123456:bench-token')
+os.environ.setdefault('ADMIN_IDS', '1')
+if not os.getenv('DATABASE_URL'):
+    _db_dir = tempfile.mkdtemp(prefix='shop-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+    os.environ['DB_AUTO_MIGRATE'] = 'true'
+os.environ.pop('ASYNC_DATABASE_URL', None)
+
+
+def setup_database():
+    """Migrate the benchmark database to head"""
+    from database.db import init_db
+
+    init_db(max_retries=1)
+
+
+def percentile(samples, pct: float) -> float:
+    """Nearest-rank percentile of samples (pct in 0..100)"""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def report(name: str, samples_s, wall_s: float = None):
+    """Print p50/p99/max latency in milliseconds (and throughput if wall_s is given)"""
+    line = (
+        f"{name:<28} n={len(samples_s):<7} "
+        f"p50={percentile(samples_s, 50) * 1000:8.2f}ms "
+        f"p99={percentile(samples_s, 99) * 1000:8.2f}ms "
+        f"max={max(samples_s, default=0) * 1000:8.2f}ms"
+    )
+    if wall_s:
+        line += f"  {len(samples_s) / wall_s:9.1f}/s"
+    print(line)
+
+
+@contextmanager
+def count_statements():
+    """Count SQL statements sent through the sync engine; yields a one-item list"""
+    from sqlalchemy import event
+    from database.db import engine
+
+    counter = [0]
+
+    def before_cursor_execute(*args):
+        counter[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def seed_catalog(categories: int, products_per_category: int) -> list:
+    """Bulk-insert categories with generated products; returns the category ids"""
+    from datetime import datetime
+    from database.db import SessionLocal
+    from database.models import Category, Product
+
+    words = ['Футболка', 'Худи', 'Кепка', 'Джинсы', 'Куртка', 'Кроссовки', 'Рубашка', 'Шорты']
+    colors = ['черная', 'белая', 'синяя', 'красная', 'зеленая', 'серая', 'бежевая']
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        category_ids = []
+        for c in range(categories):
+            category = Category(name=f'Категория {c} {time.time_ns()}', position=c)
+            db.add(category)
+            db.flush()
+            category_ids.append(category.id)
+            db.execute(Product.__table__.insert(), [
+                {
+                    'category_id': category.id,
+                    'name': f'{words[n % len(words)]} {colors[(n // len(words)) % len(colors)]} {c}-{n}',
+                    'description': f'Модель {n}, хлопок {50 + n % 50}%',
+                    'price': 500.0 + (n * 37) % 10000,
+                    'stock': n % 20,
+                    'is_active': n % 10 != 0,
+                    'position': n,
+                    'created_at': now,
+                    'updated_at': now,
+                }
+                for n in range(products_per_category)
+            ])
+        db.commit()
+    return category_ids
+
+
+@contextmanager
+def timed(name: str):
+    """Print how long the block took"""
+    started = time.perf_counter()
+    yield
+    print(f"{name:<28} {(time.perf_counter() - started) * 1000:10.1f}ms")
@@ -0,0 +1,192 @@
+"""
+Replay recorded Telegram updates through the webhook server and time them.
+
+The bot runs exactly as in BOT_MODE=webhook - bot.create_dispatcher() and
+bot.create_webhook_app() on a real port - while a stub Bot API server on
+localhost answers its outgoing calls (sendMessage, editMessageText, ...)
+after --api-rtt seconds. Every simulated user replays the recording in
+order; the script reports how fast the webhook acknowledges an update and
+how long until its handler has finished.
+
+Record updates from a test bot with getUpdates and save one Update JSON
+object per line; benchmarks/data/updates.jsonl is a sample browse session
+(/start, catalog, category, product, cart, orders) that expects category
+and product id 1, which the script seeds on an empty database.
+
+    python benchmarks/replay_webhook.py --users 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+
+import common
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'updates.jsonl')
+
+
+class StubBotAPI:
+    """Answers Bot API calls the way Telegram would, after a fixed delay"""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.calls = 0
+        self._message_ids = itertools.count(10)
+        self._runner = None
+        self.url = None
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        self.calls += 1
+        method = request.match_info['method'].lower()
+        data = await request.post()
+        await asyncio.sleep(self.rtt)
+
+        if method.startswith(('send', 'edit')):
+            chat_id = int(data.get('chat_id', 0))
+            result = {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': data.get('text') or data.get('caption') or '',
+            }
+        elif method == 'getme':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Shop', 'username': 'shop_bot'}
+        elif method == 'getchatmember':
+            result = {'status': 'member', 'user': {'id': int(data.get('user_id', 0)), 'is_bot': False, 'first_name': 'U'}}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def __aenter__(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+
+def load_recording(path: str) -> list:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def as_user(update: dict, telegram_id: int, update_id: int) -> dict:
+    """The recorded update as if a different user had sent it"""
+    update = json.loads(json.dumps(update))
+    update['update_id'] = update_id
+    event = update.get('message') or update.get('callback_query')
+    event['from']['id'] = telegram_id
+    message = event if 'chat' in event else event.get('message')
+    if message:
+        message['chat']['id'] = telegram_id
+    return update
+
+
+async def replay(recording, users: int, concurrency: int, api_rtt: float, port: int):
+    import aiohttp
+    from aiohttp import web
+    from aiogram import Bot
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.enums import ParseMode
+
+    import bot as bot_module
+    import config
+    from database.db import dispose_async_engine
+
+    acks, done_latencies = [], []
+    finished = {}
+
+    async def track(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            future = finished.pop(event.update_id, None)
+            if future and not future.done():
+                future.set_result(time.perf_counter())
+
+    async with StubBotAPI(api_rtt) as api:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api.url))
+        bot = Bot(config.BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        dp = bot_module.create_dispatcher()
+        dp.update.outer_middleware(track)
+
+        runner = web.AppRunner(bot_module.create_webhook_app(bot, dp))
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        url = f"http://127.0.0.1:{port}{config.WEBHOOK_PATH}"
+        headers = {'X-Telegram-Bot-Api-Secret-Token': config.WEBHOOK_SECRET}
+
+        update_ids = itertools.count(1)
+        gate = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+
+        async def session_of(client, telegram_id):
+            async with gate:
+                for recorded in recording:
+                    update = as_user(recorded, telegram_id, next(update_ids))
+                    future = finished[update['update_id']] = loop.create_future()
+                    started = time.perf_counter()
+                    async with client.post(url, json=update, headers=headers) as response:
+                        assert response.status == 200, await response.text()
+                    acks.append(time.perf_counter() - started)
+                    done_latencies.append(await asyncio.wait_for(future, 30) - started)
+
+        started = time.perf_counter()
+        try:
+            async with aiohttp.ClientSession() as client:
+                await asyncio.gather(*(session_of(client, 10**8 + n) for n in range(users)))
+        finally:
+            wall = time.perf_counter() - started
+            await runner.cleanup()
+            await dp.storage.close()
+            await bot.session.close()
+            await dispose_async_engine()
+
+    common.report('webhook ack', acks, wall)
+    common.report('update handled', done_latencies, wall)
+    print(f"{'':<28} Bot API calls: {api.calls}")
+
+
+def seed():
+    """Category and product 1 for the sample recording"""
+    from database import crud
+    from database.db import get_db
+
+    with get_db() as db:
+        if crud.get_product(db, 1) is None:
+            category = crud.create_category(db, name='Футболки')
+            crud.create_product(db, category.id, 'Футболка', 'Хлопок', 1500.0, stock=100, sizes='S,M,L')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('recording', nargs='?', default=SAMPLE, help='JSONL file of recorded updates')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50, help='users replaying at the same time')
+    parser.add_argument('--api-rtt', type=float, default=0.05, help='stub Bot API latency, s')
+    parser.add_argument('--port', type=int, default=8089)
+    args = parser.parse_args()
+
+    common.setup_database()
+    seed()
+    recording = load_recording(args.recording)
+    asyncio.run(replay(recording, args.users, args.concurrency, args.api_rtt, args.port))
+
+
+if __name__ == '__main__':
+    main()
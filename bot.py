@@ -1,12 +1,19 @@
 import asyncio
 import logging
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 import config
-from database.db import init_db
+from database.db import init_db, dispose_async_engine
+from utils import broadcast
+from utils.middleware import UserMiddleware
+from utils.outbox_worker import OutboxWorker
+from utils.payment import payment_gateway
+from utils.payment_reconciler import PaymentReconciler
+from utils.storage import create_fsm_storage
 from handlers import user_handlers, admin_handlers, cart_handlers, order_handlers, payment_handlers
 
 # Configure logging
@@ -17,19 +24,34 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def main():
-    """Main bot function"""
-    # Initialize database
-    logger.info("Initializing database...")
-    init_db()
-    
-    # Initialize bot and dispatcher
-    bot = Bot(
+def create_bot() -> Bot:
+    """Create bot instance with default HTML parse mode"""
+    return Bot(
         token=config.BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
+
+
+def create_dispatcher() -> Dispatcher:
+    """Create dispatcher with all routers; shared by polling and webhook modes"""
+    dp = Dispatcher(storage=create_fsm_storage())
+    
+    # Inner middlewares of the dispatcher also wrap handlers of included routers
+    user_middleware = UserMiddleware()
+    dp.message.middleware(user_middleware)
+    dp.callback_query.middleware(user_middleware)
+    dp.startup.register(user_middleware.start)
+    dp.shutdown.register(user_middleware.stop)
     
-    dp = Dispatcher(storage=MemoryStorage())
+    # Notifications queued by other processes, e.g. paid orders from the YooKassa webhook
+    outbox_worker = OutboxWorker()
+    dp.startup.register(outbox_worker.start)
+    dp.shutdown.register(outbox_worker.stop)
+    
+    # Settles orders whose payment notification was lost and expires abandoned ones
+    payment_reconciler = PaymentReconciler()
+    dp.startup.register(payment_reconciler.start)
+    dp.shutdown.register(payment_reconciler.stop)
     
     dp.include_router(user_handlers.router)
     dp.include_router(admin_handlers.router)
@@ -37,14 +59,84 @@ async def main():
     dp.include_router(order_handlers.router)
     dp.include_router(payment_handlers.router)
     
-    logger.info("Bot started successfully!")
+    return dp
+
+
+def create_webhook_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    """aiohttp application that feeds webhook updates into the dispatcher"""
+    app = web.Application()
+    
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=config.WEBHOOK_SECRET
+    ).register(app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    
+    return app
+
+
+async def run_polling(bot: Bot, dp: Dispatcher):
+    """Receive updates with long polling"""
+    # Polling and webhook are mutually exclusive on Telegram's side
+    await bot.delete_webhook(drop_pending_updates=False)
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Receive updates through the webhook server until cancelled"""
+    await bot.set_webhook(
+        config.WEBHOOK_URL,
+        secret_token=config.WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=config.WEBHOOK_MAX_CONNECTIONS
+    )
+    
+    runner = web.AppRunner(create_webhook_app(bot, dp))
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook server listening on {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # The webhook stays registered: other workers behind the balancer keep serving it
+        await runner.cleanup()
+
+
+async def run_dispatcher(bot: Bot, dp: Dispatcher):
+    """Run the dispatcher in the configured BOT_MODE"""
+    if config.BROADCAST_RESUME:
+        # Continue a broadcast interrupted by the previous shutdown
+        await broadcast.resume_broadcast(bot)
+    
+    if config.BOT_MODE == "webhook":
+        await run_webhook(bot, dp)
+    else:
+        await run_polling(bot, dp)
+
+
+async def main():
+    """Main bot function"""
+    # Initialize database
+    logger.info("Initializing database...")
+    init_db()
+    
+    # Initialize bot and dispatcher
+    bot = create_bot()
+    dp = create_dispatcher()
+    
+    logger.info(f"Bot started successfully in {config.BOT_MODE} mode!")
     logger.info(f"Admin IDs: {config.ADMIN_IDS}")
     
-    # Start polling
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        await run_dispatcher(bot, dp)
     finally:
+        await dp.storage.close()
+        await payment_gateway.close()
         await bot.session.close()
+        await dispose_async_engine()
 
 
 if __name__ == "__main__":
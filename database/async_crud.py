@@ -0,0 +1,105 @@
+"""
+Asyncio variants of database.crud for aiogram handlers.
+
+Every function here takes an AsyncSession and runs the matching sync
+crud function through AsyncSession.run_sync, so query logic lives in one
+place while handlers await I/O instead of blocking the event loop.
+
+Objects returned from these functions are detached from the greenlet
+bridge: only column attributes (and relationships loaded eagerly inside
+the crud function) may be accessed afterwards.
+"""
+from functools import wraps
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import crud
+
+
+def _async_variant(func):
+    """Wrap a sync crud function so it can be awaited with an AsyncSession"""
+    @wraps(func)
+    async def wrapper(db: AsyncSession, *args, **kwargs):
+        return await db.run_sync(func, *args, **kwargs)
+    return wrapper
+
+
+# User CRUD
+get_or_create_user = _async_variant(crud.get_or_create_user)
+get_user_by_telegram_id = _async_variant(crud.get_user_by_telegram_id)
+touch_users = _async_variant(crud.touch_users)
+get_all_users = _async_variant(crud.get_all_users)
+get_users_page = _async_variant(crud.get_users_page)
+update_user_theme = _async_variant(crud.update_user_theme)
+block_user = _async_variant(crud.block_user)
+get_user = _async_variant(crud.get_user)
+get_total_users = _async_variant(crud.get_total_users)
+get_user_order_stats = _async_variant(crud.get_user_order_stats)
+update_user_status = _async_variant(crud.update_user_status)
+get_broadcast_recipients = _async_variant(crud.get_broadcast_recipients)
+count_broadcast_recipients = _async_variant(crud.count_broadcast_recipients)
+deactivate_users = _async_variant(crud.deactivate_users)
+
+# Category CRUD
+create_category = _async_variant(crud.create_category)
+get_categories = _async_variant(crud.get_categories)
+get_category = _async_variant(crud.get_category)
+update_category = _async_variant(crud.update_category)
+delete_category = _async_variant(crud.delete_category)
+get_category_by_name = _async_variant(crud.get_category_by_name)
+get_all_categories = _async_variant(crud.get_all_categories)
+get_category_product_counts = _async_variant(crud.get_category_product_counts)
+
+# Product CRUD
+create_product = _async_variant(crud.create_product)
+get_products = _async_variant(crud.get_products)
+get_products_page = _async_variant(crud.get_products_page)
+get_product = _async_variant(crud.get_product)
+update_product = _async_variant(crud.update_product)
+delete_product = _async_variant(crud.delete_product)
+
+# Cart CRUD
+add_to_cart = _async_variant(crud.add_to_cart)
+get_cart_items = _async_variant(crud.get_cart_items)
+get_available_stock = _async_variant(crud.get_available_stock)
+update_cart_item = _async_variant(crud.update_cart_item)
+clear_cart = _async_variant(crud.clear_cart)
+get_cart_item = _async_variant(crud.get_cart_item)
+get_cart_view = _async_variant(crud.get_cart_view)
+increase_cart_item = _async_variant(crud.increase_cart_item)
+decrease_cart_item = _async_variant(crud.decrease_cart_item)
+remove_user_cart_item = _async_variant(crud.remove_user_cart_item)
+clear_user_cart = _async_variant(crud.clear_user_cart)
+remove_cart_item = _async_variant(crud.remove_cart_item)
+
+# Order CRUD
+create_order = _async_variant(crud.create_order)
+get_orders = _async_variant(crud.get_orders)
+get_orders_page = _async_variant(crud.get_orders_page)
+get_order = _async_variant(crud.get_order)
+get_order_by_number = _async_variant(crud.get_order_by_number)
+update_order_status = _async_variant(crud.update_order_status)
+update_order_payment_status = _async_variant(crud.update_order_payment_status)
+cancel_order = _async_variant(crud.cancel_order)
+attach_payment = _async_variant(crud.attach_payment)
+apply_payment_status = _async_variant(crud.apply_payment_status)
+get_pending_payments_page = _async_variant(crud.get_pending_payments_page)
+apply_payment_statuses = _async_variant(crud.apply_payment_statuses)
+sweep_reservations = _async_variant(crud.sweep_reservations)
+claim_outbox_messages = _async_variant(crud.claim_outbox_messages)
+complete_outbox_messages = _async_variant(crud.complete_outbox_messages)
+retry_outbox_message = _async_variant(crud.retry_outbox_message)
+purge_outbox = _async_variant(crud.purge_outbox)
+get_recent_orders = _async_variant(crud.get_recent_orders)
+get_orders_by_date_range = _async_variant(crud.get_orders_by_date_range)
+get_top_products = _async_variant(crud.get_top_products)
+get_total_orders = _async_variant(crud.get_total_orders)
+get_total_revenue = _async_variant(crud.get_total_revenue)
+get_pending_orders_count = _async_variant(crud.get_pending_orders_count)
+
+# Settings
+get_setting = _async_variant(crud.get_setting)
+set_setting = _async_variant(crud.set_setting)
+
+# Statistics
+get_sales_summary = _async_variant(crud.get_sales_summary)
+get_statistics = _async_variant(crud.get_statistics)
@@ -0,0 +1,179 @@
+"""
+Cart views and in-place quantity changes.
+
+A cart is read with one joined query (cart items, products and the matching
+size variant) into an immutable CartView with line and grand totals, so
+rendering never touches ORM relationships. Button taps change quantities
+with a single UPDATE ... RETURNING scoped to the tapping user through a
+telegram_id subquery, so no User row is loaded first and one user cannot
+modify another user's cart item. Every tap costs the same two statements
+(the change and the re-read) however many items the cart holds.
+"""
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from sqlalchemy import and_, case, delete, func, select, update
+from sqlalchemy.orm import Session, aliased
+
+from database.models import User, Product, ProductVariant, CartItem
+
+
+@dataclass(frozen=True)
+class CartLine:
+    id: int
+    product_id: int
+    name: str
+    size: Optional[str]
+    quantity: int
+    unit_price: float
+    stock: int
+
+    @property
+    def line_total(self) -> float:
+        return self.unit_price * self.quantity
+
+
+@dataclass(frozen=True)
+class CartView:
+    items: Tuple[CartLine, ...]
+    total: float
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.items
+
+    @property
+    def units(self) -> int:
+        return sum(item.quantity for item in self.items)
+
+
+def _owner_id(telegram_id: int):
+    return select(User.id).where(User.telegram_id == telegram_id).scalar_subquery()
+
+
+def _available_stock():
+    """
+    Stock of the joined cart item's product and size variant, by the rules of
+    inventory.available_stock: 0 for inactive products and for sizes missing
+    from a product with per-size stock, otherwise capped by the variant
+    """
+    other_variant = aliased(ProductVariant)
+    has_variants = select(other_variant.id).where(other_variant.product_id == Product.id).exists()
+    product_stock = func.coalesce(Product.stock, 0)
+    return case(
+        (Product.is_active.is_(False), 0),
+        (CartItem.size.is_(None), product_stock),
+        (ProductVariant.id.isnot(None), case(
+            (ProductVariant.stock < product_stock, ProductVariant.stock),
+            else_=product_stock
+        )),
+        (has_variants, 0),
+        else_=product_stock
+    )
+
+
+def get_cart_view(db: Session, telegram_id: int) -> CartView:
+    """Cart of a Telegram user with totals, in one query"""
+    rows = db.execute(
+        select(
+            CartItem.id, CartItem.product_id, Product.name, CartItem.size, CartItem.quantity,
+            Product.price, _available_stock().label('stock')
+        )
+        .join(Product, Product.id == CartItem.product_id)
+        .outerjoin(ProductVariant, and_(
+            ProductVariant.product_id == CartItem.product_id,
+            ProductVariant.size == CartItem.size
+        ))
+        .where(CartItem.user_id == _owner_id(telegram_id))
+        .order_by(CartItem.id)
+    ).all()
+
+    items = tuple(
+        CartLine(
+            id=row.id,
+            product_id=row.product_id,
+            name=row.name,
+            size=row.size,
+            quantity=row.quantity or 0,
+            unit_price=row.price,
+            stock=max(row.stock or 0, 0),
+        )
+        for row in rows
+    )
+    return CartView(items=items, total=sum(item.line_total for item in items))
+
+
+def increase_item(db: Session, telegram_id: int, cart_item_id: int, amount: int = 1) -> Optional[int]:
+    """
+    Add to a cart item's quantity if stock allows
+
+    Returns:
+        Optional[int]: New quantity, None if the item is not in the user's
+        cart or there is not enough stock
+    """
+    stock_limit = (
+        select(_available_stock())
+        .select_from(Product)
+        .outerjoin(ProductVariant, and_(
+            ProductVariant.product_id == Product.id,
+            ProductVariant.size == CartItem.size
+        ))
+        .where(Product.id == CartItem.product_id)
+        .scalar_subquery()
+    )
+    return db.execute(
+        update(CartItem)
+        .where(
+            CartItem.id == cart_item_id,
+            CartItem.user_id == _owner_id(telegram_id),
+            CartItem.quantity + amount <= stock_limit
+        )
+        .values(quantity=CartItem.quantity + amount)
+        .returning(CartItem.quantity)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+
+def decrease_item(db: Session, telegram_id: int, cart_item_id: int, amount: int = 1) -> Optional[int]:
+    """
+    Subtract from a cart item's quantity, removing it when it reaches zero
+
+    Returns:
+        Optional[int]: New quantity (0 if removed), None if the item is not
+        in the user's cart
+    """
+    quantity = db.execute(
+        update(CartItem)
+        .where(
+            CartItem.id == cart_item_id,
+            CartItem.user_id == _owner_id(telegram_id),
+            CartItem.quantity > amount
+        )
+        .values(quantity=CartItem.quantity - amount)
+        .returning(CartItem.quantity)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if quantity is not None:
+        return quantity
+    return 0 if remove_item(db, telegram_id, cart_item_id) else None
+
+
+def remove_item(db: Session, telegram_id: int, cart_item_id: int) -> bool:
+    """Delete a cart item if it belongs to the user"""
+    removed = db.execute(
+        delete(CartItem)
+        .where(CartItem.id == cart_item_id, CartItem.user_id == _owner_id(telegram_id))
+        .returning(CartItem.id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    return removed is not None
+
+
+def clear(db: Session, telegram_id: int) -> int:
+    """Empty a user's cart; returns the number of removed items"""
+    result = db.execute(
+        delete(CartItem)
+        .where(CartItem.user_id == _owner_id(telegram_id))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
@@ -0,0 +1,420 @@
+"""
+In-process catalog snapshot cache.
+
+Readers get an immutable, versioned CatalogSnapshot (categories, products,
+per-category ordered product lists, parsed photos, sizes and per-size stock)
+without touching
+the database. The snapshot is replaced atomically, so reads need no lock.
+
+Freshness is driven by a catalog version stored in the settings table and
+bumped by database.crud whenever categories or products are edited. Writes
+made in this process invalidate the snapshot immediately; other processes
+(the gunicorn workers, the bot) notice the new version on their next
+revalidation, at most CATALOG_CACHE_TTL seconds later.
+
+Checkouts and cancellations do not bump the version: stock counts in the
+snapshot are as of its build. Current counts come from StockLevels
+(get_stock()), reloaded with two small queries at most every
+CATALOG_STOCK_TTL seconds and overlaid on snapshot products with
+StockLevels.apply().
+"""
+import asyncio
+import bisect
+import dataclasses
+import hashlib
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import FrozenSet, Mapping, Optional, Tuple
+
+from sqlalchemy import Integer, Text, cast, update
+from sqlalchemy.orm import Session
+
+from database.models import Category, Product, ProductVariant, Settings
+from database.pagination import encode_cursor, decode_cursor, InvalidCursor
+import config
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION_KEY = 'catalog_version'
+
+
+@dataclass(frozen=True)
+class CategoryView:
+    id: int
+    name: str
+    description: Optional[str]
+    icon: Optional[str]
+    position: int
+    is_active: bool
+    product_count: int
+    active_product_count: int
+
+
+@dataclass(frozen=True)
+class ProductView:
+    id: int
+    category_id: int
+    category_name: str
+    name: str
+    description: Optional[str]
+    price: float
+    stock: int
+    brand: Optional[str]
+    sizes: Optional[str]
+    size_stock: Optional[str]
+    size_chart: Optional[str]
+    photos: Optional[str]
+    is_active: bool
+    position: int
+    photo_list: Tuple[str, ...]
+    size_list: Tuple[str, ...]
+    size_stock_map: Mapping[str, int]
+
+    @property
+    def available_sizes(self) -> Tuple[str, ...]:
+        """Sizes that can be ordered; all sizes when stock is not tracked per size"""
+        if not self.size_stock_map:
+            return self.size_list
+        return tuple(size for size in self.size_list if self.size_stock_map.get(size, 0) > 0)
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: int
+    updated_at: Optional[datetime]
+    built_at: float
+    categories: Mapping[int, CategoryView]
+    ordered_categories: Tuple[CategoryView, ...]
+    products: Mapping[int, ProductView]
+    products_by_category: Mapping[int, Tuple[ProductView, ...]]
+    active_products: Tuple[ProductView, ...]
+    photo_ids: FrozenSet[str]
+
+    def get_categories(self, active_only: bool = True) -> Tuple[CategoryView, ...]:
+        if active_only:
+            return tuple(cat for cat in self.ordered_categories if cat.is_active)
+        return self.ordered_categories
+
+    def get_products(self, category_id: int = None) -> Tuple[ProductView, ...]:
+        """Active products ordered by position, optionally for one category"""
+        if category_id:
+            return self.products_by_category.get(category_id, ())
+        return self.active_products
+
+    def get_products_page(self, category_id: int = None, cursor: str = None,
+                          limit: int = 50) -> Tuple[Tuple[ProductView, ...], Optional[str]]:
+        """Keyset page over active products on (position, id), like crud.get_products_page"""
+        products = self.get_products(category_id)
+        start = 0
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != 2:
+                raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+            start = bisect.bisect_right(products, values, key=lambda p: (p.position, p.id))
+        page = products[start:start + limit]
+        next_cursor = None
+        if start + limit < len(products):
+            next_cursor = encode_cursor(page[-1].position, page[-1].id)
+        return page, next_cursor
+
+    def get_product(self, product_id: int) -> Optional[ProductView]:
+        return self.products.get(product_id)
+
+
+@dataclass(frozen=True)
+class StockLevels:
+    """Current stock of all products, read separately from the versioned snapshot"""
+    token: str
+    loaded_at: float
+    products: Mapping[int, int]
+    variants: Mapping[int, Mapping[str, int]]
+
+    def stock_of(self, product: ProductView) -> int:
+        return self.products.get(product.id, product.stock)
+
+    def apply(self, product: ProductView) -> ProductView:
+        """The product with current stock; unchanged if its stock was not loaded"""
+        if product.id not in self.products:
+            return product
+        size_stock = self.variants.get(product.id)
+        if not size_stock:
+            return dataclasses.replace(product, stock=self.products[product.id])
+        return dataclasses.replace(
+            product,
+            stock=self.products[product.id],
+            size_stock=json.dumps(dict(size_stock), ensure_ascii=False),
+            size_stock_map=size_stock,
+        )
+
+
+_lock = threading.Lock()
+_snapshot: Optional[CatalogSnapshot] = None
+_checked_at = 0.0
+_invalidated_generation = 0
+_clean_generation = 0
+
+_stock_lock = threading.Lock()
+_stock: Optional[StockLevels] = None
+
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'revalidations': 0,
+    'rebuilds': 0,
+    'last_rebuild_ms': 0.0,
+    'total_rebuild_ms': 0.0,
+    'stock_loads': 0,
+}
+
+
+def parse_photos(photos: Optional[str]) -> Tuple[str, ...]:
+    """Split comma-separated photo ids/urls"""
+    if not photos:
+        return ()
+    return tuple(p.strip() for p in photos.split(',') if p.strip())
+
+
+def parse_sizes(sizes: Optional[str]) -> Tuple[str, ...]:
+    """Parse sizes stored either as a JSON list or as comma-separated text"""
+    if not sizes:
+        return ()
+    try:
+        parsed = json.loads(sizes)
+        if isinstance(parsed, list):
+            return tuple(str(s).strip() for s in parsed if str(s).strip())
+    except (json.JSONDecodeError, TypeError):
+        pass
+    return tuple(s.strip() for s in sizes.split(',') if s.strip())
+
+
+def get_catalog_version(db: Session) -> Tuple[int, Optional[datetime]]:
+    """Read the current catalog version and the time it was last bumped"""
+    row = db.query(Settings.value, Settings.updated_at).filter(
+        Settings.key == CATALOG_VERSION_KEY
+    ).first()
+    if not row:
+        return 0, None
+    try:
+        return int(row.value), row.updated_at
+    except (TypeError, ValueError):
+        return 0, row.updated_at
+
+
+def bump_catalog_version(db: Session):
+    """Increment the catalog version inside the caller's transaction"""
+    result = db.execute(
+        update(Settings)
+        .where(Settings.key == CATALOG_VERSION_KEY)
+        .values(
+            value=cast(cast(Settings.value, Integer) + 1, Text),
+            updated_at=datetime.utcnow()
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.add(Settings(key=CATALOG_VERSION_KEY, value='1', updated_at=datetime.utcnow()))
+        db.flush()
+
+
+def invalidate():
+    """Mark the local snapshot stale; call after committing a catalog write"""
+    global _invalidated_generation
+    with _lock:
+        _invalidated_generation += 1
+
+
+def _is_fresh() -> bool:
+    return (
+        _snapshot is not None
+        and _clean_generation == _invalidated_generation
+        and time.monotonic() - _checked_at < config.CATALOG_CACHE_TTL
+    )
+
+
+def _build_snapshot(db: Session, version: int, updated_at: Optional[datetime]) -> CatalogSnapshot:
+    categories = db.query(Category).order_by(Category.position, Category.id).all()
+    products = db.query(Product).order_by(Product.position, Product.id).all()
+    variants = {}
+    for variant in db.query(ProductVariant.product_id, ProductVariant.size, ProductVariant.stock).order_by(
+        ProductVariant.product_id, ProductVariant.position, ProductVariant.id
+    ):
+        variants.setdefault(variant.product_id, {})[variant.size] = variant.stock
+
+    category_names = {cat.id: cat.name for cat in categories}
+    product_views = {}
+    by_category = {}
+    totals = {}
+    for prod in products:
+        size_stock = variants.get(prod.id, {})
+        view = ProductView(
+            id=prod.id,
+            category_id=prod.category_id,
+            category_name=category_names.get(prod.category_id),
+            name=prod.name,
+            description=prod.description,
+            price=prod.price,
+            stock=prod.stock,
+            brand=prod.brand,
+            sizes=prod.sizes,
+            size_stock=json.dumps(size_stock, ensure_ascii=False) if size_stock else None,
+            size_chart=prod.size_chart,
+            photos=prod.photos,
+            is_active=prod.is_active,
+            position=prod.position or 0,
+            photo_list=parse_photos(prod.photos),
+            size_list=tuple(size_stock) if size_stock else parse_sizes(prod.sizes),
+            size_stock_map=MappingProxyType(size_stock),
+        )
+        product_views[prod.id] = view
+        totals[prod.category_id] = totals.get(prod.category_id, 0) + 1
+        if prod.is_active:
+            by_category.setdefault(prod.category_id, []).append(view)
+
+    category_views = tuple(
+        CategoryView(
+            id=cat.id,
+            name=cat.name,
+            description=cat.description,
+            icon=cat.icon,
+            position=cat.position or 0,
+            is_active=cat.is_active,
+            product_count=totals.get(cat.id, 0),
+            active_product_count=len(by_category.get(cat.id, ())),
+        )
+        for cat in categories
+    )
+
+    return CatalogSnapshot(
+        version=version,
+        updated_at=updated_at,
+        built_at=time.time(),
+        categories=MappingProxyType({cat.id: cat for cat in category_views}),
+        ordered_categories=category_views,
+        products=MappingProxyType(product_views),
+        products_by_category=MappingProxyType({cid: tuple(items) for cid, items in by_category.items()}),
+        active_products=tuple(view for view in product_views.values() if view.is_active),
+        photo_ids=frozenset(photo for view in product_views.values() for photo in view.photo_list),
+    )
+
+
+def get_snapshot() -> CatalogSnapshot:
+    """Return the current catalog snapshot, revalidating or rebuilding if stale"""
+    global _snapshot, _checked_at, _clean_generation
+
+    if _is_fresh():
+        _stats['hits'] += 1
+        return _snapshot
+
+    with _lock:
+        if _is_fresh():
+            _stats['hits'] += 1
+            return _snapshot
+
+        from database.db import get_db
+
+        generation = _invalidated_generation
+        with get_db() as db:
+            version, updated_at = get_catalog_version(db)
+            if (
+                _snapshot is not None
+                and _clean_generation == generation
+                and _snapshot.version == version
+            ):
+                _checked_at = time.monotonic()
+                _stats['revalidations'] += 1
+                return _snapshot
+
+            _stats['misses'] += 1
+            started = time.perf_counter()
+            snapshot = _build_snapshot(db, version, updated_at)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+        _stats['rebuilds'] += 1
+        _stats['last_rebuild_ms'] = round(elapsed_ms, 2)
+        _stats['total_rebuild_ms'] = round(_stats['total_rebuild_ms'] + elapsed_ms, 2)
+        logger.info(
+            f"Catalog snapshot v{version} rebuilt in {elapsed_ms:.1f} ms "
+            f"({len(snapshot.products)} products, {len(snapshot.categories)} categories)"
+        )
+
+        _snapshot = snapshot
+        _checked_at = time.monotonic()
+        _clean_generation = generation
+        return snapshot
+
+
+def _load_stock(db: Session) -> StockLevels:
+    products = dict(db.query(Product.id, Product.stock).order_by(Product.id).all())
+    variants = {}
+    for variant in db.query(ProductVariant.product_id, ProductVariant.size, ProductVariant.stock).order_by(
+        ProductVariant.product_id, ProductVariant.position, ProductVariant.id
+    ):
+        variants.setdefault(variant.product_id, {})[variant.size] = variant.stock or 0
+
+    # Derived from the values, so every process agrees on it and it only
+    # changes when some stock level did
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(repr(sorted(products.items())).encode())
+    digest.update(repr(sorted((pid, tuple(sizes.items())) for pid, sizes in variants.items())).encode())
+    return StockLevels(
+        token=digest.hexdigest(),
+        loaded_at=time.monotonic(),
+        products=MappingProxyType({pid: stock or 0 for pid, stock in products.items()}),
+        variants=MappingProxyType({pid: MappingProxyType(sizes) for pid, sizes in variants.items()}),
+    )
+
+
+def _stock_is_fresh() -> bool:
+    return _stock is not None and time.monotonic() - _stock.loaded_at < config.CATALOG_STOCK_TTL
+
+
+def get_stock() -> StockLevels:
+    """Return current stock levels, at most CATALOG_STOCK_TTL seconds old"""
+    global _stock
+
+    if _stock_is_fresh():
+        return _stock
+
+    with _stock_lock:
+        if _stock_is_fresh():
+            return _stock
+
+        from database.db import get_db
+
+        with get_db() as db:
+            _stock = _load_stock(db)
+        _stats['stock_loads'] += 1
+        return _stock
+
+
+async def aget_stock() -> StockLevels:
+    """Asyncio-friendly get_stock: loads run in a worker thread"""
+    if _stock_is_fresh():
+        return _stock
+    return await asyncio.to_thread(get_stock)
+
+
+async def aget_snapshot() -> CatalogSnapshot:
+    """Asyncio-friendly get_snapshot: rebuilds run in a worker thread"""
+    if _is_fresh():
+        _stats['hits'] += 1
+        return _snapshot
+    return await asyncio.to_thread(get_snapshot)
+
+
+def get_stats() -> dict:
+    """Cache counters for monitoring"""
+    snapshot = _snapshot
+    return {
+        **_stats,
+        'version': snapshot.version if snapshot else None,
+        'stock_token': _stock.token if _stock else None,
+        'categories': len(snapshot.categories) if snapshot else 0,
+        'products': len(snapshot.products) if snapshot else 0,
+        'built_at': datetime.utcfromtimestamp(snapshot.built_at).isoformat() if snapshot else None,
+    }
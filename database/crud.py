@@ -1,16 +1,48 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_, desc
-from database.models import User, Category, Product, CartItem, Order, OrderItem, Settings
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import func, and_, or_, desc, case, update
+from database.models import User, Category, Product, ProductVariant, CartItem, Order, OrderItem, Settings
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Dict, List, Optional
 import json
 from utils.error_handler import db_error_handler
+from database import cart, catalog_cache, inventory, order_numbers, outbox, payments, reservations, stats
+from database.pagination import paginate
 import logging
 import time
 
 logger = logging.getLogger(__name__)
 SessionLocal = None  # Assuming SessionLocal is defined somewhere in your codebase
 
+# Named eager-loading profiles: each view loads its relationships in a
+# fixed number of round trips instead of one SELECT per row
+LOAD_PROFILES = {
+    'cart_with_products': (
+        joinedload(CartItem.product),
+    ),
+    'order_with_items': (
+        selectinload(Order.items),
+    ),
+    'order_with_user': (
+        joinedload(Order.user),
+    ),
+    'order_with_items_and_user': (
+        joinedload(Order.user),
+        selectinload(Order.items).joinedload(OrderItem.product),
+    ),
+    'product_with_category': (
+        joinedload(Product.category),
+        selectinload(Product.variants),
+    ),
+}
+
+
+def apply_profile(query, profile: str = None):
+    """Apply a named eager-loading profile to a query"""
+    if profile:
+        query = query.options(*LOAD_PROFILES[profile])
+    return query
+
+
 def transactional(func):
     """Decorator to ensure database operations are atomic with retry logic"""
     def wrapper(db: Session, *args, **kwargs):
@@ -53,6 +85,7 @@ def get_or_create_user(db: Session, telegram_id: int, username: str = None,
         )
         db.add(user)
         db.flush()
+        stats.record_new_user(db, user.created_at)
     else:
         user.last_activity = datetime.utcnow()
         if username:
@@ -64,6 +97,21 @@ def get_or_create_user(db: Session, telegram_id: int, username: str = None,
     return user
 
 
+@db_error_handler
+@transactional
+def touch_users(db: Session, last_activity: Dict[int, datetime]) -> int:
+    """Set last_activity for many users (keyed by user id) in one UPDATE"""
+    if not last_activity:
+        return 0
+    result = db.execute(
+        update(User)
+        .where(User.id.in_(list(last_activity)))
+        .values(last_activity=case(last_activity, value=User.id))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
 def get_user_by_telegram_id(db: Session, telegram_id: int) -> Optional[User]:
     return db.query(User).filter(User.telegram_id == telegram_id).first()
 
@@ -72,6 +120,11 @@ def get_all_users(db: Session, skip: int = 0, limit: int = 100) -> List[User]:
     return db.query(User).offset(skip).limit(limit).all()
 
 
+def get_users_page(db: Session, cursor: str = None, limit: int = 20):
+    """Newest users first, keyset-paginated on (created_at, id)"""
+    return paginate(db.query(User), [User.created_at, User.id], cursor, limit, descending=True)
+
+
 def update_user_theme(db: Session, telegram_id: int, theme: str):
     user = get_user_by_telegram_id(db, telegram_id)
     if user:
@@ -94,6 +147,22 @@ def get_total_users(db: Session) -> int:
     return db.query(func.count(User.id)).scalar()
 
 
+def get_user_order_stats(db: Session, user_ids: List[int]) -> dict:
+    """Order count and completed spend per user in a single GROUP BY query"""
+    if not user_ids:
+        return {}
+    rows = db.query(
+        Order.user_id,
+        func.count(Order.id).label('orders'),
+        func.sum(case((Order.status == 'completed', Order.total_amount), else_=0)).label('spent')
+    ).filter(Order.user_id.in_(user_ids)).group_by(Order.user_id).all()
+    
+    return {
+        row.user_id: {'orders': row.orders, 'spent': float(row.spent or 0)}
+        for row in rows
+    }
+
+
 def update_user_status(db: Session, user_id: int, is_active: bool):
     user = get_user(db, user_id)
     if user:
@@ -103,18 +172,49 @@ def update_user_status(db: Session, user_id: int, is_active: bool):
     return user
 
 
+def get_broadcast_recipients(db: Session, after_id: int = 0, limit: int = 500):
+    """Next batch of (id, telegram_id) rows of reachable users, keyset-paginated on id"""
+    return db.query(User.id, User.telegram_id).filter(
+        User.id > after_id,
+        User.is_active == True,
+        User.is_blocked.isnot(True)
+    ).order_by(User.id).limit(limit).all()
+
+
+def count_broadcast_recipients(db: Session) -> int:
+    return db.query(func.count(User.id)).filter(
+        User.is_active == True,
+        User.is_blocked.isnot(True)
+    ).scalar()
+
+
+def deactivate_users(db: Session, user_ids: List[int]) -> int:
+    """Mark users who blocked the bot as inactive with a single UPDATE"""
+    if not user_ids:
+        return 0
+    updated = db.query(User).filter(User.id.in_(user_ids)).update(
+        {User.is_active: False}, synchronize_session=False
+    )
+    db.commit()
+    return updated
+
+
 # Category CRUD
 @db_error_handler
-def create_category(db: Session, name: str, description: str = None, icon: str = None) -> Category:
+def create_category(db: Session, name: str, description: str = None, icon: str = None,
+                    is_active: bool = True) -> Category:
     max_position = db.query(func.max(Category.position)).scalar() or 0
     category = Category(
         name=name,
         description=description,
         icon=icon,
+        is_active=is_active,
         position=max_position + 1
     )
     db.add(category)
+    catalog_cache.bump_catalog_version(db)
     db.commit()
+    catalog_cache.invalidate()
     db.refresh(category)
     return category
 
@@ -136,7 +236,9 @@ def update_category(db: Session, category_id: int, **kwargs):
         for key, value in kwargs.items():
             if hasattr(category, key):
                 setattr(category, key, value)
+        catalog_cache.bump_catalog_version(db)
         db.commit()
+        catalog_cache.invalidate()
         db.refresh(category)
     return category
 
@@ -145,7 +247,9 @@ def delete_category(db: Session, category_id: int):
     category = get_category(db, category_id)
     if category:
         db.delete(category)
+        catalog_cache.bump_catalog_version(db)
         db.commit()
+        catalog_cache.invalidate()
         return True
     return False
 
@@ -158,11 +262,26 @@ def get_all_categories(db: Session) -> List[Category]:
     return db.query(Category).order_by(Category.position).all()
 
 
+def get_category_product_counts(db: Session) -> dict:
+    """Total and active product counts per category in a single GROUP BY query"""
+    rows = db.query(
+        Product.category_id,
+        func.count(Product.id).label('total'),
+        func.sum(case((Product.is_active == True, 1), else_=0)).label('active')
+    ).group_by(Product.category_id).all()
+    
+    return {
+        row.category_id: {'total': row.total, 'active': int(row.active or 0)}
+        for row in rows
+    }
+
+
 # Product CRUD
 @db_error_handler
 def create_product(db: Session, category_id: int, name: str, description: str,
                    price: float, stock: int = 0, sizes: str = None,
-                   photos: str = None, size_chart: str = None) -> Product:
+                   photos: str = None, size_chart: str = None,
+                   brand: str = None, size_stock: str = None) -> Product:
     """Create new product with photos as comma-separated string"""
     max_position = db.query(func.max(Product.position)).filter(
         Product.category_id == category_id
@@ -177,16 +296,23 @@ def create_product(db: Session, category_id: int, name: str, description: str,
         sizes=sizes,
         photos=photos,
         size_chart=size_chart,
+        brand=brand,
         position=max_position + 1
     )
+    size_stock = inventory.parse_size_stock(size_stock)
+    if size_stock:
+        inventory.set_size_stock(product, size_stock, catalog_cache.parse_sizes(sizes))
     db.add(product)
+    catalog_cache.bump_catalog_version(db)
     db.commit()
+    catalog_cache.invalidate()
     db.refresh(product)
     return product
 
 
-def get_products(db: Session, category_id: int = None, active_only: bool = True) -> List[Product]:
-    query = db.query(Product)
+def get_products(db: Session, category_id: int = None, active_only: bool = True,
+                 profile: str = None) -> List[Product]:
+    query = apply_profile(db.query(Product), profile)
     if category_id:
         query = query.filter(Product.category_id == category_id)
     if active_only:
@@ -194,8 +320,19 @@ def get_products(db: Session, category_id: int = None, active_only: bool = True)
     return query.order_by(Product.position).all()
 
 
-def get_product(db: Session, product_id: int) -> Optional[Product]:
-    return db.query(Product).filter(Product.id == product_id).first()
+def get_products_page(db: Session, category_id: int = None, active_only: bool = True,
+                      cursor: str = None, limit: int = 50, profile: str = None):
+    """Products in display order, keyset-paginated on (position, id)"""
+    query = apply_profile(db.query(Product), profile)
+    if category_id:
+        query = query.filter(Product.category_id == category_id)
+    if active_only:
+        query = query.filter(Product.is_active == True)
+    return paginate(query, [Product.position, Product.id], cursor, limit)
+
+
+def get_product(db: Session, product_id: int, profile: str = None) -> Optional[Product]:
+    return apply_profile(db.query(Product), profile).filter(Product.id == product_id).first()
 
 
 def update_product(db: Session, product_id: int, **kwargs):
@@ -205,10 +342,17 @@ def update_product(db: Session, product_id: int, **kwargs):
             if hasattr(product, key):
                 if key == 'sizes' and isinstance(value, list):
                     setattr(product, key, json.dumps(value))
+                elif key == 'size_stock':
+                    inventory.set_size_stock(
+                        product, inventory.parse_size_stock(value),
+                        catalog_cache.parse_sizes(kwargs.get('sizes', product.sizes))
+                    )
                 else:
                     setattr(product, key, value)
         product.updated_at = datetime.utcnow()
+        catalog_cache.bump_catalog_version(db)
         db.commit()
+        catalog_cache.invalidate()
         db.refresh(product)
     return product
 
@@ -217,7 +361,9 @@ def delete_product(db: Session, product_id: int):
     product = get_product(db, product_id)
     if product:
         db.delete(product)
+        catalog_cache.bump_catalog_version(db)
         db.commit()
+        catalog_cache.invalidate()
         return True
     return False
 
@@ -234,11 +380,15 @@ def add_to_cart(db: Session, user_id: int, product_id: int, quantity: int = 1, s
         )
     ).first()
     
+    new_quantity = (cart_item.quantity if cart_item else 0) + quantity
+    available = inventory.available_stock(db, product_id, size, lock=True)
+    if new_quantity > available:
+        product = db.query(Product.name).filter(Product.id == product_id).first()
+        raise inventory.InsufficientStockError([inventory.StockShortage(
+            product_id, product.name if product else None, new_quantity, available, size
+        )])
+    
     if cart_item:
-        new_quantity = cart_item.quantity + quantity
-        product = db.query(Product).filter(Product.id == product_id).with_for_update().first()
-        if new_quantity > product.stock:
-            raise ValueError("Insufficient stock")
         cart_item.quantity = new_quantity
     else:
         cart_item = CartItem(
@@ -253,8 +403,13 @@ def add_to_cart(db: Session, user_id: int, product_id: int, quantity: int = 1, s
     return cart_item
 
 
-def get_cart_items(db: Session, user_id: int) -> List[CartItem]:
-    return db.query(CartItem).filter(CartItem.user_id == user_id).all()
+def get_available_stock(db: Session, product_id: int, size: str = None) -> int:
+    """Quantity of a product (or one of its sizes) that can be added to a cart"""
+    return inventory.available_stock(db, product_id, size)
+
+
+def get_cart_items(db: Session, user_id: int, profile: str = None) -> List[CartItem]:
+    return apply_profile(db.query(CartItem), profile).filter(CartItem.user_id == user_id).all()
 
 
 def update_cart_item(db: Session, cart_item_id: int, quantity: int):
@@ -274,8 +429,8 @@ def clear_cart(db: Session, user_id: int):
     db.commit()
 
 
-def get_cart_item(db: Session, cart_item_id: int) -> Optional[CartItem]:
-    return db.query(CartItem).filter(CartItem.id == cart_item_id).first()
+def get_cart_item(db: Session, cart_item_id: int, profile: str = None) -> Optional[CartItem]:
+    return apply_profile(db.query(CartItem), profile).filter(CartItem.id == cart_item_id).first()
 
 
 def remove_cart_item(db: Session, cart_item_id: int):
@@ -287,62 +442,97 @@ def remove_cart_item(db: Session, cart_item_id: int):
     return False
 
 
+def get_cart_view(db: Session, telegram_id: int) -> cart.CartView:
+    """Cart lines with totals for a Telegram user, in one query"""
+    return cart.get_cart_view(db, telegram_id)
+
+
+def increase_cart_item(db: Session, telegram_id: int, cart_item_id: int) -> Optional[int]:
+    """+1 if stock allows; new quantity or None"""
+    quantity = cart.increase_item(db, telegram_id, cart_item_id)
+    db.commit()
+    return quantity
+
+
+def decrease_cart_item(db: Session, telegram_id: int, cart_item_id: int) -> Optional[int]:
+    """-1, removing the item at zero; new quantity or None if not in the user's cart"""
+    quantity = cart.decrease_item(db, telegram_id, cart_item_id)
+    db.commit()
+    return quantity
+
+
+def remove_user_cart_item(db: Session, telegram_id: int, cart_item_id: int) -> bool:
+    removed = cart.remove_item(db, telegram_id, cart_item_id)
+    db.commit()
+    return removed
+
+
+def clear_user_cart(db: Session, telegram_id: int) -> int:
+    removed = cart.clear(db, telegram_id)
+    db.commit()
+    return removed
+
+
 # Order CRUD
 @db_error_handler
 @transactional
 def create_order(db: Session, user_id: int, cart_items: List[CartItem],
                  phone: str = None, delivery_address: str = None, comment: str = None) -> Order:
-    """Create order from cart items with stock validation"""
-    for item in cart_items:
-        product = db.query(Product).filter(Product.id == item.product_id).with_for_update().first()
-        if not product or product.stock < item.quantity:
-            raise ValueError(f"Insufficient stock for {product.name if product else 'product'}")
-    
-    # Generate order number
-    order_count = db.query(func.count(Order.id)).scalar()
-    order_number = f"ORD-{datetime.utcnow().strftime('%Y%m%d')}-{order_count + 1:04d}"
+    """Create order from cart items; raises InsufficientStockError with every shortage"""
+    demand = inventory.aggregate_demand(
+        (item.product_id, item.size, item.quantity) for item in cart_items
+    )
+    inventory.reserve_stock(db, demand)
     
     # Calculate total
     total_amount = sum(item.product.price * item.quantity for item in cart_items)
     
     order = Order(
         user_id=user_id,
-        order_number=order_number,
+        order_number=order_numbers.next_order_number(db),
         total_amount=total_amount,
         phone=phone,
         delivery_address=delivery_address,
         comment=comment
     )
-    db.add(order)
-    db.flush()
-    
-    for cart_item in cart_items:
-        order_item = OrderItem(
-            order_id=order.id,
+    order.items = [
+        OrderItem(
             product_id=cart_item.product_id,
             product_name=cart_item.product.name,
             price=cart_item.product.price,
             quantity=cart_item.quantity,
             size=cart_item.size
         )
-        db.add(order_item)
-        
-        # Decrease stock
-        product = db.query(Product).filter(Product.id == cart_item.product_id).first()
-        product.stock -= cart_item.quantity
+        for cart_item in cart_items
+    ]
+    db.add(order)
+    db.flush()
+    reservations.reserve(db, order, demand)
     
+    # Stock changes do not bump the catalog version (see catalog_cache.get_stock)
+    stats.record_order_created(db, order)
     return order
 
 
-def get_orders(db: Session, user_id: int = None, skip: int = 0, limit: int = 100) -> List[Order]:
-    query = db.query(Order)
+def get_orders(db: Session, user_id: int = None, skip: int = 0, limit: int = 100,
+               profile: str = None) -> List[Order]:
+    query = apply_profile(db.query(Order), profile)
     if user_id:
         query = query.filter(Order.user_id == user_id)
     return query.order_by(desc(Order.created_at)).offset(skip).limit(limit).all()
 
 
-def get_order(db: Session, order_id: int) -> Optional[Order]:
-    return db.query(Order).filter(Order.id == order_id).first()
+def get_orders_page(db: Session, user_id: int = None, cursor: str = None, limit: int = 20,
+                    profile: str = None):
+    """Newest orders first, keyset-paginated on (created_at, id)"""
+    query = apply_profile(db.query(Order), profile)
+    if user_id:
+        query = query.filter(Order.user_id == user_id)
+    return paginate(query, [Order.created_at, Order.id], cursor, limit, descending=True)
+
+
+def get_order(db: Session, order_id: int, profile: str = None) -> Optional[Order]:
+    return apply_profile(db.query(Order), profile).filter(Order.id == order_id).first()
 
 
 def get_order_by_number(db: Session, order_number: str) -> Optional[Order]:
@@ -352,29 +542,99 @@ def get_order_by_number(db: Session, order_number: str) -> Optional[Order]:
 def update_order_status(db: Session, order_id: int, status: str, payment_id: str = None):
     order = get_order(db, order_id)
     if order:
+        old_status, old_payment_status = order.status, order.payment_status
         order.status = status
         if payment_id:
             order.payment_id = payment_id
         order.updated_at = datetime.utcnow()
+        reservations.settle(db, order, old_status)
+        stats.record_order_change(db, order, old_status, old_payment_status)
         db.commit()
         db.refresh(order)
     return order
 
 
+@db_error_handler
+@transactional
+def cancel_order(db: Session, order_id: int, user_id: int = None) -> Optional[Order]:
+    """Cancel an order (of user_id, if given) and release its stock; raises payments.OrderNotCancellable"""
+    order = db.query(Order).filter(Order.id == order_id).with_for_update().first()
+    if order:
+        payments.cancel_order(db, order, user_id)
+    return order
+
+
+@db_error_handler
+@transactional
+def attach_payment(db: Session, order_id: int, payment_id: str) -> bool:
+    """Record a created payment on a pending order; False if the order was cancelled or paid meanwhile"""
+    order = db.query(Order).filter(Order.id == order_id).with_for_update().first()
+    if order is None or order.status != 'pending' or order.payment_status == 'succeeded':
+        return False
+    order.payment_id = payment_id
+    order.payment_status = 'pending'
+    order.updated_at = datetime.utcnow()
+    return True
+
+
 def update_order_payment_status(db: Session, order_id: int, payment_status: str):
     order = get_order(db, order_id)
     if order:
-        order.payment_status = payment_status
-        if payment_status == 'succeeded':
-            order.status = 'paid'
-        order.updated_at = datetime.utcnow()
+        payments.set_payment_status(db, order, payment_status)
         db.commit()
         db.refresh(order)
     return order
 
 
-def get_recent_orders(db: Session, limit: int = 15) -> List[Order]:
-    return db.query(Order).order_by(desc(Order.created_at)).limit(limit).all()
+@db_error_handler
+@transactional
+def apply_payment_status(db: Session, payment: dict) -> Optional[Order]:
+    """Apply a fetched YooKassa payment to its order once; the order if it changed"""
+    return payments.apply_payment(db, payment)
+
+
+def get_pending_payments_page(db: Session, cursor: str = None, limit: int = 100):
+    """Keyset page of unpaid pending orders for the payment reconciler"""
+    return payments.pending_orders_page(db, cursor, limit)
+
+
+@db_error_handler
+@transactional
+def apply_payment_statuses(db: Session, fetched: List[dict]) -> List[int]:
+    """Apply a batch of fetched YooKassa payments in one transaction; IDs of changed orders"""
+    return [order.id for order in payments.apply_payments(db, fetched)]
+
+
+@db_error_handler
+@transactional
+def sweep_reservations(db: Session, now: datetime = None) -> List[int]:
+    """Cancel one batch of unpaid orders whose stock reservation expired; their IDs"""
+    return reservations.sweep(db, now=now)
+
+
+@transactional
+def claim_outbox_messages(db: Session, limit: int = 50) -> List[outbox.ClaimedMessage]:
+    return outbox.claim(db, limit=limit)
+
+
+def complete_outbox_messages(db: Session, message_ids: List[int]):
+    outbox.mark_processed(db, message_ids)
+    db.commit()
+
+
+def retry_outbox_message(db: Session, message_id: int, attempts: int):
+    outbox.retry_later(db, message_id, attempts)
+    db.commit()
+
+
+def purge_outbox(db: Session) -> int:
+    removed = outbox.purge(db)
+    db.commit()
+    return removed
+
+
+def get_recent_orders(db: Session, limit: int = 15, profile: str = None) -> List[Order]:
+    return apply_profile(db.query(Order), profile).order_by(desc(Order.created_at)).limit(limit).all()
 
 
 def get_orders_by_date_range(db: Session, start_date: datetime, end_date: datetime) -> List[Order]:
@@ -386,19 +646,9 @@ def get_orders_by_date_range(db: Session, start_date: datetime, end_date: dateti
     ).all()
 
 
-def get_top_products(db: Session, limit: int = 5):
-    results = db.query(
-        Product,
-        func.sum(OrderItem.quantity).label('total_sold')
-    ).join(
-        OrderItem, Product.id == OrderItem.product_id
-    ).join(
-        Order, OrderItem.order_id == Order.id
-    ).filter(
-        Order.status == 'completed'
-    ).group_by(Product.id).order_by(desc('total_sold')).limit(limit).all()
-    
-    return results
+def get_top_products(db: Session, limit: int = 5, days: int = None):
+    """Best sellers by units in completed orders, served from the daily rollup"""
+    return stats.get_top_products(db, limit=limit, days=days)
 
 
 def get_total_orders(db: Session) -> int:
@@ -417,37 +667,35 @@ def get_pending_orders_count(db: Session) -> int:
     ).scalar()
 
 
+# Settings
+def get_setting(db: Session, key: str, default: str = None) -> Optional[str]:
+    value = db.query(Settings.value).filter(Settings.key == key).scalar()
+    return value if value is not None else default
+
+
+def set_setting(db: Session, key: str, value: str):
+    setting = db.query(Settings).filter(Settings.key == key).first()
+    if setting:
+        setting.value = value
+    else:
+        db.add(Settings(key=key, value=value))
+    db.commit()
+
+
 # Statistics
+def get_sales_summary(db: Session, periods: dict = None) -> dict:
+    return stats.get_sales_summary(db, periods)
+
+
 def get_statistics(db: Session, days: int = 30):
-    start_date = datetime.utcnow() - timedelta(days=days)
-    
-    total_users = db.query(func.count(User.id)).scalar()
-    new_users = db.query(func.count(User.id)).filter(User.created_at >= start_date).scalar()
-    
-    total_orders = db.query(func.count(Order.id)).scalar()
-    period_orders = db.query(func.count(Order.id)).filter(Order.created_at >= start_date).scalar()
-    
-    total_revenue = db.query(func.sum(Order.total_amount)).filter(
-        Order.payment_status == 'succeeded'
-    ).scalar() or 0
-    
-    period_revenue = db.query(func.sum(Order.total_amount)).filter(
-        and_(
-            Order.created_at >= start_date,
-            Order.payment_status == 'succeeded'
-        )
-    ).scalar() or 0
-    
-    pending_orders = db.query(func.count(Order.id)).filter(
-        Order.status == 'pending'
-    ).scalar()
+    summary = stats.get_sales_summary(db, {'period': days})
     
     return {
-        'total_users': total_users,
-        'new_users': new_users,
-        'total_orders': total_orders,
-        'period_orders': period_orders,
-        'total_revenue': total_revenue,
-        'period_revenue': period_revenue,
-        'pending_orders': pending_orders
+        'total_users': summary['total_users'],
+        'new_users': summary['period']['new_users'],
+        'total_orders': summary['all']['orders_count'],
+        'period_orders': summary['period']['orders_count'],
+        'total_revenue': summary['all']['paid_revenue'],
+        'period_revenue': summary['period']['paid_revenue'],
+        'pending_orders': summary['pending_orders']
     }
@@ -1,36 +1,94 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, Session
-from contextlib import contextmanager
-from database.models import Base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional
 import config
+import os
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
-engine = create_engine(
-    config.DATABASE_URL,
-    echo=False,
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20,
-    pool_recycle=3600,
-    connect_args={
-        "connect_timeout": 10,
-        "options": "-c timezone=utc"
-    }
-)
+
+def get_engine_options(database_url: str) -> dict:
+    """create_engine options for the database the URL points to"""
+    options = {"echo": False, "pool_pre_ping": True}
+    if make_url(database_url).get_backend_name() == "postgresql":
+        options.update(
+            pool_size=10,
+            max_overflow=20,
+            pool_recycle=3600,
+            connect_args={
+                "connect_timeout": 10,
+                "options": "-c timezone=utc"
+            }
+        )
+    # SQLite (local runs, tests) keeps SQLAlchemy's own pool defaults
+    return options
+
+
+engine = create_engine(config.DATABASE_URL, **get_engine_options(config.DATABASE_URL))
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
 
 
+def get_async_database_url(database_url: str) -> str:
+    """Convert a sync DATABASE_URL into its asyncio driver equivalent"""
+    url = make_url(database_url)
+    if url.drivername in ("postgresql", "postgresql+psycopg2"):
+        # libpq-only query params are not understood by asyncpg
+        return url.set(drivername="postgresql+asyncpg", query={}).render_as_string(hide_password=False)
+    if url.drivername in ("sqlite", "sqlite+pysqlite"):
+        return url.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    return database_url
+
+
+ASYNC_DATABASE_URL = config.ASYNC_DATABASE_URL or get_async_database_url(config.DATABASE_URL)
+
+if ASYNC_DATABASE_URL.startswith("postgresql+asyncpg"):
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        echo=False,
+        pool_pre_ping=True,
+        pool_size=config.ASYNC_DB_POOL_SIZE,
+        max_overflow=config.ASYNC_DB_MAX_OVERFLOW,
+        pool_recycle=3600,
+        connect_args={
+            "timeout": 10,
+            "server_settings": {
+                "timezone": "utc",
+                "application_name": "telegram_shop_bot"
+            }
+        }
+    )
+else:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False)
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_REVISION = '0001'
+# pg_advisory_lock key serializing migrations between the bot and webapp containers
+MIGRATION_LOCK_KEY = 72_016_018
+
+
+class SchemaOutdated(RuntimeError):
+    """Database schema revision differs from the migrations head"""
+    pass
+
+
 def init_db(max_retries=5, retry_delay=2):
-    """Initialize database tables with retry logic"""
+    """Verify the schema revision with retry logic, migrating if DB_AUTO_MIGRATE is on"""
     for attempt in range(max_retries):
         try:
             logger.info(f"Attempting to connect to database (attempt {attempt + 1}/{max_retries})...")
-            Base.metadata.create_all(bind=engine)
+            _check_schema()
             logger.info("Database initialized successfully!")
             return
+        except SchemaOutdated:
+            raise
         except Exception as e:
             logger.warning(f"Database connection attempt {attempt + 1} failed: {e}")
             if attempt < max_retries - 1:
@@ -42,6 +100,72 @@ def init_db(max_retries=5, retry_delay=2):
                 raise
 
 
+def get_alembic_config(connection=None):
+    """Alembic Config for migrations/, optionally bound to an open connection"""
+    from alembic.config import Config
+    
+    alembic_config = Config(os.path.join(PROJECT_ROOT, 'alembic.ini'))
+    alembic_config.set_main_option('script_location', os.path.join(PROJECT_ROOT, 'migrations'))
+    if connection is not None:
+        alembic_config.attributes['connection'] = connection
+    return alembic_config
+
+
+def get_head_revision() -> str:
+    """Latest revision in migrations/versions (reads files, not the database)"""
+    from alembic.script import ScriptDirectory
+    
+    return ScriptDirectory.from_config(get_alembic_config()).get_current_head()
+
+
+def get_schema_revision(connection) -> Optional[str]:
+    """Revision recorded in alembic_version, None for unversioned databases"""
+    from alembic.runtime.migration import MigrationContext
+    
+    return MigrationContext.configure(connection).get_current_revision()
+
+
+def _check_schema():
+    """One SELECT on alembic_version instead of reflecting every table"""
+    head = get_head_revision()
+    with engine.connect() as conn:
+        current = get_schema_revision(conn)
+    if current == head:
+        logger.info(f"Database schema is at revision {head}")
+        return
+    
+    if not config.DB_AUTO_MIGRATE:
+        raise SchemaOutdated(
+            f"Database schema is at revision {current}, expected {head}; run 'alembic upgrade head'"
+        )
+    upgrade_schema()
+
+
+def upgrade_schema():
+    """Apply pending migrations; databases created by create_all are stamped with the baseline first"""
+    from alembic import command
+    
+    with engine.connect() as conn:
+        is_postgresql = conn.dialect.name == "postgresql"
+        if is_postgresql:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            alembic_config = get_alembic_config(conn)
+            if get_schema_revision(conn) is None and inspect(conn).has_table('users'):
+                logger.info(f"Stamping existing database with baseline revision {BASELINE_REVISION}")
+                conn.commit()
+                command.stamp(alembic_config, BASELINE_REVISION)
+            conn.commit()
+            
+            logger.info("Applying database migrations...")
+            command.upgrade(alembic_config, 'head')
+            conn.commit()
+        finally:
+            if is_postgresql:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                conn.commit()
+
+
 @contextmanager
 def get_db():
     """Get database session as context manager"""
@@ -56,6 +180,23 @@ def get_db():
         db.close()
 
 
+@asynccontextmanager
+async def get_async_db():
+    """Get asyncio database session as async context manager"""
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+
+async def dispose_async_engine():
+    """Close all pooled asyncio connections"""
+    await async_engine.dispose()
+
+
 def get_session() -> Session:
     """Get database session directly (must be closed manually)"""
     return SessionLocal()
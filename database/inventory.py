@@ -0,0 +1,276 @@
+"""
+Stock reservation for checkout.
+
+Stock is tracked per product and, for sized products, per ProductVariant
+(product_id, size). Product.stock stays the overall cap; whenever per-size
+stock is set it becomes the sum of the variants.
+
+All products of an order are locked with one SELECT ... FOR UPDATE ordered
+by id, then their variants with one SELECT ... FOR UPDATE ordered by
+(product_id, size), so concurrent checkouts always take row locks in the
+same order and cannot deadlock. Stock is then decremented with one
+conditional UPDATE (stock >= requested) per table that returns the new
+levels. A checkout costs at most four statements whatever the number of
+items, and every shortage is reported at once instead of failing on the
+first one.
+"""
+import json
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, select, update
+from sqlalchemy.orm import Session
+
+from database.models import Product, ProductVariant
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class StockShortage:
+    product_id: int
+    name: str
+    requested: int
+    available: int
+    size: Optional[str] = None
+
+
+class InsufficientStockError(ValueError):
+    """Raised when an order asks for more than is in stock"""
+
+    def __init__(self, shortages: List[StockShortage]):
+        self.shortages = shortages
+        super().__init__("Insufficient stock for " + ", ".join(
+            f"{s.name or s.product_id}{f' [{s.size}]' if s.size else ''} "
+            f"({s.requested} requested, {s.available} available)"
+            for s in shortages
+        ))
+
+
+def aggregate_demand(items: Iterable[Tuple[int, Optional[str], int]]) -> Dict[Tuple[int, Optional[str]], int]:
+    """Sum (product_id, size, quantity) triples per product and size"""
+    demand: Dict[Tuple[int, Optional[str]], int] = {}
+    for product_id, size, quantity in items:
+        demand[(product_id, size)] = demand.get((product_id, size), 0) + quantity
+    return demand
+
+
+def _decrement(db: Session, model, amounts: Dict[int, int]) -> Dict[int, int]:
+    """Conditionally subtract amounts (id -> quantity) in one UPDATE ... RETURNING"""
+    requested = case(amounts, value=model.id, else_=0)
+    return dict(db.execute(
+        update(model)
+        .where(model.id.in_(list(amounts)), model.stock >= requested)
+        .values(stock=model.stock - requested)
+        .returning(model.id, model.stock)
+        .execution_options(synchronize_session='fetch')
+    ).all())
+
+
+def reserve_stock(db: Session, demand: Dict[Tuple[int, Optional[str]], int]) -> Dict[int, int]:
+    """
+    Atomically decrement product and variant stock for an order
+
+    Args:
+        db: Database session; the caller commits or rolls back
+        demand: (product_id, size) -> quantity, size None for unsized items
+
+    Returns:
+        Dict[int, int]: product_id -> remaining stock
+
+    Raises:
+        InsufficientStockError: if any product is missing, inactive or short
+    """
+    if not demand:
+        return {}
+
+    product_demand: Dict[int, int] = {}
+    for (product_id, _), quantity in demand.items():
+        product_demand[product_id] = product_demand.get(product_id, 0) + quantity
+    product_ids = sorted(product_demand)
+
+    products = {row.id: row for row in db.execute(
+        select(Product.id, Product.name, Product.stock, Product.is_active)
+        .where(Product.id.in_(product_ids))
+        .order_by(Product.id)
+        .with_for_update()
+    ).all()}
+    variants = {(row.product_id, row.size): row for row in db.execute(
+        select(ProductVariant.id, ProductVariant.product_id, ProductVariant.size, ProductVariant.stock)
+        .where(ProductVariant.product_id.in_(product_ids))
+        .order_by(ProductVariant.product_id, ProductVariant.size)
+        .with_for_update()
+    ).all()}
+    sized_products = {product_id for product_id, _ in variants}
+
+    shortages = []
+    for product_id in product_ids:
+        row = products.get(product_id)
+        available = (row.stock or 0) if row is not None and row.is_active is not False else 0
+        if available < product_demand[product_id]:
+            name = row.name if row is not None else None
+            shortages.append(StockShortage(product_id, name, product_demand[product_id], available))
+    short_products = {shortage.product_id for shortage in shortages}
+
+    for (product_id, size), quantity in sorted(demand.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+        if size is None or product_id not in sized_products or product_id in short_products:
+            continue
+        variant = variants.get((product_id, size))
+        variant_available = variant.stock if variant is not None else 0
+        if variant_available < quantity:
+            shortages.append(StockShortage(product_id, products[product_id].name, quantity, variant_available, size))
+    if shortages:
+        raise InsufficientStockError(shortages)
+
+    variant_amounts = {
+        variants[key].id: quantity for key, quantity in demand.items() if key in variants
+    }
+    remaining = _decrement(db, Product, product_demand)
+    variants_left = _decrement(db, ProductVariant, variant_amounts) if variant_amounts else {}
+
+    # Only reachable where FOR UPDATE is a no-op (SQLite) and a concurrent
+    # writer got in between; the caller's rollback undoes the partial update
+    if len(remaining) != len(product_ids) or len(variants_left) != len(variant_amounts):
+        raise InsufficientStockError([
+            StockShortage(product_id, products[product_id].name, quantity,
+                          available_stock(db, product_id, size), size)
+            for (product_id, size), quantity in demand.items()
+            if product_id not in remaining
+            or ((product_id, size) in variants and variants[(product_id, size)].id not in variants_left)
+        ])
+    return remaining
+
+
+def release_stock(db: Session, demand: Dict[Tuple[int, Optional[str]], int]):
+    """
+    Give back stock taken by reserve_stock, e.g. for a cancelled order
+
+    Rows are locked in the same order as reserve_stock; products or sizes
+    that no longer exist are skipped.
+    """
+    if not demand:
+        return
+
+    product_demand: Dict[int, int] = {}
+    for (product_id, _), quantity in demand.items():
+        product_demand[product_id] = product_demand.get(product_id, 0) + quantity
+    product_ids = sorted(product_demand)
+
+    db.execute(select(Product.id).where(Product.id.in_(product_ids)).order_by(Product.id).with_for_update())
+    variant_ids = {(row.product_id, row.size): row.id for row in db.execute(
+        select(ProductVariant.id, ProductVariant.product_id, ProductVariant.size)
+        .where(ProductVariant.product_id.in_(product_ids))
+        .order_by(ProductVariant.product_id, ProductVariant.size)
+        .with_for_update()
+    ).all()}
+    variant_amounts = {
+        variant_ids[key]: quantity for key, quantity in demand.items() if key in variant_ids
+    }
+
+    for model, amounts in ((Product, product_demand), (ProductVariant, variant_amounts)):
+        if amounts:
+            db.execute(
+                update(model)
+                .where(model.id.in_(list(amounts)))
+                .values(stock=model.stock + case(amounts, value=model.id, else_=0))
+                .execution_options(synchronize_session='fetch')
+            )
+
+
+def available_stock(db: Session, product_id: int, size: str = None, lock: bool = False) -> int:
+    """
+    Stock that can be put into a cart for a product or one of its sizes
+
+    Args:
+        db: Database session
+        product_id: Product ID
+        size: Size for sized products
+        lock: Lock the product and variant rows until the caller commits
+
+    Returns:
+        int: Available quantity, 0 for missing or inactive products
+    """
+    product_query = select(Product.stock, Product.is_active).where(Product.id == product_id)
+    product = db.execute(product_query.with_for_update() if lock else product_query).first()
+    if product is None or product.is_active is False:
+        return 0
+    if size is None:
+        return product.stock or 0
+
+    variant_query = select(ProductVariant.size, ProductVariant.stock).where(
+        ProductVariant.product_id == product_id
+    ).order_by(ProductVariant.size)
+    variants = dict(db.execute(variant_query.with_for_update() if lock else variant_query).all())
+    if not variants:
+        # Sizes without per-size stock share the product's stock
+        return product.stock or 0
+    return min(product.stock or 0, variants.get(size, 0))
+
+
+def parse_size_stock(value) -> Dict[str, int]:
+    """Per-size stock from a dict or its JSON text; invalid entries are dropped"""
+    if not value:
+        return {}
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except (json.JSONDecodeError, TypeError):
+            return {}
+    if not isinstance(value, dict):
+        return {}
+
+    size_stock = {}
+    for size, stock in value.items():
+        size = str(size).strip()[:10]
+        try:
+            size_stock[size] = max(0, int(stock))
+        except (TypeError, ValueError):
+            continue
+    size_stock.pop('', None)
+    return size_stock
+
+
+def set_size_stock(product: Product, size_stock: Dict[str, int], sizes: Sequence[str] = (),
+                   update_total: bool = True):
+    """Replace a product's variants; sizes gives the display order"""
+    ordered = [size for size in sizes if size in size_stock]
+    ordered += [size for size in size_stock if size not in ordered]
+    existing = {variant.size: variant for variant in product.variants}
+
+    variants = []
+    for position, size in enumerate(ordered):
+        variant = existing.get(size) or ProductVariant(size=size)
+        variant.stock = size_stock[size]
+        variant.position = position
+        variants.append(variant)
+    product.variants = variants
+    product.size_stock = None
+    if variants and update_total:
+        product.stock = sum(variant.stock for variant in variants)
+
+
+def size_stock_json(product) -> Optional[str]:
+    """Per-size stock of a product as the JSON text the API has always returned"""
+    if not product.variants:
+        return None
+    return json.dumps({variant.size: variant.stock for variant in product.variants}, ensure_ascii=False)
+
+
+def convert_size_stock(db: Session) -> int:
+    """Move legacy JSON size_stock values into product_variants; returns products converted"""
+    from database.catalog_cache import parse_sizes
+
+    converted = 0
+    for product in db.query(Product).filter(Product.size_stock.isnot(None), Product.size_stock != ''):
+        size_stock = parse_size_stock(product.size_stock)
+        if product.variants or not size_stock:
+            product.size_stock = None
+            continue
+        # Keep the existing total: it still caps the sum of the sizes
+        set_size_stock(product, size_stock, parse_sizes(product.sizes), update_total=False)
+        converted += 1
+    db.flush()
+    if converted:
+        logger.info(f"Converted size_stock of {converted} products into variants")
+    return converted
@@ -1,9 +1,16 @@
-from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, DateTime, ForeignKey, Text, Index
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, Date, DateTime, ForeignKey, Text, Index, Sequence, text
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime
 
 Base = declarative_base()
 
+# Full-text document for product search (PostgreSQL only). Kept as literal SQL
+# so the expression index and search queries render identically.
+PRODUCT_SEARCH_VECTOR_SQL = (
+    "to_tsvector('russian'::regconfig, coalesce(name, '') || ' ' || coalesce(description, '')) || "
+    "to_tsvector('simple'::regconfig, coalesce(name, '') || ' ' || coalesce(description, ''))"
+)
+
 
 class User(Base):
     __tablename__ = 'users'
@@ -26,6 +33,7 @@ class User(Base):
     __table_args__ = (
         Index('idx_user_active_created', 'is_active', 'created_at'),
         Index('idx_user_telegram_active', 'telegram_id', 'is_active'),
+        Index('idx_user_created_id', 'created_at', 'id'),
     )
 
 
@@ -59,7 +67,7 @@ class Product(Base):
     stock = Column(Integer, default=0, index=True)
     brand = Column(String(255))
     sizes = Column(String(255))
-    size_stock = Column(Text)  # JSON: {"S": 10, "M": 15, "L": 5}
+    size_stock = Column(Text)  # Legacy JSON {"S": 10, ...}; converted into product_variants
     size_chart = Column(Text)
     is_active = Column(Boolean, default=True, index=True)
     position = Column(Integer, default=0)
@@ -69,11 +77,40 @@ class Product(Base):
     category = relationship('Category', back_populates='products')
     cart_items = relationship('CartItem', back_populates='product', cascade='all, delete-orphan')
     order_items = relationship('OrderItem', back_populates='product')
+    variants = relationship(
+        'ProductVariant', back_populates='product', cascade='all, delete-orphan',
+        order_by='ProductVariant.position'
+    )
     
     __table_args__ = (
         Index('idx_product_category_active', 'category_id', 'is_active', 'position'),
         Index('idx_product_active_price', 'is_active', 'price'),
         Index('idx_product_active_stock', 'is_active', 'stock'),
+        Index(
+            'idx_product_search_vector', text(f"({PRODUCT_SEARCH_VECTOR_SQL})"),
+            postgresql_using='gin'
+        ).ddl_if(dialect='postgresql'),
+        Index(
+            'idx_product_name_trgm', 'name',
+            postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
+    )
+
+
+class ProductVariant(Base):
+    __tablename__ = 'product_variants'
+    
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    size = Column(String(10), nullable=False)
+    stock = Column(Integer, default=0, nullable=False)
+    position = Column(Integer, default=0)
+    
+    product = relationship('Product', back_populates='variants')
+    
+    __table_args__ = (
+        Index('idx_variant_product_size', 'product_id', 'size', unique=True),
+        Index('idx_variant_product_stock', 'product_id', 'stock'),
     )
 
 
@@ -95,6 +132,10 @@ class CartItem(Base):
     )
 
 
+# Source of order numbers on databases with sequences (PostgreSQL); ignored elsewhere
+order_number_seq = Sequence('order_number_seq', metadata=Base.metadata)
+
+
 class Order(Base):
     __tablename__ = 'orders'
     
@@ -118,6 +159,8 @@ class Order(Base):
         Index('idx_order_user_created', 'user_id', 'created_at'),
         Index('idx_order_status_created', 'status', 'created_at'),
         Index('idx_order_payment_status', 'payment_status', 'created_at'),
+        Index('idx_order_created_id', 'created_at', 'id'),
+        Index('idx_order_user_created_id', 'user_id', 'created_at', 'id'),
     )
 
 
@@ -143,3 +186,85 @@ class Settings(Base):
     key = Column(String(255), unique=True, nullable=False, index=True)
     value = Column(Text)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DailySalesStats(Base):
+    """Per-day rollup of orders, revenue and sign-ups, maintained by database.stats"""
+    __tablename__ = 'daily_sales_stats'
+    
+    day = Column(Date, primary_key=True)
+    orders_count = Column(Integer, nullable=False, default=0)
+    completed_orders = Column(Integer, nullable=False, default=0)
+    completed_revenue = Column(Float, nullable=False, default=0)
+    paid_orders = Column(Integer, nullable=False, default=0)
+    paid_revenue = Column(Float, nullable=False, default=0)
+    units_sold = Column(Integer, nullable=False, default=0)
+    new_users = Column(Integer, nullable=False, default=0)
+
+
+class DailyProductSales(Base):
+    """Per-day, per-product units sold in completed orders"""
+    __tablename__ = 'daily_product_sales'
+    
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    product_name = Column(String(255), nullable=False)
+    units_sold = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index('idx_daily_product_sales_product', 'product_id', 'day'),
+    )
+
+
+class RateLimitCounter(Base):
+    """Fixed-window hit counters for the SQL rate-limit backend (utils.storage)"""
+    __tablename__ = 'rate_limit_counters'
+    
+    key = Column(String(255), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class FSMRecord(Base):
+    """aiogram FSM state and data for the SQL storage backend (utils.storage)"""
+    __tablename__ = 'fsm_records'
+    
+    key = Column(String(255), primary_key=True)
+    state = Column(String(255))
+    data = Column(Text)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class OutboxMessage(Base):
+    """Side effects committed with the change that caused them, delivered by the bot (database.outbox)"""
+    __tablename__ = 'outbox'
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = Column(DateTime)
+    
+    __table_args__ = (
+        Index('idx_outbox_pending', 'processed_at', 'available_at'),
+    )
+
+
+class StockReservation(Base):
+    """Stock held by an unpaid order until it is paid, cancelled or expires (database.reservations)"""
+    __tablename__ = 'stock_reservations'
+    
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey('orders.id', ondelete='CASCADE'), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='SET NULL'))
+    size = Column(String(10))
+    quantity = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    
+    __table_args__ = (
+        Index('idx_reservation_expires', 'expires_at'),
+    )
@@ -0,0 +1,107 @@
+"""
+Order number generation.
+
+Numbers look like ORD-YYYYMMDD-<suffix> and are produced without touching
+the orders table:
+
+- PostgreSQL: the suffix is nextval('order_number_seq'), unique across all
+  processes and days, zero-padded to four digits.
+- Other databases: the suffix is a fixed-width, time-sortable base36 id made
+  of milliseconds since midnight, a random per-process node and a per-
+  millisecond counter, so numbers from one process never repeat and numbers
+  from different processes collide only if they draw the same node in the
+  same millisecond.
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database.models import order_number_seq
+
+NODE_BITS = 16
+COUNTER_BITS = 10
+SUFFIX_WIDTH = 11  # base36 digits for 27 bits of ms-of-day + node + counter
+
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def _to_base36(number: int, width: int) -> str:
+    digits = []
+    while number:
+        number, rem = divmod(number, 36)
+        digits.append(_DIGITS[rem])
+    return ''.join(reversed(digits)).rjust(width, '0')
+
+
+class TimeSortableIds:
+    """Thread-safe generator of (day, suffix) pairs unique within the process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._node = 0
+        self._last_ms = -1
+        self._counter = 0
+
+    def next(self, now: Optional[datetime] = None) -> tuple:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Fresh node after fork so gunicorn workers don't share one
+                self._pid = os.getpid()
+                self._node = random.getrandbits(NODE_BITS)
+
+            while True:
+                moment = now or datetime.utcnow()
+                ms = ((moment.hour * 60 + moment.minute) * 60 + moment.second) * 1000 + moment.microsecond // 1000
+                if ms != self._last_ms:
+                    self._last_ms, self._counter = ms, 0
+                    break
+                if self._counter < (1 << COUNTER_BITS) - 1:
+                    self._counter += 1
+                    break
+                if now is not None:
+                    raise OverflowError("Order number counter exhausted for this millisecond")
+                time.sleep(0.0005)
+
+            value = (((ms << NODE_BITS) | self._node) << COUNTER_BITS) | self._counter
+            return moment.strftime('%Y%m%d'), _to_base36(value, SUFFIX_WIDTH)
+
+
+_time_ids = TimeSortableIds()
+
+
+def next_order_number(db: Session, now: datetime = None) -> str:
+    """
+    Allocate a unique order number in O(1)
+
+    Args:
+        db: Database session
+        now: Order time (UTC), defaults to now
+
+    Returns:
+        str: ORD-YYYYMMDD-<suffix>
+    """
+    if db.get_bind().dialect.supports_sequences:
+        number = db.execute(order_number_seq.next_value()).scalar()
+        return f"ORD-{(now or datetime.utcnow()).strftime('%Y%m%d')}-{number:04d}"
+
+    day, suffix = _time_ids.next(now)
+    return f"ORD-{day}-{suffix}"
+
+
+def sync_sequence(db: Session):
+    """Move a new sequence past numbers issued by the old COUNT(*) scheme"""
+    if not db.get_bind().dialect.supports_sequences:
+        return
+    # Old numbers were count(orders) + 1, which never exceeds max(id) + 1
+    db.execute(text(
+        "SELECT setval('order_number_seq', floor_value, false) FROM ("
+        "SELECT coalesce(max(id), 0) + 1 AS floor_value FROM orders) AS f "
+        "WHERE (SELECT last_value FROM order_number_seq) < floor_value"
+    ))
@@ -0,0 +1,84 @@
+"""
+Transactional outbox.
+
+A message is inserted in the same transaction as the change it reports
+(e.g. an order becoming paid), so it exists if and only if that change was
+committed, whichever process made it. The bot claims due messages in
+batches and delivers them: claiming leases a message for LEASE_SECONDS by
+pushing its available_at forward, so a crashed deliverer's messages are
+picked up again after the lease and delivery is at-least-once. On
+PostgreSQL concurrent claimers skip each other's rows (SKIP LOCKED).
+"""
+import json
+from datetime import datetime, timedelta
+from typing import List, NamedTuple
+
+from sqlalchemy import delete, update
+from sqlalchemy.orm import Session
+
+from database.models import OutboxMessage
+
+LEASE_SECONDS = 60
+MAX_ATTEMPTS = 10
+
+
+class ClaimedMessage(NamedTuple):
+    id: int
+    kind: str
+    payload: dict
+    attempts: int
+
+
+def enqueue(db: Session, kind: str, payload: dict):
+    """Add a message inside the caller's transaction"""
+    db.add(OutboxMessage(kind=kind, payload=json.dumps(payload)))
+
+
+def claim(db: Session, limit: int = 50, now: datetime = None) -> List[ClaimedMessage]:
+    """Lease up to limit due messages; the caller commits"""
+    now = now or datetime.utcnow()
+    rows = db.query(OutboxMessage).filter(
+        OutboxMessage.processed_at.is_(None),
+        OutboxMessage.available_at <= now,
+        OutboxMessage.attempts < MAX_ATTEMPTS
+    ).order_by(OutboxMessage.id).limit(limit).with_for_update(skip_locked=True).all()
+
+    lease_until = now + timedelta(seconds=LEASE_SECONDS)
+    claimed = []
+    for row in rows:
+        row.attempts += 1
+        row.available_at = lease_until
+        claimed.append(ClaimedMessage(row.id, row.kind, json.loads(row.payload), row.attempts))
+    return claimed
+
+
+def mark_processed(db: Session, message_ids: List[int], now: datetime = None):
+    if not message_ids:
+        return
+    db.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(message_ids))
+        .values(processed_at=now or datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def retry_later(db: Session, message_id: int, attempts: int, now: datetime = None):
+    """Reschedule a failed delivery with exponential backoff (capped at one hour)"""
+    delay = min(2 ** attempts * 5, 3600)
+    db.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id == message_id)
+        .values(available_at=(now or datetime.utcnow()) + timedelta(seconds=delay))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def purge(db: Session, older_than: timedelta = timedelta(days=7), now: datetime = None) -> int:
+    """Delete messages delivered before now - older_than"""
+    result = db.execute(
+        delete(OutboxMessage)
+        .where(OutboxMessage.processed_at < (now or datetime.utcnow()) - older_than)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
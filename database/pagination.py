@@ -0,0 +1,96 @@
+"""
+Keyset (cursor) pagination helpers.
+
+A page is fetched with WHERE (col1, col2) > (last1, last2) ORDER BY col1, col2
+instead of OFFSET, so page N costs the same as page 1. Cursors are short
+opaque strings that fit into Telegram callback_data (64 bytes).
+"""
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+
+_EPOCH = datetime(1970, 1, 1)
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+    pass
+
+
+def _to_base36(number: int) -> str:
+    if number < 0:
+        return '-' + _to_base36(-number)
+    if number == 0:
+        return '0'
+    digits = []
+    while number:
+        number, rem = divmod(number, 36)
+        digits.append(_DIGITS[rem])
+    return ''.join(reversed(digits))
+
+
+def encode_cursor(*values) -> str:
+    """Encode datetime/int key values into an opaque cursor"""
+    tokens = []
+    for value in values:
+        if isinstance(value, datetime):
+            micros = (value - _EPOCH) // timedelta(microseconds=1)
+            tokens.append('d' + _to_base36(micros))
+        elif isinstance(value, int):
+            tokens.append('i' + _to_base36(value))
+        else:
+            raise TypeError(f"Unsupported cursor value type: {type(value).__name__}")
+    return '.'.join(tokens)
+
+
+def decode_cursor(cursor: str) -> Tuple:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        values = []
+        for token in cursor.split('.'):
+            kind, body = token[0], token[1:]
+            if kind == 'd':
+                values.append(_EPOCH + timedelta(microseconds=int(body, 36)))
+            elif kind == 'i':
+                values.append(int(body, 36))
+            else:
+                raise ValueError(f"unknown token type {kind!r}")
+        return tuple(values)
+    except (ValueError, IndexError, OverflowError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+
+
+def paginate(query, columns: Sequence, cursor: Optional[str] = None,
+             limit: int = 20, descending: bool = False) -> Tuple[List, Optional[str]]:
+    """
+    Fetch one keyset page
+
+    Args:
+        query: ORM query over a single entity
+        columns: Ordering columns; the last one must be unique (usually id)
+        cursor: Cursor returned with the previous page
+        limit: Page size
+        descending: Order newest/largest first
+
+    Returns:
+        (items, next_cursor) where next_cursor is None on the last page
+    """
+    key = tuple_(*columns)
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(columns):
+            raise InvalidCursor(f"Invalid cursor: {cursor!r}")
+        bound = tuple_(*values)
+        query = query.filter(key < bound if descending else key > bound)
+
+    order = [col.desc() if descending else col.asc() for col in columns]
+    items = query.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(*(getattr(last, col.key) for col in columns))
+    return items, next_cursor
@@ -0,0 +1,166 @@
+"""
+Order payment status transitions.
+
+Payment results arrive from several places (YooKassa webhooks, the
+"check payment" button, the reconciler), possibly more than once and out
+of order. apply_payment() turns a payment object fetched from YooKassa
+into at most one transition per order: the order row is locked, repeats
+and updates after a final status are ignored, the order's stock
+reservation is settled (see database.reservations) and the admin
+notification is queued in the outbox in the same transaction.
+
+An order paid after it was cancelled takes its stock again; if that stock
+is gone it stays cancelled with payment_status 'succeeded' (needs_refund)
+and admins are asked to refund it. An order cannot be cancelled while a
+started payment is pending, since YooKassa cannot cancel such a payment
+and the user may still complete it.
+"""
+import logging
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from database import outbox, reservations, stats
+from database.models import Order
+from database.pagination import paginate
+
+logger = logging.getLogger(__name__)
+
+FINAL_PAYMENT_STATUSES = ('succeeded', 'canceled')
+ORDER_PAID_EVENT = 'order_paid'
+ORDER_REFUND_EVENT = 'order_refund_required'
+
+
+class OrderNotCancellable(ValueError):
+    """Raised when an order cannot be cancelled; the message is shown to the user"""
+    pass
+
+
+def needs_refund(order: Order) -> bool:
+    """Paid after being cancelled, with its stock no longer available"""
+    return order.status == 'cancelled' and order.payment_status == 'succeeded'
+
+
+def cancel_order(db: Session, order: Order, user_id: int = None):
+    """
+    Cancel a locked order and release its stock
+
+    Args:
+        order: Order locked by the caller (SELECT ... FOR UPDATE)
+        user_id: Owner required for a cancel requested by a customer, who
+            may only cancel pending orders
+
+    Raises:
+        OrderNotCancellable: if the order may not be cancelled now
+    """
+    if user_id is not None:
+        if order.user_id != user_id:
+            raise OrderNotCancellable("Это не ваш заказ")
+        if order.status != 'pending':
+            raise OrderNotCancellable("Этот заказ нельзя отменить")
+    if order.status == 'cancelled':
+        raise OrderNotCancellable("Заказ уже отменен")
+    if order.payment_id and order.payment_status == 'pending':
+        raise OrderNotCancellable("По заказу начата оплата. Дождитесь ее завершения или отмены платежа")
+
+    old_status, old_payment_status = order.status, order.payment_status
+    order.status = 'cancelled'
+    order.updated_at = datetime.utcnow()
+    reservations.settle(db, order, old_status)
+    stats.record_order_change(db, order, old_status, old_payment_status)
+
+
+def set_payment_status(db: Session, order: Order, payment_status: str):
+    """Change an order's payment status (and the order status it implies)"""
+    old_status, old_payment_status = order.status, order.payment_status
+    order.payment_status = payment_status
+    if payment_status == 'succeeded':
+        # A cancelled order's stock was released and may have been sold since
+        if order.status != 'cancelled' or reservations.restore(db, order):
+            order.status = 'paid'
+    elif payment_status == 'canceled' and order.status == 'pending':
+        order.status = 'cancelled'
+    order.updated_at = datetime.utcnow()
+    reservations.settle(db, order, old_status)
+    stats.record_order_change(db, order, old_status, old_payment_status)
+
+
+def _find_order(db: Session, payment: dict) -> Optional[Order]:
+    order = db.query(Order).filter(Order.payment_id == payment['id']).with_for_update().first()
+    if order is not None:
+        return order
+    # The order may point to a newer payment when the user pressed "pay" again
+    try:
+        order_id = int(payment.get('metadata', {}).get('order_id'))
+    except (TypeError, ValueError):
+        return None
+    return db.query(Order).filter(Order.id == order_id).with_for_update().first()
+
+
+def apply_payment(db: Session, payment: dict) -> Optional[Order]:
+    """
+    Apply a YooKassa payment status to its order
+
+    Args:
+        payment: Payment as returned by check_payment_status, fetched from
+            YooKassa rather than taken from an unverified notification
+
+    Returns:
+        Optional[Order]: The order if its status changed, None otherwise
+    """
+    order = _find_order(db, payment)
+    if order is None:
+        logger.warning(f"Payment {payment['id']} does not match any order")
+        return None
+
+    status = payment['status']
+    if order.payment_status == status or order.payment_status in FINAL_PAYMENT_STATUSES:
+        return None
+
+    if status == 'succeeded':
+        if not payment.get('paid') or abs(payment['amount'] - order.total_amount) >= 0.01:
+            logger.error(
+                f"Payment {payment['id']} of {payment['amount']} does not settle "
+                f"order {order.id} of {order.total_amount}"
+            )
+            return None
+        if order.payment_id != payment['id']:
+            logger.info(f"Order {order.id} paid by earlier payment {payment['id']}")
+            order.payment_id = payment['id']
+    elif status == 'canceled' and order.payment_id != payment['id']:
+        # A superseded payment expired; the order waits for its current one
+        return None
+
+    set_payment_status(db, order, status)
+    if status == 'succeeded':
+        event = ORDER_REFUND_EVENT if needs_refund(order) else ORDER_PAID_EVENT
+        outbox.enqueue(db, event, {'order_id': order.id})
+    return order
+
+
+def apply_payments(db: Session, payments: Iterable[dict]) -> List[Order]:
+    """apply_payment for a batch in the caller's transaction; the changed orders"""
+    changed = []
+    for payment in payments:
+        order = apply_payment(db, payment)
+        if order is not None:
+            changed.append(order)
+    return changed
+
+
+def pending_orders_page(db: Session, cursor: str = None, limit: int = 100):
+    """
+    One page of pending orders waiting for a started payment, oldest first
+
+    Returns:
+        (rows of (id, payment_id, created_at), next_cursor), keyset-paginated
+        on (created_at, id)
+    """
+    query = db.query(Order.id, Order.payment_id, Order.created_at).filter(
+        Order.payment_status == 'pending',
+        Order.status == 'pending',
+        Order.payment_id.isnot(None)
+    )
+    return paginate(query, [Order.created_at, Order.id], cursor, limit)
+
@@ -0,0 +1,186 @@
+"""
+Stock reservations of unpaid orders.
+
+create_order takes stock out of products and variants right away
+(inventory.reserve_stock) and records what it took in stock_reservations,
+one row per (product, size) with an expiry. The rows are the order's hold
+on that stock and end when the order leaves 'pending' (settle()):
+
+- cancelled (by the user, an admin, or because its payment was
+  cancelled): the quantities go back to stock; restore() takes them again
+  if a cancelled order is paid after all;
+- any other status (paid, completed, ...): the stock stays sold;
+- still pending and no payment started by expires_at: sweep() cancels the
+  order and gives the stock back.
+
+Orders that started a payment are not swept; YooKassa settles or cancels
+the payment and the payment reconciler applies the result. Rows are
+removed with DELETE ... RETURNING, so two concurrent releases of one order
+cannot return its stock twice. Orders without rows (already settled, or
+paid before reservations existed) release nothing.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+from database import inventory
+from database.models import Order, OrderItem, StockReservation
+import config
+
+logger = logging.getLogger(__name__)
+
+SWEEP_BATCH = 500
+
+
+def _expires_at(now: datetime = None) -> datetime:
+    return (now or datetime.utcnow()) + timedelta(minutes=config.STOCK_RESERVATION_MINUTES)
+
+
+def reserve(db: Session, order: Order, demand: Dict[Tuple[int, Optional[str]], int], now: datetime = None):
+    """Record the stock just taken for a flushed order"""
+    created_at = now or datetime.utcnow()
+    db.add_all([
+        StockReservation(
+            order_id=order.id,
+            product_id=product_id,
+            size=size,
+            quantity=quantity,
+            created_at=created_at,
+            expires_at=_expires_at(created_at)
+        )
+        for (product_id, size), quantity in demand.items()
+    ])
+
+
+def consume(db: Session, order_ids: List[int]):
+    """Drop reservations whose stock has been sold"""
+    db.execute(
+        delete(StockReservation)
+        .where(StockReservation.order_id.in_(order_ids))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def release(db: Session, order_ids: List[int]) -> int:
+    """
+    Drop reservations and give their stock back
+
+    Returns:
+        int: Number of units returned to stock
+    """
+    rows = db.execute(
+        delete(StockReservation)
+        .where(StockReservation.order_id.in_(order_ids))
+        .returning(StockReservation.product_id, StockReservation.size, StockReservation.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    demand = inventory.aggregate_demand(row for row in rows if row.product_id is not None)
+    if not demand:
+        return 0
+    inventory.release_stock(db, demand)
+    return sum(demand.values())
+
+
+def settle(db: Session, order: Order, old_status: str):
+    """End the order's reservation if its status change took it out of 'pending'"""
+    if order.status == old_status or old_status != 'pending':
+        return
+    if order.status == 'cancelled':
+        release(db, [order.id])
+    else:
+        consume(db, [order.id])
+
+
+def restore(db: Session, order: Order) -> bool:
+    """
+    Take the stock of a cancelled order again, e.g. when it is paid after all
+
+    Returns:
+        bool: True if all of it was available; otherwise nothing is taken
+    """
+    if any(item.product_id is None for item in order.items):
+        logger.warning(f"Order {order.id} has deleted products; its stock cannot be restored")
+        return False
+    demand = inventory.aggregate_demand((item.product_id, item.size, item.quantity) for item in order.items)
+    try:
+        # The savepoint undoes a partial decrement (see inventory.reserve_stock)
+        with db.begin_nested():
+            inventory.reserve_stock(db, demand)
+    except inventory.InsufficientStockError as e:
+        logger.warning(f"Order {order.id} cannot take its stock again: {e}")
+        return False
+    return True
+
+
+def sweep(db: Session, now: datetime = None, limit: int = SWEEP_BATCH) -> List[int]:
+    """
+    Cancel up to limit pending orders whose reservation expired and release their stock
+
+    Orders are locked with SKIP LOCKED (on PostgreSQL), so concurrent
+    sweepers and checkouts do not wait on each other. Whatever the batch
+    size this costs one SELECT, one DELETE, the release_stock statements
+    and one UPDATE of the orders; the caller commits.
+
+    Args:
+        now: Reference time (UTC), defaults to now
+
+    Returns:
+        List[int]: IDs of the cancelled orders
+    """
+    now = now or datetime.utcnow()
+    expired = select(StockReservation.order_id).where(StockReservation.expires_at <= now)
+    order_ids = list(db.execute(
+        select(Order.id)
+        .where(
+            Order.id.in_(expired),
+            Order.status == 'pending',
+            Order.payment_status == 'pending',
+            Order.payment_id.is_(None)
+        )
+        .order_by(Order.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).scalars())
+    if not order_ids:
+        return []
+
+    release(db, order_ids)
+    # pending -> cancelled of an unpaid order changes no sales rollup
+    db.execute(
+        update(Order)
+        .where(Order.id.in_(order_ids))
+        .values(status='cancelled', updated_at=now)
+        .execution_options(synchronize_session='fetch')
+    )
+    logger.info(f"Released stock of {len(order_ids)} expired orders")
+    return order_ids
+
+
+def backfill(db: Session) -> int:
+    """Create reservations for pending unpaid orders that have none; returns the rows added"""
+    reserved = select(StockReservation.order_id)
+    rows = db.execute(
+        select(Order.id, Order.created_at, OrderItem.product_id, OrderItem.size, func.sum(OrderItem.quantity))
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .where(
+            Order.status == 'pending',
+            Order.payment_status == 'pending',
+            Order.id.not_in(reserved)
+        )
+        .group_by(Order.id, Order.created_at, OrderItem.product_id, OrderItem.size)
+    ).all()
+    db.add_all([
+        StockReservation(
+            order_id=order_id,
+            product_id=product_id,
+            size=size,
+            quantity=quantity,
+            created_at=created_at or datetime.utcnow(),
+            expires_at=_expires_at(created_at)
+        )
+        for order_id, created_at, product_id, size, quantity in rows
+    ])
+    return len(rows)
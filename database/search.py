@@ -0,0 +1,186 @@
+"""
+Product search.
+
+On PostgreSQL, search uses the expression GIN index over a Russian + simple
+tsvector (stemmed words and exact/prefix tokens) and the pg_trgm index on
+product names for typo tolerance, ranked by ts_rank_cd plus name
+similarity.
+
+Other databases (SQLite in tests and local runs) fall back to an in-memory
+inverted index built from the catalog snapshot and rebuilt whenever the
+snapshot version changes.
+"""
+import bisect
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import desc, func, literal_column, or_
+from sqlalchemy.orm import Session
+
+from database import catalog_cache
+from database.models import Product, PRODUCT_SEARCH_VECTOR_SQL
+
+MAX_QUERY_LENGTH = 100
+TRIGRAM_THRESHOLD = 0.3
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase word tokens"""
+    if not text:
+        return []
+    return [t.replace('ё', 'е') for t in _TOKEN_RE.findall(text.lower())]
+
+
+def _trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def search_products(db: Session, query: str, category_id: int = None,
+                    limit: int = 20, offset: int = 0) -> List[int]:
+    """
+    Search active products
+
+    Args:
+        db: Database session
+        query: User search query
+        category_id: Restrict results to one category
+        limit: Page size
+        offset: Number of results to skip
+
+    Returns:
+        Product ids ordered by relevance
+    """
+    query = (query or '').strip()[:MAX_QUERY_LENGTH]
+    if not tokenize(query):
+        return []
+
+    if db.get_bind().dialect.name == 'postgresql':
+        return _search_postgresql(db, query, category_id, limit, offset)
+    return _search_memory(query, category_id, limit, offset)
+
+
+def _search_postgresql(db: Session, query: str, category_id: Optional[int],
+                       limit: int, offset: int) -> List[int]:
+    vector = literal_column(f"({PRODUCT_SEARCH_VECTOR_SQL})")
+    ts_query = func.websearch_to_tsquery(literal_column("'russian'::regconfig"), query)
+
+    # Prefix matching so "футб" finds "футболка" while the user is typing
+    prefix_terms = ' & '.join(f"{token}:*" for token in tokenize(query))
+    if prefix_terms:
+        ts_query = ts_query.op('||')(
+            func.to_tsquery(literal_column("'simple'::regconfig"), prefix_terms)
+        )
+
+    rank = (
+        func.ts_rank_cd(vector, ts_query)
+        + func.similarity(Product.name, query)
+    ).label('rank')
+
+    stmt = db.query(Product.id, rank).filter(
+        Product.is_active == True,
+        or_(vector.op('@@')(ts_query), Product.name.op('%')(query))
+    )
+    if category_id:
+        stmt = stmt.filter(Product.category_id == category_id)
+
+    rows = stmt.order_by(desc('rank'), Product.id).offset(offset).limit(limit).all()
+    return [row.id for row in rows]
+
+
+class _MemoryIndex:
+    """Inverted index over active products of one catalog snapshot"""
+
+    def __init__(self, snapshot: catalog_cache.CatalogSnapshot):
+        self.snapshot = snapshot
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.trigram_words: Dict[str, Set[str]] = {}
+        self.category_of: Dict[int, int] = {}
+
+        for product in snapshot.active_products:
+            self.category_of[product.id] = product.category_id
+            for token in tokenize(product.name):
+                self._add(token, product.id, 2.0)
+            for token in tokenize(product.description):
+                self._add(token, product.id, 1.0)
+
+        self.vocabulary = sorted(self.postings)
+        for word in self.vocabulary:
+            for gram in _trigrams(word):
+                self.trigram_words.setdefault(gram, set()).add(word)
+
+    def _add(self, token: str, product_id: int, weight: float):
+        bucket = self.postings.setdefault(token, {})
+        bucket[product_id] = bucket.get(product_id, 0.0) + weight
+
+    def _prefix_words(self, token: str) -> List[str]:
+        start = bisect.bisect_left(self.vocabulary, token)
+        words = []
+        for word in self.vocabulary[start:]:
+            if not word.startswith(token):
+                break
+            words.append(word)
+        return words
+
+    def _similar_words(self, token: str) -> List[Tuple[str, float]]:
+        grams = _trigrams(token)
+        overlap: Dict[str, int] = {}
+        for gram in grams:
+            for word in self.trigram_words.get(gram, ()):
+                overlap[word] = overlap.get(word, 0) + 1
+        similar = []
+        for word, shared in overlap.items():
+            score = shared / len(grams | _trigrams(word))
+            if score >= TRIGRAM_THRESHOLD:
+                similar.append((word, score))
+        return similar
+
+    def search(self, query: str) -> List[Tuple[int, float]]:
+        scores: Optional[Dict[int, float]] = None
+        for token in tokenize(query):
+            matches = [(word, 1.0 if word == token else 0.8) for word in self._prefix_words(token)]
+            if not matches:
+                matches = self._similar_words(token)
+
+            token_scores: Dict[int, float] = {}
+            for word, weight in matches:
+                for product_id, score in self.postings[word].items():
+                    token_scores[product_id] = max(token_scores.get(product_id, 0.0), score * weight)
+
+            # Every query token must match (AND semantics, like websearch_to_tsquery)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {pid: scores[pid] + s for pid, s in token_scores.items() if pid in scores}
+            if not scores:
+                return []
+
+        return sorted((scores or {}).items(), key=lambda item: (-item[1], item[0]))
+
+
+_memory_lock = threading.Lock()
+_memory_index: Optional[_MemoryIndex] = None
+
+
+def _get_memory_index() -> _MemoryIndex:
+    global _memory_index
+    snapshot = catalog_cache.get_snapshot()
+    index = _memory_index
+    if index is None or index.snapshot is not snapshot:
+        with _memory_lock:
+            index = _memory_index
+            if index is None or index.snapshot is not snapshot:
+                index = _MemoryIndex(snapshot)
+                _memory_index = index
+    return index
+
+
+def _search_memory(query: str, category_id: Optional[int], limit: int, offset: int) -> List[int]:
+    index = _get_memory_index()
+    results = index.search(query)
+    if category_id:
+        results = [item for item in results if index.category_of.get(item[0]) == category_id]
+    return [product_id for product_id, _ in results[offset:offset + limit]]
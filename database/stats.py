@@ -0,0 +1,237 @@
+"""
+Pre-aggregated sales statistics.
+
+DailySalesStats and DailyProductSales hold one row per day (and per product)
+and are updated incrementally inside the transactions that create users and
+orders or change an order's status. Dashboards read a handful of rollup rows
+in a single query instead of scanning orders.
+
+Orders are attributed to the UTC day they were created, so completing an
+order later updates the day on which it was placed. rebuild_rollups()
+recomputes everything from the base tables.
+"""
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from database.models import User, Order, OrderItem, DailySalesStats, DailyProductSales
+
+logger = logging.getLogger(__name__)
+
+METRICS = (
+    'orders_count', 'completed_orders', 'completed_revenue',
+    'paid_orders', 'paid_revenue', 'units_sold', 'new_users',
+)
+
+DEFAULT_PERIODS = {'today': 1, 'week': 7, 'month': 30}
+
+
+def _increment(db: Session, model, keys: dict, deltas: dict, values: dict = None):
+    """Add deltas to a rollup row, creating it if needed, in one statement"""
+    values = values or {}
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+        stmt = insert(model).values(**keys, **deltas, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={
+                **{name: getattr(model, name) + stmt.excluded[name] for name in deltas},
+                **{name: stmt.excluded[name] for name in values},
+            }
+        )
+        db.execute(stmt)
+        return
+
+    row = db.query(model).filter_by(**keys).with_for_update().first()
+    if row is None:
+        db.add(model(**keys, **deltas, **values))
+        db.flush()
+        return
+    for name, delta in deltas.items():
+        setattr(row, name, (getattr(row, name) or 0) + delta)
+    for name, value in values.items():
+        setattr(row, name, value)
+
+
+def _day(moment: Optional[datetime]) -> date:
+    return (moment or datetime.utcnow()).date()
+
+
+def record_new_user(db: Session, created_at: datetime = None):
+    _increment(db, DailySalesStats, {'day': _day(created_at)}, {'new_users': 1})
+
+
+def record_order_created(db: Session, order: Order):
+    _increment(db, DailySalesStats, {'day': _day(order.created_at)}, {'orders_count': 1})
+
+
+def record_order_change(db: Session, order: Order, old_status: str, old_payment_status: str):
+    """Apply the rollup delta of an order status and/or payment status change"""
+    was_completed = old_status == 'completed'
+    is_completed = order.status == 'completed'
+    was_paid = old_payment_status == 'succeeded'
+    is_paid = order.payment_status == 'succeeded'
+    if was_completed == is_completed and was_paid == is_paid:
+        return
+
+    day = _day(order.created_at)
+    deltas = {}
+    if was_paid != is_paid:
+        sign = 1 if is_paid else -1
+        deltas['paid_orders'] = sign
+        deltas['paid_revenue'] = sign * order.total_amount
+
+    if was_completed != is_completed:
+        sign = 1 if is_completed else -1
+        units = 0
+        for item in order.items:
+            units += item.quantity
+            if item.product_id is None:
+                continue
+            _increment(
+                db, DailyProductSales,
+                {'day': day, 'product_id': item.product_id},
+                {'units_sold': sign * item.quantity, 'revenue': sign * item.price * item.quantity},
+                {'product_name': item.product_name}
+            )
+        deltas['completed_orders'] = sign
+        deltas['completed_revenue'] = sign * order.total_amount
+        deltas['units_sold'] = sign * units
+
+    _increment(db, DailySalesStats, {'day': day}, deltas)
+
+
+def get_sales_summary(db: Session, periods: Dict[str, int] = None, now: datetime = None) -> dict:
+    """
+    Sales totals for several trailing periods in one query
+
+    Args:
+        db: Database session
+        periods: Period name -> number of days including today
+        now: Reference time (UTC), defaults to now
+
+    Returns:
+        {'<period>': {metric: value}, 'all': {...}, 'total_users': n, 'pending_orders': n}
+    """
+    periods = DEFAULT_PERIODS if periods is None else periods
+    today = _day(now)
+
+    columns = []
+    for name, days in periods.items():
+        start = today - timedelta(days=days - 1)
+        for metric in METRICS:
+            value = case((DailySalesStats.day >= start, getattr(DailySalesStats, metric)), else_=0)
+            columns.append(func.coalesce(func.sum(value), 0).label(f"{name}__{metric}"))
+    for metric in METRICS:
+        columns.append(func.coalesce(func.sum(getattr(DailySalesStats, metric)), 0).label(f"all__{metric}"))
+
+    # Current-state counters ride along as scalar subqueries
+    columns.append(select(func.count(User.id)).scalar_subquery().label('total_users'))
+    columns.append(
+        select(func.count(Order.id)).where(Order.status == 'pending').scalar_subquery().label('pending_orders')
+    )
+
+    row = db.query(*columns).select_from(DailySalesStats).one()._mapping
+
+    summary = {'total_users': row['total_users'] or 0, 'pending_orders': row['pending_orders'] or 0}
+    for name in [*periods, 'all']:
+        summary[name] = {metric: row[f"{name}__{metric}"] for metric in METRICS}
+    return summary
+
+
+def get_top_products(db: Session, limit: int = 5, days: int = None, now: datetime = None) -> List:
+    """(product_id, product_name, units_sold) of best sellers, optionally over the last N days"""
+    query = db.query(
+        DailyProductSales.product_id,
+        func.max(DailyProductSales.product_name).label('product_name'),
+        func.sum(DailyProductSales.units_sold).label('units_sold')
+    )
+    if days:
+        query = query.filter(DailyProductSales.day >= _day(now) - timedelta(days=days - 1))
+    return query.group_by(DailyProductSales.product_id).having(
+        func.sum(DailyProductSales.units_sold) > 0
+    ).order_by(func.sum(DailyProductSales.units_sold).desc()).limit(limit).all()
+
+
+def _as_date(value) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def rebuild_rollups(db: Session):
+    """Recompute both rollup tables from users, orders and order items"""
+    order_day = func.date(Order.created_at)
+    is_completed = Order.status == 'completed'
+    is_paid = Order.payment_status == 'succeeded'
+
+    days: Dict[date, dict] = {}
+
+    def bucket(day) -> dict:
+        return days.setdefault(_as_date(day), {metric: 0 for metric in METRICS})
+
+    for row in db.query(
+        order_day.label('day'),
+        func.count(Order.id),
+        func.sum(case((is_completed, 1), else_=0)),
+        func.sum(case((is_completed, Order.total_amount), else_=0)),
+        func.sum(case((is_paid, 1), else_=0)),
+        func.sum(case((is_paid, Order.total_amount), else_=0)),
+    ).group_by(order_day):
+        stats = bucket(row[0])
+        stats['orders_count'] = row[1]
+        stats['completed_orders'] = row[2] or 0
+        stats['completed_revenue'] = row[3] or 0
+        stats['paid_orders'] = row[4] or 0
+        stats['paid_revenue'] = row[5] or 0
+
+    user_day = func.date(User.created_at)
+    for day, count in db.query(user_day, func.count(User.id)).filter(
+        User.created_at.isnot(None)
+    ).group_by(user_day):
+        bucket(day)['new_users'] = count
+
+    product_rows = db.query(
+        order_day.label('day'),
+        OrderItem.product_id,
+        func.max(OrderItem.product_name),
+        func.sum(OrderItem.quantity),
+        func.sum(OrderItem.price * OrderItem.quantity),
+    ).join(Order, OrderItem.order_id == Order.id).filter(
+        is_completed,
+        OrderItem.product_id.isnot(None)
+    ).group_by(order_day, OrderItem.product_id).all()
+
+    for day, units in db.query(order_day, func.sum(OrderItem.quantity)).join(
+        Order, OrderItem.order_id == Order.id
+    ).filter(is_completed).group_by(order_day):
+        bucket(day)['units_sold'] = units or 0
+
+    db.query(DailyProductSales).delete(synchronize_session=False)
+    db.query(DailySalesStats).delete(synchronize_session=False)
+    db.bulk_insert_mappings(DailySalesStats, [{'day': day, **stats} for day, stats in days.items()])
+    db.bulk_insert_mappings(DailyProductSales, [
+        {
+            'day': _as_date(day),
+            'product_id': product_id,
+            'product_name': name,
+            'units_sold': units,
+            'revenue': revenue,
+        }
+        for day, product_id, name, units, revenue in product_rows
+    ])
+    db.commit()
+    logger.info(f"Sales rollups rebuilt: {len(days)} days, {len(product_rows)} product-days")
+
+
+def ensure_rollups(db: Session):
+    """Backfill rollups on first start after the tables were added"""
+    has_rollups = db.query(DailySalesStats.day).first() is not None
+    has_history = db.query(Order.id).first() is not None or db.query(User.id).first() is not None
+    if not has_rollups and has_history:
+        rebuild_rollups(db)
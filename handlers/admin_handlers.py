@@ -7,8 +7,10 @@ from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 import io
 
-from database.db import get_db
-from database import crud
+from database.db import get_async_db
+from database import async_crud
+from database.pagination import InvalidCursor
+from database.payments import OrderNotCancellable, needs_refund
 from utils.keyboards import (
     get_admin_main_keyboard,
     get_admin_categories_keyboard,
@@ -21,9 +23,12 @@ from utils.keyboards import (
     get_admin_product_actions_keyboard,
     get_admin_category_actions_keyboard,
     get_admin_user_actions_keyboard,
-    get_admin_order_actions_keyboard
+    get_admin_order_actions_keyboard,
+    get_broadcast_progress_keyboard
 )
-from utils.helpers import is_admin, format_price, get_user_theme
+from utils import broadcast
+from utils.helpers import is_admin, format_price
+from utils.middleware import CachedUser, invalidate_user
 from config import ADMIN_IDS
 from utils.error_handler import error_handler, ValidationError, validate_price, validate_stock, sanitize_text
 
@@ -65,89 +70,81 @@ class AdminStates(StatesGroup):
 
 @router.message(Command("admin"))
 @error_handler
-async def admin_panel(message: Message, state: FSMContext):
+async def admin_panel(message: Message, state: FSMContext, db_user: CachedUser):
     """Admin panel entry point"""
-    with get_db() as db:
-        if not is_admin(message.from_user.id):
-            await message.answer("У вас нет доступа к админ-панели.")
-            return
-        
-        await state.clear()
-        
-        # Get statistics
-        total_users = crud.get_total_users(db)
-        total_orders = crud.get_total_orders(db)
-        total_revenue = crud.get_total_revenue(db)
-        pending_orders = crud.get_pending_orders_count(db)
-        
-        theme = get_user_theme(db, message.from_user.id)
-        
-        text = f"""
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет доступа к админ-панели.")
+        return
+    
+    await state.clear()
+    
+    # Get statistics
+    async with get_async_db() as db:
+        summary = await async_crud.get_sales_summary(db, {})
+    
+    text = f"""
 <b>🎛 Панель администратора</b>
 
 📊 <b>Статистика:</b>
-👥 Пользователей: {total_users}
-📦 Заказов: {total_orders}
-💰 Выручка: {format_price(total_revenue)}
-⏳ Ожидают обработки: {pending_orders}
+👥 Пользователей: {summary['total_users']}
+📦 Заказов: {summary['all']['orders_count']}
+💰 Выручка: {format_price(summary['all']['paid_revenue'])}
+⏳ Ожидают обработки: {summary['pending_orders']}
 
 Выберите действие:
 """
-        
-        await message.answer(
-            text,
-            reply_markup=get_admin_main_keyboard(theme)
-        )
+    
+    await message.answer(
+        text,
+        reply_markup=get_admin_main_keyboard(db_user.theme)
+    )
 
 
 # ============= CATEGORIES MANAGEMENT =============
 
 @router.callback_query(F.data == "admin_categories")
 @error_handler
-async def admin_categories(callback: CallbackQuery, state: FSMContext):
+async def admin_categories(callback: CallbackQuery, state: FSMContext, db_user: CachedUser):
     """Show categories management"""
-    with get_db() as db:
-        if not is_admin(callback.from_user.id):
-            await callback.answer("Нет доступа", show_alert=True)
-            return
-        
-        categories = crud.get_all_categories(db)
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        text = "<b>📂 Управление категориями</b>\n\n"
-        
-        if categories:
-            text += "Доступные категории:\n"
-            for cat in categories:
-                product_count = len(cat.products)
-                text += f"• {cat.name} ({product_count} товаров)\n"
-        else:
-            text += "Категории отсутствуют."
-        
-        await callback.message.edit_text(
-            text,
-            reply_markup=get_admin_categories_keyboard(categories, theme)
-        )
-        await callback.answer()
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    
+    async with get_async_db() as db:
+        categories = await async_crud.get_all_categories(db)
+        counts = await async_crud.get_category_product_counts(db)
+    
+    text = "<b>📂 Управление категориями</b>\n\n"
+    
+    if categories:
+        text += "Доступные категории:\n"
+        for cat in categories:
+            product_count = counts.get(cat.id, {}).get('total', 0)
+            text += f"• {cat.name} ({product_count} товаров)\n"
+    else:
+        text += "Категории отсутствуют."
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=get_admin_categories_keyboard(categories, db_user.theme)
+    )
+    await callback.answer()
 
 
 @router.callback_query(F.data == "admin_add_category")
-async def admin_add_category(callback: CallbackQuery, state: FSMContext):
+async def admin_add_category(callback: CallbackQuery, state: FSMContext, db_user: CachedUser):
     """Start adding new category"""
-    with get_db() as db:
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        await callback.message.edit_text(
-            "<b>➕ Добавление категории</b>\n\nВведите название новой категории:",
-            reply_markup=get_back_to_admin_keyboard(theme)
-        )
-        await state.set_state(AdminStates.waiting_category_name)
-        await callback.answer()
+    await callback.message.edit_text(
+        "<b>➕ Добавление категории</b>\n\nВведите название новой категории:",
+        reply_markup=get_back_to_admin_keyboard(db_user.theme)
+    )
+    await state.set_state(AdminStates.waiting_category_name)
+    await callback.answer()
 
 
 @router.message(AdminStates.waiting_category_name)
 @error_handler
-async def process_category_name(message: Message, state: FSMContext):
+async def process_category_name(message: Message, state: FSMContext, db_user: CachedUser):
     """Process new category name"""
     category_name = sanitize_text(message.text, max_length=100)
     
@@ -155,51 +152,47 @@ async def process_category_name(message: Message, state: FSMContext):
         await message.answer("❌ Название слишком короткое. Введите минимум 2 символа:")
         return
     
-    with get_db() as db:
+    async with get_async_db() as db:
         # Check if category exists
-        existing = crud.get_category_by_name(db, category_name)
+        existing = await async_crud.get_category_by_name(db, category_name)
         if existing:
             await message.answer("❌ Категория с таким названием уже существует. Введите другое название:")
             return
         
         # Create category
-        crud.create_category(db, category_name)
-        
-        theme = get_user_theme(db, callback.from_user.id)
-        categories = crud.get_all_categories(db)
-        
-        await message.answer(
-            f"✅ Категория <b>{category_name}</b> успешно создана!",
-            reply_markup=get_admin_categories_keyboard(categories, theme)
-        )
-        await state.clear()
+        await async_crud.create_category(db, category_name)
+        categories = await async_crud.get_all_categories(db)
+    
+    await message.answer(
+        f"✅ Категория <b>{category_name}</b> успешно создана!",
+        reply_markup=get_admin_categories_keyboard(categories, db_user.theme)
+    )
+    await state.clear()
 
 
 @router.callback_query(F.data.startswith("admin_edit_cat_"))
-async def admin_edit_category(callback: CallbackQuery, state: FSMContext):
+async def admin_edit_category(callback: CallbackQuery, state: FSMContext, db_user: CachedUser):
     """Edit category"""
-    with get_db() as db:
-        category_id = int(callback.data.split("_")[-1])
-        
-        category = crud.get_category(db, category_id)
-        if not category:
-            await callback.answer("Категория не найдена", show_alert=True)
-            return
-        
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        await callback.message.edit_text(
-            f"<b>✏️ Редактирование категории</b>\n\nТекущее название: <b>{category.name}</b>\n\nВведите новое название:",
-            reply_markup=get_back_to_admin_keyboard(theme)
-        )
-        await state.set_state(AdminStates.waiting_category_edit_name)
-        await state.update_data(category_id=category_id)
-        await callback.answer()
+    category_id = int(callback.data.split("_")[-1])
+    
+    async with get_async_db() as db:
+        category = await async_crud.get_category(db, category_id)
+    if not category:
+        await callback.answer("Категория не найдена", show_alert=True)
+        return
+    
+    await callback.message.edit_text(
+        f"<b>✏️ Редактирование категории</b>\n\nТекущее название: <b>{category.name}</b>\n\nВведите новое название:",
+        reply_markup=get_back_to_admin_keyboard(db_user.theme)
+    )
+    await state.set_state(AdminStates.waiting_category_edit_name)
+    await state.update_data(category_id=category_id)
+    await callback.answer()
 
 
 @router.message(AdminStates.waiting_category_edit_name)
 @error_handler
-async def process_category_edit_name(message: Message, state: FSMContext):
+async def process_category_edit_name(message: Message, state: FSMContext, db_user: CachedUser):
     """Process edited category name"""
     category_name = sanitize_text(message.text, max_length=100)
     
@@ -207,160 +200,157 @@ async def process_category_edit_name(message: Message, state: FSMContext):
         await message.answer("❌ Название слишком короткое. Введите минимум 2 символа:")
         return
     
-    with get_db() as db:
-        data = await state.get_data()
-        category_id = data.get("category_id")
-        
-        new_name = category_name
-        
+    data = await state.get_data()
+    category_id = data.get("category_id")
+    
+    new_name = category_name
+    
+    async with get_async_db() as db:
         # Check if name is taken
-        existing = crud.get_category_by_name(db, new_name)
+        existing = await async_crud.get_category_by_name(db, new_name)
         if existing and existing.id != category_id:
             await message.answer("❌ Категория с таким названием уже существует. Введите другое название:")
             return
         
         # Update category
-        crud.update_category(db, category_id, new_name)
-        
-        theme = get_user_theme(db, callback.from_user.id)
-        categories = crud.get_all_categories(db)
-        
-        await message.answer(
-            f"✅ Категория успешно переименована в <b>{new_name}</b>!",
-            reply_markup=get_admin_categories_keyboard(categories, theme)
-        )
-        await state.clear()
+        await async_crud.update_category(db, category_id, new_name)
+        categories = await async_crud.get_all_categories(db)
+    
+    await message.answer(
+        f"✅ Категория успешно переименована в <b>{new_name}</b>!",
+        reply_markup=get_admin_categories_keyboard(categories, db_user.theme)
+    )
+    await state.clear()
 
 
 @router.callback_query(F.data.startswith("admin_del_cat_"))
-async def admin_delete_category(callback: CallbackQuery):
+async def admin_delete_category(callback: CallbackQuery, db_user: CachedUser):
     """Delete category"""
-    with get_db() as db:
-        category_id = int(callback.data.split("_")[-1])
-        
-        category = crud.get_category(db, category_id)
+    category_id = int(callback.data.split("_")[-1])
+    
+    async with get_async_db() as db:
+        category = await async_crud.get_category(db, category_id)
         if not category:
             await callback.answer("Категория не найдена", show_alert=True)
             return
         
         # Check if category has products
-        if category.products:
+        product_count = (await async_crud.get_category_product_counts(db)).get(category_id, {}).get('total', 0)
+        if product_count:
             await callback.answer(
-                f"❌ Невозможно удалить категорию с товарами ({len(category.products)} шт). Сначала удалите товары.",
+                f"❌ Невозможно удалить категорию с товарами ({product_count} шт). Сначала удалите товары.",
                 show_alert=True
             )
             return
         
-        crud.delete_category(db, category_id)
-        
-        theme = get_user_theme(db, callback.from_user.id)
-        categories = crud.get_all_categories(db)
-        
-        await callback.message.edit_text(
-            f"✅ Категория <b>{category.name}</b> удалена!",
-            reply_markup=get_admin_categories_keyboard(categories, theme)
-        )
-        await callback.answer()
+        await async_crud.delete_category(db, category_id)
+        categories = await async_crud.get_all_categories(db)
+    
+    await callback.message.edit_text(
+        f"✅ Категория <b>{category.name}</b> удалена!",
+        reply_markup=get_admin_categories_keyboard(categories, db_user.theme)
+    )
+    await callback.answer()
 
 
 # ============= PRODUCTS MANAGEMENT =============
 
 @router.callback_query(F.data == "admin_products")
-async def admin_products(callback: CallbackQuery):
+async def admin_products(callback: CallbackQuery, db_user: CachedUser):
     """Show products management"""
-    with get_db() as db:
-        if not is_admin(callback.from_user.id):
-            await callback.answer("Нет доступа", show_alert=True)
-            return
-        
-        categories = crud.get_all_categories(db)
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        if not categories:
-            await callback.message.edit_text(
-                "<b>📦 Управление товарами</b>\n\n❌ Сначала создайте категории!",
-                reply_markup=get_back_to_admin_keyboard(theme)
-            )
-            await callback.answer()
-            return
-        
-        text = "<b>📦 Управление товарами</b>\n\nВыберите категорию:"
-        
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    
+    async with get_async_db() as db:
+        categories = await async_crud.get_all_categories(db)
+        counts = await async_crud.get_category_product_counts(db)
+    
+    if not categories:
         await callback.message.edit_text(
-            text,
-            reply_markup=get_admin_products_keyboard(categories, theme)
+            "<b>📦 Управление товарами</b>\n\n❌ Сначала создайте категории!",
+            reply_markup=get_back_to_admin_keyboard(db_user.theme)
         )
         await callback.answer()
+        return
+    
+    text = "<b>📦 Управление товарами</b>\n\nВыберите категорию:"
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=get_admin_products_keyboard(categories, counts, db_user.theme)
+    )
+    await callback.answer()
 
 
 @router.callback_query(F.data.startswith("admin_prod_cat_"))
 async def admin_products_category(callback: CallbackQuery):
     """Show products in category"""
-    with get_db() as db:
-        category_id = int(callback.data.split("_")[-1])
-        
-        category = crud.get_category(db, category_id)
-        if not category:
-            await callback.answer("Категория не найдена", show_alert=True)
-            return
-        
-        products = category.products
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        text = f"<b>📦 Товары в категории: {category.name}</b>\n\n"
-        
-        if products:
-            for prod in products:
-                text += f"• {prod.name} - {format_price(prod.price)}\n"
-                text += f"  Остаток: {prod.stock} шт\n\n"
-        else:
-            text += "Товары отсутствуют."
-        
-        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        
-        buttons = []
+    await show_category_products(callback, int(callback.data.split("_")[-1]))
+
+
+async def show_category_products(callback: CallbackQuery, category_id: int):
+    """Render the product list of a category"""
+    async with get_async_db() as db:
+        category = await async_crud.get_category(db, category_id)
+        products = await async_crud.get_products(db, category_id=category_id, active_only=False)
+    
+    if not category:
+        await callback.answer("Категория не найдена", show_alert=True)
+        return
+    
+    text = f"<b>📦 Товары в категории: {category.name}</b>\n\n"
+    
+    if products:
         for prod in products:
-            buttons.append([InlineKeyboardButton(
-                text=f"✏️ {prod.name}",
-                callback_data=f"admin_edit_prod_{prod.id}"
-            )])
-        
-        buttons.append([InlineKeyboardButton(
-            text="➕ Добавить товар",
-            callback_data=f"admin_add_prod_{category_id}"
-        )])
+            text += f"• {prod.name} - {format_price(prod.price)}\n"
+            text += f"  Остаток: {prod.stock} шт\n\n"
+    else:
+        text += "Товары отсутствуют."
+    
+    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+    
+    buttons = []
+    for prod in products:
         buttons.append([InlineKeyboardButton(
-            text="◀️ Назад",
-            callback_data="admin_products"
+            text=f"✏️ {prod.name}",
+            callback_data=f"admin_edit_prod_{prod.id}"
         )])
-        
-        await callback.message.edit_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
-        await callback.answer()
+    
+    buttons.append([InlineKeyboardButton(
+        text="➕ Добавить товар",
+        callback_data=f"admin_add_prod_{category_id}"
+    )])
+    buttons.append([InlineKeyboardButton(
+        text="◀️ Назад",
+        callback_data="admin_products"
+    )])
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
+    await callback.answer()
 
 
 @router.callback_query(F.data.startswith("admin_add_prod_"))
-async def admin_add_product(callback: CallbackQuery, state: FSMContext):
+async def admin_add_product(callback: CallbackQuery, state: FSMContext, db_user: CachedUser):
     """Start adding new product"""
-    with get_db() as db:
-        category_id = int(callback.data.split("_")[-1])
-        
-        category = crud.get_category(db, category_id)
-        if not category:
-            await callback.answer("Категория не найдена", show_alert=True)
-            return
-        
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        await callback.message.edit_text(
-            f"<b>➕ Добавление товара в категорию: {category.name}</b>\n\nВведите название товара:",
-            reply_markup=get_back_to_admin_keyboard(theme)
-        )
-        await state.set_state(AdminStates.waiting_product_name)
-        await state.update_data(category_id=category_id)
-        await callback.answer()
+    category_id = int(callback.data.split("_")[-1])
+    
+    async with get_async_db() as db:
+        category = await async_crud.get_category(db, category_id)
+    if not category:
+        await callback.answer("Категория не найдена", show_alert=True)
+        return
+    
+    await callback.message.edit_text(
+        f"<b>➕ Добавление товара в категорию: {category.name}</b>\n\nВведите название товара:",
+        reply_markup=get_back_to_admin_keyboard(db_user.theme)
+    )
+    await state.set_state(AdminStates.waiting_product_name)
+    await state.update_data(category_id=category_id)
+    await callback.answer()
 
 
 @router.message(AdminStates.waiting_product_name)
@@ -434,19 +424,19 @@ async def process_product_photo(message: Message, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_product_photos, Command("done"))
-async def finish_product_creation(message: Message, state: FSMContext):
+async def finish_product_creation(message: Message, state: FSMContext, db_user: CachedUser):
     """Finish product creation"""
-    with get_db() as db:
-        data = await state.get_data()
-        
-        photos = data.get("product_photos", [])
-        if not photos:
-            await message.answer("❌ Добавьте хотя бы одну фотографию товара!")
-            return
-        
-        # Create product
-        product = crud.create_product(
-            db=db,
+    data = await state.get_data()
+    
+    photos = data.get("product_photos", [])
+    if not photos:
+        await message.answer("❌ Добавьте хотя бы одну фотографию товара!")
+        return
+    
+    # Create product
+    async with get_async_db() as db:
+        product = await async_crud.create_product(
+            db,
             name=data["product_name"],
             description=data["product_description"],
             price=data["product_price"],
@@ -455,32 +445,28 @@ async def finish_product_creation(message: Message, state: FSMContext):
             stock=data["product_stock"],
             photos=",".join(photos)
         )
-        
-        theme = get_user_theme(db, message.from_user.id)
-        
-        await message.answer(
-            f"✅ Товар <b>{product.name}</b> успешно создан!",
-            reply_markup=get_back_to_admin_keyboard(theme)
-        )
-        await state.clear()
+    
+    await message.answer(
+        f"✅ Товар <b>{product.name}</b> успешно создан!",
+        reply_markup=get_back_to_admin_keyboard(db_user.theme)
+    )
+    await state.clear()
 
 
 @router.callback_query(F.data.startswith("admin_edit_prod_"))
-async def admin_edit_product(callback: CallbackQuery):
+async def admin_edit_product(callback: CallbackQuery, db_user: CachedUser):
     """Show product edit menu"""
-    with get_db() as db:
-        product_id = int(callback.data.split("_")[-1])
-        
-        product = crud.get_product(db, product_id)
-        if not product:
-            await callback.answer("Товар не найден", show_alert=True)
-            return
-        
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        photo_count = len(product.photos.split(',')) if product.photos else 0
-        
-        text = f"""
+    product_id = int(callback.data.split("_")[-1])
+    
+    async with get_async_db() as db:
+        product = await async_crud.get_product(db, product_id)
+    if not product:
+        await callback.answer("Товар не найден", show_alert=True)
+        return
+    
+    photo_count = len(product.photos.split(',')) if product.photos else 0
+    
+    text = f"""
 <b>✏️ Редактирование товара</b>
 
 <b>Название:</b> {product.name}
@@ -492,21 +478,21 @@ async def admin_edit_product(callback: CallbackQuery):
 
 Выберите что изменить:
 """
-        
-        await callback.message.edit_text(
-            text,
-            reply_markup=get_admin_product_actions_keyboard(product_id, theme)
-        )
-        await callback.answer()
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=get_admin_product_actions_keyboard(product_id, db_user.theme)
+    )
+    await callback.answer()
 
 
 @router.callback_query(F.data.startswith("admin_del_prod_"))
 async def admin_delete_product(callback: CallbackQuery):
     """Delete product"""
-    with get_db() as db:
-        product_id = int(callback.data.split("_")[-1])
-        
-        product = crud.get_product(db, product_id)
+    product_id = int(callback.data.split("_")[-1])
+    
+    async with get_async_db() as db:
+        product = await async_crud.get_product(db, product_id)
         if not product:
             await callback.answer("Товар не найден", show_alert=True)
             return
@@ -514,60 +500,65 @@ async def admin_delete_product(callback: CallbackQuery):
         category_id = product.category_id
         product_name = product.name
         
-        crud.delete_product(db, product_id)
-        
-        await callback.answer(f"✅ Товар {product_name} удален!", show_alert=True)
-        
-        # Return to category products list
-        await admin_products_category(callback)
+        await async_crud.delete_product(db, product_id)
+    
+    await callback.answer(f"✅ Товар {product_name} удален!", show_alert=True)
+    
+    # Return to category products list
+    await show_category_products(callback, category_id)
 
 
 # ============= USERS MANAGEMENT =============
 
 @router.callback_query(F.data == "admin_users")
-async def admin_users(callback: CallbackQuery):
+@router.callback_query(F.data.startswith("admin_users_p_"))
+async def admin_users(callback: CallbackQuery, db_user: CachedUser):
     """Show users management"""
-    with get_db() as db:
-        if not is_admin(callback.from_user.id):
-            await callback.answer("Нет доступа", show_alert=True)
-            return
-        
-        users = crud.get_all_users(db, limit=20)
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        text = "<b>👥 Управление пользователями</b>\n\n"
-        text += f"Всего пользователей: {crud.get_total_users(db)}\n\n"
-        text += "Последние 20 пользователей:\n\n"
-        
-        for user in users:
-            status = "🟢" if user.is_active else "🔴"
-            text += f"{status} {user.username or user.telegram_id}\n"
-            text += f"   ID: {user.telegram_id}\n"
-            text += f"   Заказов: {len(user.orders)}\n\n"
-        
-        await callback.message.edit_text(
-            text,
-            reply_markup=get_admin_users_keyboard(users, theme)
-        )
-        await callback.answer()
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    
+    cursor = callback.data.removeprefix("admin_users_p_") if callback.data != "admin_users" else None
+    async with get_async_db() as db:
+        try:
+            users, next_cursor = await async_crud.get_users_page(db, cursor=cursor, limit=20)
+        except InvalidCursor:
+            users, next_cursor = await async_crud.get_users_page(db, limit=20)
+        total_users = await async_crud.get_total_users(db)
+        order_stats = await async_crud.get_user_order_stats(db, [user.id for user in users])
+    
+    text = "<b>👥 Управление пользователями</b>\n\n"
+    text += f"Всего пользователей: {total_users}\n\n"
+    text += "Последние пользователи:\n\n" if not cursor else "Более ранние пользователи:\n\n"
+    
+    for user in users:
+        status = "🟢" if user.is_active else "🔴"
+        text += f"{status} {user.username or user.telegram_id}\n"
+        text += f"   ID: {user.telegram_id}\n"
+        text += f"   Заказов: {order_stats.get(user.id, {}).get('orders', 0)}\n\n"
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=get_admin_users_keyboard(users, db_user.theme, next_cursor)
+    )
+    await callback.answer()
 
 
 @router.callback_query(F.data.startswith("admin_user_"))
-async def admin_user_details(callback: CallbackQuery):
+async def admin_user_details(callback: CallbackQuery, db_user: CachedUser):
     """Show user details"""
-    with get_db() as db:
-        user_id = int(callback.data.split("_")[-1])
-        
-        user = crud.get_user(db, user_id)
-        if not user:
-            await callback.answer("Пользователь не найден", show_alert=True)
-            return
-        
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        total_spent = sum(order.total_amount for order in user.orders if order.status == "completed")
-        
-        text = f"""
+    user_id = int(callback.data.split("_")[-1])
+    
+    async with get_async_db() as db:
+        user = await async_crud.get_user(db, user_id)
+        order_stats = (await async_crud.get_user_order_stats(db, [user_id])).get(user_id, {})
+    if not user:
+        await callback.answer("Пользователь не найден", show_alert=True)
+        return
+    
+    total_spent = order_stats.get('spent', 0.0)
+    
+    text = f"""
 <b>👤 Информация о пользователе</b>
 
 <b>ID:</b> {user.telegram_id}
@@ -577,97 +568,116 @@ async def admin_user_details(callback: CallbackQuery):
 <b>Регистрация:</b> {user.created_at.strftime('%d.%m.%Y %H:%M')}
 
 <b>📊 Статистика:</b>
-• Заказов: {len(user.orders)}
+• Заказов: {order_stats.get('orders', 0)}
 • Потрачено: {format_price(total_spent)}
 
 Выберите действие:
 """
-        
-        await callback.message.edit_text(
-            text,
-            reply_markup=get_admin_user_actions_keyboard(user_id, user.is_active, theme)
-        )
-        await callback.answer()
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=get_admin_user_actions_keyboard(user_id, user.is_active, db_user.theme)
+    )
+    await callback.answer()
 
 
 @router.callback_query(F.data.startswith("admin_block_user_"))
-async def admin_block_user(callback: CallbackQuery):
+async def admin_block_user(callback: CallbackQuery, db_user: CachedUser):
     """Block/unblock user"""
-    with get_db() as db:
-        user_id = int(callback.data.split("_")[-1])
-        
-        user = crud.get_user(db, user_id)
+    user_id = int(callback.data.split("_")[-1])
+    
+    async with get_async_db() as db:
+        user = await async_crud.get_user(db, user_id)
         if not user:
             await callback.answer("Пользователь не найден", show_alert=True)
             return
         
         # Toggle active status
-        crud.update_user_status(db, user_id, not user.is_active)
-        
-        status_text = "разблокирован" if not user.is_active else "заблокирован"
-        await callback.answer(f"✅ Пользователь {status_text}!", show_alert=True)
-        
-        # Refresh user details
-        await admin_user_details(callback)
+        was_active = user.is_active
+        await async_crud.update_user_status(db, user_id, not was_active)
+    invalidate_user(user.telegram_id)
+    
+    status_text = "разблокирован" if not was_active else "заблокирован"
+    await callback.answer(f"✅ Пользователь {status_text}!", show_alert=True)
+    
+    # Refresh user details
+    await admin_user_details(callback, db_user)
 
 
 # ============= ORDERS MANAGEMENT =============
 
 @router.callback_query(F.data == "admin_orders")
-async def admin_orders(callback: CallbackQuery):
+@router.callback_query(F.data.startswith("admin_orders_p_"))
+async def admin_orders(callback: CallbackQuery, db_user: CachedUser):
     """Show orders management"""
-    with get_db() as db:
-        if not is_admin(callback.from_user.id):
-            await callback.answer("Нет доступа", show_alert=True)
-            return
-        
-        orders = crud.get_recent_orders(db, limit=15)
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        text = "<b>📦 Управление заказами</b>\n\n"
-        text += f"Всего заказов: {crud.get_total_orders(db)}\n"
-        text += f"Ожидают обработки: {crud.get_pending_orders_count(db)}\n\n"
-        text += "Последние 15 заказов:\n\n"
-        
-        for order in orders:
-            status_emoji = {
-                "pending": "⏳",
-                "processing": "🔄",
-                "completed": "✅",
-                "cancelled": "❌"
-            }.get(order.status, "❓")
-            
-            text += f"{status_emoji} Заказ #{order.id}\n"
-            text += f"   {format_price(order.total_amount)} • {order.created_at.strftime('%d.%m %H:%M')}\n\n"
-        
-        await callback.message.edit_text(
-            text,
-            reply_markup=get_admin_orders_keyboard(orders, theme)
-        )
-        await callback.answer()
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    
+    cursor = callback.data.removeprefix("admin_orders_p_") if callback.data != "admin_orders" else None
+    async with get_async_db() as db:
+        try:
+            orders, next_cursor = await async_crud.get_orders_page(db, cursor=cursor, limit=15)
+        except InvalidCursor:
+            orders, next_cursor = await async_crud.get_orders_page(db, limit=15)
+        total_orders = await async_crud.get_total_orders(db)
+        pending_orders = await async_crud.get_pending_orders_count(db)
+    
+    text = "<b>📦 Управление заказами</b>\n\n"
+    text += f"Всего заказов: {total_orders}\n"
+    text += f"Ожидают обработки: {pending_orders}\n\n"
+    text += "Последние заказы:\n\n" if not cursor else "Более ранние заказы:\n\n"
+    
+    for order in orders:
+        status_emoji = {
+            "pending": "⏳",
+            "paid": "💳",
+            "processing": "🔄",
+            "completed": "✅",
+            "cancelled": "❌"
+        }.get(order.status, "❓")
+        
+        text += f"{status_emoji} Заказ #{order.id}\n"
+        text += f"   {format_price(order.total_amount)} • {order.created_at.strftime('%d.%m %H:%M')}\n\n"
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=get_admin_orders_keyboard(orders, db_user.theme, next_cursor)
+    )
+    await callback.answer()
 
 
-@router.callback_query(F.data.startswith("admin_order_"))
-async def admin_order_details(callback: CallbackQuery):
+@router.callback_query(F.data.regexp(r"^admin_order_\d+$"))
+async def admin_order_details(callback: CallbackQuery, db_user: CachedUser):
     """Show order details"""
-    with get_db() as db:
-        order_id = int(callback.data.split("_")[-1])
-        
-        order = crud.get_order(db, order_id)
-        if not order:
-            await callback.answer("Заказ не найден", show_alert=True)
-            return
-        
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        status_text = {
-            "pending": "⏳ Ожидает оплаты",
-            "processing": "🔄 В обработке",
-            "completed": "✅ Завершен",
-            "cancelled": "❌ Отменен"
-        }.get(order.status, "❓ Неизвестно")
-        
-        text = f"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    
+    if not await show_admin_order(callback, int(callback.data.split("_")[-1]), db_user.theme):
+        await callback.answer("Заказ не найден", show_alert=True)
+        return
+    await callback.answer()
+
+
+async def show_admin_order(callback: CallbackQuery, order_id: int, theme: str) -> bool:
+    """Render an order with the admin actions its status allows; False if there is no such order"""
+    async with get_async_db() as db:
+        order = await async_crud.get_order(db, order_id, profile='order_with_items_and_user')
+    if not order:
+        return False
+    
+    status_text = {
+        "pending": "⏳ Ожидает оплаты",
+        "paid": "💳 Оплачен",
+        "processing": "🔄 В обработке",
+        "completed": "✅ Завершен",
+        "cancelled": "❌ Отменен"
+    }.get(order.status, "❓ Неизвестно")
+    if needs_refund(order):
+        status_text += " (оплачен после отмены — нужен возврат)"
+    
+    text = f"""
 <b>📦 Заказ #{order.id}</b>
 
 <b>Статус:</b> {status_text}
@@ -680,127 +690,117 @@ Username: @{order.user.username or 'не указан'}
 
 <b>📋 Товары:</b>
 """
-        
-        for item in order.items:
-            text += f"• {item.product.name}\n"
-            text += f"  {item.quantity} шт × {format_price(item.price)} = {format_price(item.quantity * item.price)}\n"
-        
-        if order.delivery_address:
-            text += f"\n<b>📍 Адрес доставки:</b>\n{order.delivery_address}"
-        
-        await callback.message.edit_text(
-            text,
-            reply_markup=get_admin_order_actions_keyboard(order_id, order.status, theme)
-        )
-        await callback.answer()
+    
+    for item in order.items:
+        text += f"• {item.product_name}\n"
+        text += f"  {item.quantity} шт × {format_price(item.price)} = {format_price(item.quantity * item.price)}\n"
+    
+    if order.delivery_address:
+        text += f"\n<b>📍 Адрес доставки:</b>\n{order.delivery_address}"
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=get_admin_order_actions_keyboard(order_id, order.status, theme)
+    )
+    return True
 
 
 @router.callback_query(F.data.startswith("admin_order_status_"))
-async def admin_change_order_status(callback: CallbackQuery):
+async def admin_change_order_status(callback: CallbackQuery, db_user: CachedUser):
     """Change order status"""
-    with get_db() as db:
-        parts = callback.data.split("_")
-        order_id = int(parts[-2])
-        new_status = parts[-1]
-        
-        order = crud.get_order(db, order_id)
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    
+    parts = callback.data.split("_")
+    order_id = int(parts[-2])
+    new_status = parts[-1]
+    
+    async with get_async_db() as db:
+        order = await async_crud.get_order(db, order_id)
         if not order:
             await callback.answer("Заказ не найден", show_alert=True)
             return
         
-        crud.update_order_status(db, order_id, new_status)
-        
-        status_text = {
-            "processing": "в обработку",
-            "completed": "завершен",
-            "cancelled": "отменен"
-        }.get(new_status, new_status)
-        
-        await callback.answer(f"✅ Заказ переведен в статус: {status_text}!", show_alert=True)
-        
-        # Refresh order details
-        await admin_order_details(callback)
+        if new_status == 'cancelled':
+            try:
+                await async_crud.cancel_order(db, order_id)
+            except OrderNotCancellable as e:
+                await callback.answer(str(e), show_alert=True)
+                return
+        else:
+            await async_crud.update_order_status(db, order_id, new_status)
+    
+    status_text = {
+        "processing": "в обработку",
+        "completed": "завершен",
+        "cancelled": "отменен"
+    }.get(new_status, new_status)
+    
+    await callback.answer(f"✅ Заказ переведен в статус: {status_text}!", show_alert=True)
+    
+    # Refresh order details
+    await show_admin_order(callback, order_id, db_user.theme)
 
 
 # ============= STATISTICS =============
 
 @router.callback_query(F.data == "admin_stats")
-async def admin_statistics(callback: CallbackQuery):
+async def admin_statistics(callback: CallbackQuery, db_user: CachedUser):
     """Show detailed statistics"""
-    with get_db() as db:
-        if not is_admin(callback.from_user.id):
-            await callback.answer("Нет доступа", show_alert=True)
-            return
-        
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        # Get statistics
-        total_users = crud.get_total_users(db)
-        total_orders = crud.get_total_orders(db)
-        total_revenue = crud.get_total_revenue(db)
-        pending_orders = crud.get_pending_orders_count(db)
-        
-        # Today's stats
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_orders = crud.get_orders_by_date_range(db, today_start, datetime.now())
-        today_revenue = sum(o.total_amount for o in today_orders if o.status == "completed")
-        
-        # Week stats
-        week_start = datetime.now() - timedelta(days=7)
-        week_orders = crud.get_orders_by_date_range(db, week_start, datetime.now())
-        week_revenue = sum(o.total_amount for o in week_orders if o.status == "completed")
-        
-        # Month stats
-        month_start = datetime.now() - timedelta(days=30)
-        month_orders = crud.get_orders_by_date_range(db, month_start, datetime.now())
-        month_revenue = sum(o.total_amount for o in month_orders if o.status == "completed")
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    
+    async with get_async_db() as db:
+        # Today / week / month / all-time totals from the daily rollups
+        summary = await async_crud.get_sales_summary(db)
         
         # Top products
-        top_products = crud.get_top_products(db, limit=5)
-        
-        text = f"""
+        top_products = await async_crud.get_top_products(db, limit=5)
+    today, week, month = summary['today'], summary['week'], summary['month']
+    
+    text = f"""
 <b>📊 Детальная статистика</b>
 
 <b>👥 Пользователи:</b>
-Всего: {total_users}
+Всего: {summary['total_users']}
+Новых за неделю: {week['new_users']}
 
 <b>📦 Заказы:</b>
-Всего: {total_orders}
-Ожидают: {pending_orders}
+Всего: {summary['all']['orders_count']}
+Ожидают: {summary['pending_orders']}
 
-<b>💰 Выручка:</b>
-Всего: {format_price(total_revenue)}
-За сегодня: {format_price(today_revenue)} ({len(today_orders)} заказов)
-За неделю: {format_price(week_revenue)} ({len(week_orders)} заказов)
-За месяц: {format_price(month_revenue)} ({len(month_orders)} заказов)
+<b>💰 Выручка (оплаченные заказы, дни по UTC):</b>
+Всего: {format_price(summary['all']['paid_revenue'])}
+За сегодня: {format_price(today['paid_revenue'])} ({today['orders_count']} заказов)
+За неделю: {format_price(week['paid_revenue'])} ({week['orders_count']} заказов)
+За месяц: {format_price(month['paid_revenue'])} ({month['orders_count']} заказов)
 
 <b>🔥 Топ-5 товаров:</b>
 """
-        
-        for i, (product, count) in enumerate(top_products, 1):
-            text += f"{i}. {product.name} - {count} продаж\n"
-        
-        await callback.message.edit_text(
-            text,
-            reply_markup=get_admin_stats_keyboard(theme)
-        )
-        await callback.answer()
+    
+    for i, product in enumerate(top_products, 1):
+        text += f"{i}. {product.product_name} - {product.units_sold} продаж\n"
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=get_admin_stats_keyboard(db_user.theme)
+    )
+    await callback.answer()
 
 
 # ============= BROADCAST =============
 
 @router.callback_query(F.data == "admin_broadcast")
-async def admin_broadcast(callback: CallbackQuery, state: FSMContext):
+async def admin_broadcast(callback: CallbackQuery, state: FSMContext, db_user: CachedUser):
     """Start broadcast message"""
-    with get_db() as db:
-        theme = get_user_theme(db, callback.from_user.id)
-        
-        await callback.message.edit_text(
-            "<b>📢 Рассылка сообщений</b>\n\nВведите текст сообщения для рассылки всем пользователям:",
-            reply_markup=get_back_to_admin_keyboard(theme)
-        )
-        await state.set_state(AdminStates.waiting_broadcast_message)
-        await callback.answer()
+    await callback.message.edit_text(
+        "<b>📢 Рассылка сообщений</b>\n\nВведите текст сообщения для рассылки всем пользователям:",
+        reply_markup=get_back_to_admin_keyboard(db_user.theme)
+    )
+    await state.set_state(AdminStates.waiting_broadcast_message)
+    await callback.answer()
 
 
 @router.message(AdminStates.waiting_broadcast_message)
@@ -813,46 +813,41 @@ async def process_broadcast(message: Message, state: FSMContext):
         await message.answer("❌ Сообщение слишком короткое. Введите минимум 5 символов:")
         return
     
-    with get_db() as db:
-        users = crud.get_all_users(db)
-        
-        sent = 0
-        failed = 0
-        blocked = 0
-        
-        status_msg = await message.answer(f"📤 Отправка... 0/{len(users)}")
-        
-        for i, user in enumerate(users, 1):
-            try:
-                await message.bot.send_message(user.telegram_id, broadcast_text)
-                sent += 1
-            except Exception as e:
-                if "blocked" in str(e).lower():
-                    blocked += 1
-                failed += 1
-            
-            if i % 5 == 0:
-                try:
-                    await status_msg.edit_text(f"📤 Отправка... {i}/{len(users)}")
-                except:
-                    pass
-        
-        theme = get_user_theme(db, message.from_user.id)
-        
-        await status_msg.edit_text(
-            f"✅ Рассылка завершена!\n\n"
-            f"Отправлено: {sent}\n"
-            f"Заблокировали бота: {blocked}\n"
-            f"Не доставлено: {failed - blocked}",
-            reply_markup=get_back_to_admin_keyboard(theme)
-        )
+    if broadcast.is_running():
+        await message.answer("⏳ Предыдущая рассылка ещё не завершена")
         await state.clear()
+        return
+    
+    status_msg = await message.answer(
+        "📤 Рассылка запущена...",
+        reply_markup=get_broadcast_progress_keyboard()
+    )
+    await broadcast.start_broadcast(
+        message.bot,
+        broadcast_text,
+        admin_chat_id=message.chat.id,
+        status_message_id=status_msg.message_id
+    )
+    await state.clear()
+
+
+@router.callback_query(F.data == "admin_broadcast_cancel")
+async def admin_broadcast_cancel(callback: CallbackQuery):
+    """Stop running broadcast"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    
+    if broadcast.cancel_broadcast():
+        await callback.answer("Рассылка будет остановлена")
+    else:
+        await callback.answer("Нет активной рассылки", show_alert=True)
 
 
 # ============= NAVIGATION =============
 
 @router.callback_query(F.data == "back_to_admin")
-async def back_to_admin(callback: CallbackQuery, state: FSMContext):
+async def back_to_admin(callback: CallbackQuery, state: FSMContext, db_user: CachedUser):
     """Return to admin main menu"""
     await state.clear()
     
@@ -861,5 +856,5 @@ async def back_to_admin(callback: CallbackQuery, state: FSMContext):
     fake_message.from_user = callback.from_user
     fake_message.answer = callback.message.edit_text
     
-    await admin_panel(fake_message, state)
+    await admin_panel(fake_message, state, db_user)
     await callback.answer()
@@ -4,10 +4,12 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.orm import Session
 
-from database.db import get_db
-from database import crud
+from database.db import get_async_db
+from database import async_crud
+from database.inventory import InsufficientStockError
 from utils.keyboards import get_cart_keyboard, get_back_button
-from utils.helpers import format_price, get_user_theme, is_subscribed
+from utils.helpers import format_cart, format_price, format_stock_shortages, get_user_theme, is_subscribed
+from utils.middleware import CachedUser
 from config import REQUIRED_CHANNEL_ID
 
 router = Router()
@@ -23,67 +25,50 @@ class CheckoutStates(StatesGroup):
 async def show_cart(callback: CallbackQuery):
     """Show user's cart"""
     try:
-        with get_db() as db:
-            user = crud.get_or_create_user(
-                db,
-                callback.from_user.id,
-                callback.from_user.username,
-                callback.from_user.first_name,
-                callback.from_user.last_name
-            )
-            
-            cart_items = crud.get_cart_items(db, user.id)
-            
-            if not cart_items:
-                await callback.message.edit_text(
-                    "<b>🛒 Ваша корзина</b>\n\nКорзина пуста. Добавьте товары из каталога!",
-                    reply_markup=get_back_button("main_menu")
-                )
-                await callback.answer()
-                return
-            
-            total = sum(item.product.price * item.quantity for item in cart_items)
-            
-            text = "<b>🛒 Ваша корзина</b>\n\n"
-            
-            for item in cart_items:
-                size_text = f" (Размер: {item.size})" if item.size else ""
-                item_total = item.product.price * item.quantity
-                text += f"<b>{item.product.name}</b>{size_text}\n"
-                text += f"{item.quantity} × {format_price(item.product.price)} = {format_price(item_total)}\n\n"
-            
-            text += f"<b>Итого: {format_price(total)}</b>"
-            
-            await callback.message.edit_text(
-                text,
-                reply_markup=get_cart_keyboard(cart_items, total)
-            )
-            await callback.answer()
+        async with get_async_db() as db:
+            view = await async_crud.get_cart_view(db, callback.from_user.id)
+        
+        await render_cart(callback, view)
+        await callback.answer()
     except Exception as e:
         await callback.answer("Произошла ошибка при загрузке корзины", show_alert=True)
         print(f"[ERROR] show_cart: {e}")
 
 
+async def render_cart(callback: CallbackQuery, view):
+    """Edit the callback message to show a cart view"""
+    if view.is_empty:
+        await callback.message.edit_text(
+            "<b>🛒 Ваша корзина</b>\n\nКорзина пуста. Добавьте товары из каталога!",
+            reply_markup=get_back_button("main_menu")
+        )
+        return
+    
+    await callback.message.edit_text(
+        format_cart(view),
+        reply_markup=get_cart_keyboard(view.items, view.total)
+    )
+
+
 @router.callback_query(F.data.startswith("cart_increase_"))
 async def increase_cart_item(callback: CallbackQuery):
     """Increase cart item quantity"""
     try:
-        with get_db() as db:
-            cart_item_id = int(callback.data.split("_")[-1])
-            
-            cart_item = crud.get_cart_item(db, cart_item_id)
-            if not cart_item:
+        cart_item_id = int(callback.data.split("_")[-1])
+        async with get_async_db() as db:
+            quantity = await async_crud.increase_cart_item(db, callback.from_user.id, cart_item_id)
+            view = await async_crud.get_cart_view(db, callback.from_user.id)
+        
+        if quantity is None:
+            line = next((item for item in view.items if item.id == cart_item_id), None)
+            if line is None:
                 await callback.answer("Товар не найден", show_alert=True)
-                return
-            
-            if cart_item.quantity >= cart_item.product.stock:
-                await callback.answer(f"Максимальное количество: {cart_item.product.stock}", show_alert=True)
-                return
-            
-            crud.update_cart_item(db, cart_item_id, cart_item.quantity + 1)
-            
-            await callback.answer("Количество увеличено")
-            await show_cart(callback)
+            else:
+                await callback.answer(f"Максимальное количество: {line.stock}", show_alert=True)
+            return
+        
+        await callback.answer("Количество увеличено")
+        await render_cart(callback, view)
     except Exception as e:
         await callback.answer("Ошибка при обновлении количества", show_alert=True)
         print(f"[ERROR] increase_cart_item: {e}")
@@ -92,101 +77,80 @@ async def increase_cart_item(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("cart_decrease_"))
 async def decrease_cart_item(callback: CallbackQuery):
     """Decrease cart item quantity"""
-    with get_db() as db:
-        cart_item_id = int(callback.data.split("_")[-1])
-        
-        cart_item = crud.get_cart_item(db, cart_item_id)
-        if not cart_item:
-            await callback.answer("Товар не найден", show_alert=True)
-            return
-        
-        if cart_item.quantity <= 1:
-            crud.remove_cart_item(db, cart_item_id)
-            await callback.answer("Товар удален из корзины")
-        else:
-            crud.update_cart_item(db, cart_item_id, cart_item.quantity - 1)
-            await callback.answer("Количество уменьшено")
-        
-        await show_cart(callback)
+    cart_item_id = int(callback.data.split("_")[-1])
+    async with get_async_db() as db:
+        quantity = await async_crud.decrease_cart_item(db, callback.from_user.id, cart_item_id)
+        view = await async_crud.get_cart_view(db, callback.from_user.id)
+    
+    if quantity is None:
+        await callback.answer("Товар не найден", show_alert=True)
+        return
+    
+    await callback.answer("Товар удален из корзины" if quantity == 0 else "Количество уменьшено")
+    await render_cart(callback, view)
 
 
 @router.callback_query(F.data.startswith("cart_remove_"))
 async def remove_cart_item(callback: CallbackQuery):
     """Remove item from cart"""
-    with get_db() as db:
-        cart_item_id = int(callback.data.split("_")[-1])
-        
-        crud.remove_cart_item(db, cart_item_id)
-        
-        await callback.answer("Товар удален из корзины")
-        await show_cart(callback)
+    cart_item_id = int(callback.data.split("_")[-1])
+    async with get_async_db() as db:
+        await async_crud.remove_user_cart_item(db, callback.from_user.id, cart_item_id)
+        view = await async_crud.get_cart_view(db, callback.from_user.id)
+    
+    await callback.answer("Товар удален из корзины")
+    await render_cart(callback, view)
 
 
 @router.callback_query(F.data == "clear_cart")
 async def clear_cart(callback: CallbackQuery):
     """Clear entire cart"""
-    with get_db() as db:
-        user = crud.get_or_create_user(
-            db,
-            callback.from_user.id,
-            callback.from_user.username,
-            callback.from_user.first_name,
-            callback.from_user.last_name
-        )
-        
-        crud.clear_cart(db, user.id)
-        
-        await callback.message.edit_text(
-            "<b>🛒 Корзина очищена</b>\n\nВсе товары удалены из корзины.",
-            reply_markup=get_back_button("main_menu")
-        )
-        await callback.answer("Корзина очищена")
+    async with get_async_db() as db:
+        await async_crud.clear_user_cart(db, callback.from_user.id)
+    
+    await callback.message.edit_text(
+        "<b>🛒 Корзина очищена</b>\n\nВсе товары удалены из корзины.",
+        reply_markup=get_back_button("main_menu")
+    )
+    await callback.answer("Корзина очищена")
 
 
 @router.callback_query(F.data == "checkout")
 async def start_checkout(callback: CallbackQuery, state: FSMContext):
     """Start checkout process"""
     try:
-        with get_db() as db:
-            if REQUIRED_CHANNEL_ID:
-                subscribed = await is_subscribed(callback.bot, callback.from_user.id, REQUIRED_CHANNEL_ID)
-                if not subscribed:
-                    from utils.keyboards import get_subscription_keyboard
-                    await callback.message.edit_text(
-                        "<b>⚠️ Требуется подписка</b>\n\nДля оформления заказа необходимо подписаться на наш канал.",
-                        reply_markup=get_subscription_keyboard()
-                    )
-                    await callback.answer()
-                    return
-            
-            user = crud.get_or_create_user(
-                db,
-                callback.from_user.id,
-                callback.from_user.username,
-                callback.from_user.first_name,
-                callback.from_user.last_name
-            )
-            
-            cart_items = crud.get_cart_items(db, user.id)
-            
-            if not cart_items:
-                await callback.answer("Корзина пуста", show_alert=True)
+        if REQUIRED_CHANNEL_ID:
+            subscribed = await is_subscribed(callback.bot, callback.from_user.id, REQUIRED_CHANNEL_ID)
+            if not subscribed:
+                from utils.keyboards import get_subscription_keyboard
+                await callback.message.edit_text(
+                    "<b>⚠️ Требуется подписка</b>\n\nДля оформления заказа необходимо подписаться на наш канал.",
+                    reply_markup=get_subscription_keyboard()
+                )
+                await callback.answer()
                 return
-            
-            for item in cart_items:
-                if item.product.stock < item.quantity:
-                    await callback.answer(
-                        f"Недостаточно товара {item.product.name} на складе (доступно: {item.product.stock})",
-                        show_alert=True
-                    )
-                    return
-            
-            await callback.message.edit_text(
-                "<b>📱 Оформление заказа</b>\n\nВведите ваш номер телефона для связи:",
-                reply_markup=get_back_button("cart")
-            )
-            await state.set_state(CheckoutStates.waiting_phone)
-            await callback.answer()
+        
+        async with get_async_db() as db:
+            view = await async_crud.get_cart_view(db, callback.from_user.id)
+        
+        if view.is_empty:
+            await callback.answer("Корзина пуста", show_alert=True)
+            return
+        
+        for item in view.items:
+            if item.stock < item.quantity:
+                await callback.answer(
+                    f"Недостаточно товара {item.name} на складе (доступно: {item.stock})",
+                    show_alert=True
+                )
+                return
+        
+        await callback.message.edit_text(
+            "<b>📱 Оформление заказа</b>\n\nВведите ваш номер телефона для связи:",
+            reply_markup=get_back_button("cart")
+        )
+        await state.set_state(CheckoutStates.waiting_phone)
+        await callback.answer()
     except Exception as e:
         await callback.answer("Ошибка при оформлении заказа", show_alert=True)
         print(f"[ERROR] start_checkout: {e}")
@@ -219,24 +183,16 @@ async def process_address(message: Message, state: FSMContext):
 
 
 @router.message(CheckoutStates.waiting_comment)
-async def process_comment(message: Message, state: FSMContext):
+async def process_comment(message: Message, state: FSMContext, db_user: CachedUser):
     """Process order comment and create order"""
-    with get_db() as db:
+    async with get_async_db() as db:
         comment = None if message.text == "/skip" else message.text.strip()
         
         data = await state.get_data()
         phone = data.get("phone")
         address = data.get("address")
         
-        user = crud.get_or_create_user(
-            db,
-            message.from_user.id,
-            message.from_user.username,
-            message.from_user.first_name,
-            message.from_user.last_name
-        )
-        
-        cart_items = crud.get_cart_items(db, user.id)
+        cart_items = await async_crud.get_cart_items(db, db_user.id, profile='cart_with_products')
         
         if not cart_items:
             await message.answer("Корзина пуста", reply_markup=get_back_button("main_menu"))
@@ -244,17 +200,22 @@ async def process_comment(message: Message, state: FSMContext):
             return
         
         # Create order
-        order = crud.create_order(
-            db,
-            user.id,
-            cart_items,
-            phone=phone,
-            delivery_address=address,
-            comment=comment
-        )
+        try:
+            order = await async_crud.create_order(
+                db,
+                db_user.id,
+                cart_items,
+                phone=phone,
+                delivery_address=address,
+                comment=comment
+            )
+        except InsufficientStockError as e:
+            await message.answer(format_stock_shortages(e.shortages), reply_markup=get_back_button("cart"))
+            await state.clear()
+            return
         
         # Clear cart
-        crud.clear_cart(db, user.id)
+        await async_crud.clear_cart(db, db_user.id)
         
         # Build order summary
         text = f"""
@@ -3,28 +3,28 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from sqlalchemy.orm import Session
 
-from database.db import get_db
-from database import crud
+from database.db import get_db, get_async_db
+from database import crud, async_crud
+from database.pagination import InvalidCursor
+from database.payments import OrderNotCancellable
 from utils.keyboards import get_orders_keyboard, get_order_detail_keyboard, get_back_button
 from utils.helpers import format_price, get_user_theme
+from utils.middleware import CachedUser
 
 router = Router()
 
 
 @router.callback_query(F.data == "my_orders")
-async def show_orders(callback: CallbackQuery):
+@router.callback_query(F.data.startswith("my_orders_p_"))
+async def show_orders(callback: CallbackQuery, db_user: CachedUser):
     """Show user's orders"""
+    cursor = callback.data.removeprefix("my_orders_p_") if callback.data != "my_orders" else None
     try:
-        with get_db() as db:
-            user = crud.get_or_create_user(
-                db,
-                callback.from_user.id,
-                callback.from_user.username,
-                callback.from_user.first_name,
-                callback.from_user.last_name
-            )
-            
-            orders = crud.get_orders(db, user_id=user.id, limit=20)
+        async with get_async_db() as db:
+            try:
+                orders, next_cursor = await async_crud.get_orders_page(db, user_id=db_user.id, cursor=cursor, limit=10)
+            except InvalidCursor:
+                orders, next_cursor = await async_crud.get_orders_page(db, user_id=db_user.id, limit=10)
             
             if not orders:
                 await callback.message.edit_text(
@@ -36,9 +36,10 @@ async def show_orders(callback: CallbackQuery):
             
             text = "<b>📦 Мои заказы</b>\n\nВыберите заказ для просмотра деталей:\n\n"
             
-            for order in orders[:10]:
+            for order in orders:
                 status_text = {
                     'pending': '⏳ Ожидает оплаты',
+                    'paid': '✅ Оплачен',
                     'processing': '🔄 В обработке',
                     'completed': '✅ Завершен',
                     'cancelled': '❌ Отменен'
@@ -49,7 +50,7 @@ async def show_orders(callback: CallbackQuery):
             
             await callback.message.edit_text(
                 text,
-                reply_markup=get_orders_keyboard(orders)
+                reply_markup=get_orders_keyboard(orders, next_cursor)
             )
             await callback.answer()
     except Exception as e:
@@ -58,32 +59,25 @@ async def show_orders(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("order_"))
-async def show_order_details(callback: CallbackQuery):
+async def show_order_details(callback: CallbackQuery, db_user: CachedUser):
     """Show order details"""
     try:
-        with get_db() as db:
+        async with get_async_db() as db:
             order_id = int(callback.data.split("_")[-1])
             
-            order = crud.get_order(db, order_id)
+            order = await async_crud.get_order(db, order_id, profile='order_with_items')
             
             if not order:
                 await callback.answer("Заказ не найден", show_alert=True)
                 return
             
-            user = crud.get_or_create_user(
-                db,
-                callback.from_user.id,
-                callback.from_user.username,
-                callback.from_user.first_name,
-                callback.from_user.last_name
-            )
-            
-            if order.user_id != user.id:
+            if order.user_id != db_user.id:
                 await callback.answer("Это не ваш заказ", show_alert=True)
                 return
             
             status_text = {
                 'pending': '⏳ Ожидает оплаты',
+                'paid': '✅ Оплачен',
                 'processing': '🔄 В обработке',
                 'completed': '✅ Завершен',
                 'cancelled': '❌ Отменен'
@@ -123,38 +117,25 @@ async def show_order_details(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("cancel_order_"))
-async def cancel_order(callback: CallbackQuery):
+async def cancel_order(callback: CallbackQuery, db_user: CachedUser):
     """Cancel order"""
     try:
-        with get_db() as db:
+        async with get_async_db() as db:
             order_id = int(callback.data.split("_")[-1])
             
-            order = crud.get_order(db, order_id)
+            # Checks ownership, status and a pending payment under the row lock
+            try:
+                order = await async_crud.cancel_order(db, order_id, user_id=db_user.id)
+            except OrderNotCancellable as e:
+                await callback.answer(str(e), show_alert=True)
+                return
             
             if not order:
                 await callback.answer("Заказ не найден", show_alert=True)
                 return
             
-            user = crud.get_or_create_user(
-                db,
-                callback.from_user.id,
-                callback.from_user.username,
-                callback.from_user.first_name,
-                callback.from_user.last_name
-            )
-            
-            if order.user_id != user.id:
-                await callback.answer("Это не ваш заказ", show_alert=True)
-                return
-            
-            if order.status != 'pending':
-                await callback.answer("Этот заказ нельзя отменить", show_alert=True)
-                return
-            
-            crud.update_order_status(db, order_id, 'cancelled')
-            
             await callback.answer("Заказ отменен", show_alert=True)
-            await show_orders(callback)
+            await show_orders(callback, db_user)
     except Exception as e:
         await callback.answer("Ошибка при отмене заказа", show_alert=True)
         print(f"[ERROR] cancel_order: {e}")
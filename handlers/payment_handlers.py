@@ -4,11 +4,14 @@ from aiogram.filters import Command
 from sqlalchemy.orm import Session
 import logging
 
-from database.db import get_db
-from database import crud
-from utils.payment import create_payment, check_payment_status
+from database.db import get_async_db
+from database import async_crud
+from database.payments import ORDER_PAID_EVENT, ORDER_REFUND_EVENT, needs_refund
+from utils import outbox_worker
+from utils.payment import payment_gateway
 from utils.keyboards import get_back_button
 from utils.helpers import format_price
+from utils.middleware import CachedUser
 from config import ADMIN_IDS
 
 router = Router()
@@ -16,63 +19,60 @@ logger = logging.getLogger(__name__)
 
 
 @router.callback_query(F.data.startswith("pay_order_"))
-async def initiate_payment(callback: CallbackQuery):
+async def initiate_payment(callback: CallbackQuery, db_user: CachedUser):
     """Initiate payment for order"""
-    with get_db() as db:
-        order_id = int(callback.data.split("_")[-1])
-        
-        order = crud.get_order(db, order_id)
-        
-        if not order:
-            await callback.answer("Заказ не найден", show_alert=True)
-            return
-        
-        # Check if user owns this order
-        user = crud.get_or_create_user(
-            db,
-            callback.from_user.id,
-            callback.from_user.username,
-            callback.from_user.first_name,
-            callback.from_user.last_name
-        )
-        
-        if order.user_id != user.id:
-            await callback.answer("Это не ваш заказ", show_alert=True)
-            return
-        
-        if order.status == 'completed':
-            await callback.answer("Заказ уже оплачен", show_alert=True)
-            return
-        
-        if order.status == 'cancelled':
-            await callback.answer("Заказ отменен", show_alert=True)
-            return
-        
-        # Create payment
-        payment_data = create_payment(
-            amount=order.total_amount,
-            order_id=order.id,
-            description=f"Оплата заказа #{order.id}",
-            return_url=f"https://t.me/{(await callback.bot.get_me()).username}"
-        )
-        
-        if not payment_data:
-            await callback.answer("Ошибка создания платежа. Попробуйте позже.", show_alert=True)
-            return
-        
-        # Update order with payment ID
-        crud.update_order_status(db, order.id, 'pending', payment_id=payment_data['id'])
-        
-        # Send payment link
-        from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="💳 Оплатить", url=payment_data['confirmation_url'])],
-            [InlineKeyboardButton(text="🔄 Проверить оплату", callback_data=f"check_payment_{order.id}")],
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="my_orders")]
-        ])
-        
-        text = f"""
+    order_id = int(callback.data.split("_")[-1])
+    
+    async with get_async_db() as db:
+        order = await async_crud.get_order(db, order_id)
+    
+    if not order:
+        await callback.answer("Заказ не найден", show_alert=True)
+        return
+    
+    # Check if user owns this order
+    if order.user_id != db_user.id:
+        await callback.answer("Это не ваш заказ", show_alert=True)
+        return
+    
+    if order.status == 'completed' or order.payment_status == 'succeeded':
+        await callback.answer("Заказ уже оплачен", show_alert=True)
+        return
+    
+    if order.status == 'cancelled':
+        await callback.answer("Заказ отменен", show_alert=True)
+        return
+    
+    # No session is held while waiting for YooKassa
+    payment_data = await payment_gateway.create_payment(
+        amount=order.total_amount,
+        order_id=order.id,
+        description=f"Оплата заказа #{order.id}",
+        return_url=f"https://t.me/{(await callback.bot.get_me()).username}"
+    )
+    
+    if not payment_data:
+        await callback.answer("Ошибка создания платежа. Попробуйте позже.", show_alert=True)
+        return
+    
+    # The order may have been cancelled (or expired) while YooKassa answered
+    async with get_async_db() as db:
+        attached = await async_crud.attach_payment(db, order.id, payment_data['id'])
+    
+    if not attached:
+        await callback.answer("Заказ отменен или уже оплачен", show_alert=True)
+        return
+    
+    # Send payment link
+    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="💳 Оплатить", url=payment_data['confirmation_url'])],
+        [InlineKeyboardButton(text="🔄 Проверить оплату", callback_data=f"check_payment_{order.id}")],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data="my_orders")]
+    ])
+    
+    text = f"""
 <b>💳 Оплата заказа #{order.id}</b>
 
 <b>Сумма:</b> {format_price(order.total_amount)}
@@ -80,43 +80,58 @@ async def initiate_payment(callback: CallbackQuery):
 Нажмите кнопку "Оплатить" для перехода на страницу оплаты.
 После оплаты нажмите "Проверить оплату" для обновления статуса.
 """
-        
-        await callback.message.edit_text(text, reply_markup=keyboard)
-        await callback.answer()
+    
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
 
 
 @router.callback_query(F.data.startswith("check_payment_"))
 async def check_payment(callback: CallbackQuery):
     """Check payment status"""
-    with get_db() as db:
-        order_id = int(callback.data.split("_")[-1])
-        
-        order = crud.get_order(db, order_id)
-        
-        if not order:
-            await callback.answer("Заказ не найден", show_alert=True)
-            return
-        
-        if not order.payment_id:
-            await callback.answer("Платеж не найден", show_alert=True)
-            return
-        
-        # Check payment status
-        payment_status = check_payment_status(order.payment_id)
+    order_id = int(callback.data.split("_")[-1])
+    
+    async with get_async_db() as db:
+        order = await async_crud.get_order(db, order_id)
+    
+    if not order:
+        await callback.answer("Заказ не найден", show_alert=True)
+        return
+    
+    if not order.payment_id:
+        await callback.answer("Платеж не найден", show_alert=True)
+        return
+    
+    # Usually already settled by the YooKassa webhook
+    if order.payment_status == 'succeeded':
+        payment_status = {'status': 'succeeded', 'paid': True}
+    else:
+        payment_status = await payment_gateway.check_payment_status(order.payment_id)
         
         if not payment_status:
             await callback.answer("Ошибка проверки платежа", show_alert=True)
             return
         
-        if payment_status['status'] == 'succeeded' and payment_status['paid']:
-            # Update order status
-            crud.update_order_status(db, order.id, 'completed')
-            
-            # Notify admins
-            await notify_admins_about_order(callback.bot, order)
-            
-            await callback.message.edit_text(
-                f"""
+        # Queues the admin notification if the order becomes paid
+        async with get_async_db() as db:
+            order = await async_crud.apply_payment_status(db, payment_status) or order
+    
+    if needs_refund(order):
+        await callback.message.edit_text(
+            f"""
+<b>⚠️ Заказ #{order.id} был отменен до оплаты</b>
+
+Товара больше нет в наличии. Оплата будет возвращена,
+администратор свяжется с вами.
+
+<b>Сумма:</b> {format_price(order.total_amount)}
+""",
+            reply_markup=get_back_button("my_orders")
+        )
+        await callback.answer()
+    
+    elif payment_status['status'] == 'succeeded' and payment_status['paid']:
+        await callback.message.edit_text(
+            f"""
 <b>✅ Оплата успешна!</b>
 
 Заказ #{order.id} оплачен и принят в обработку.
@@ -124,23 +139,80 @@ async def check_payment(callback: CallbackQuery):
 
 <b>Сумма:</b> {format_price(order.total_amount)}
 """,
-                reply_markup=get_back_button("my_orders")
-            )
-            await callback.answer("Оплата подтверждена!", show_alert=True)
-        
-        elif payment_status['status'] == 'canceled':
-            crud.update_order_status(db, order.id, 'cancelled')
-            await callback.answer("Платеж отменен", show_alert=True)
-            await callback.message.edit_text(
-                f"❌ Платеж отменен.\n\nЗаказ #{order.id} отменен.",
-                reply_markup=get_back_button("my_orders")
-            )
-        
-        else:
-            await callback.answer(
-                f"Статус платежа: {payment_status['status']}\nОжидаем оплату...",
-                show_alert=True
-            )
+            reply_markup=get_back_button("my_orders")
+        )
+        await callback.answer("Оплата подтверждена!", show_alert=True)
+    
+    elif payment_status['status'] == 'canceled':
+        await callback.answer("Платеж отменен", show_alert=True)
+        await callback.message.edit_text(
+            f"❌ Платеж отменен.\n\nЗаказ #{order.id} отменен.",
+            reply_markup=get_back_button("my_orders")
+        )
+    
+    else:
+        await callback.answer(
+            f"Статус платежа: {payment_status['status']}\nОжидаем оплату...",
+            show_alert=True
+        )
+
+
+@outbox_worker.handler(ORDER_PAID_EVENT)
+async def deliver_order_paid(bot, payload: dict):
+    """Outbox delivery of an order that became paid"""
+    async with get_async_db() as db:
+        order = await async_crud.get_order(db, payload['order_id'], profile='order_with_items_and_user')
+    if order:
+        await notify_admins_about_order(bot, order)
+
+
+@outbox_worker.handler(ORDER_REFUND_EVENT)
+async def deliver_order_refund(bot, payload: dict):
+    """Outbox delivery of an order paid after it was cancelled and sold out"""
+    async with get_async_db() as db:
+        order = await async_crud.get_order(db, payload['order_id'], profile='order_with_items_and_user')
+    if order:
+        await notify_admins_about_refund(bot, order)
+
+
+async def _send_to_admins(bot, order, text: str):
+    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📦 Управление заказом", callback_data=f"admin_order_{order.id}")]
+    ])
+    
+    delivered = 0
+    last_error = None
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(admin_id, text, reply_markup=keyboard)
+            delivered += 1
+        except Exception as e:
+            last_error = e
+            logger.error(f"Failed to notify admin {admin_id}: {e}")
+    
+    # Failing lets the outbox retry with backoff; a partial delivery counts as
+    # done so that admins who got the message are not notified twice
+    if last_error is not None and not delivered:
+        raise RuntimeError(f"Order {order.id} notification reached no admin") from last_error
+
+
+async def notify_admins_about_refund(bot, order):
+    """Ask admins to refund an order paid after it was cancelled"""
+    text = f"""
+⚠️ <b>Нужен возврат по заказу #{order.id}</b>
+
+Заказ оплачен после отмены, а товара уже нет в наличии.
+Верните оплату в личном кабинете ЮKassa и свяжитесь с покупателем.
+
+<b>👤 Покупатель:</b>
+ID: {order.user.telegram_id}
+Username: @{order.user.username or 'не указан'}
+<b>💳 Платеж:</b> {order.payment_id}
+<b>💰 Сумма:</b> {format_price(order.total_amount)}
+"""
+    await _send_to_admins(bot, order, text)
 
 
 async def notify_admins_about_order(bot, order):
@@ -169,14 +241,4 @@ Username: @{order.user.username or 'не указан'}
     if order.comment:
         text += f"\n<b>💬 Комментарий:</b> {order.comment}"
     
-    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📦 Управление заказом", callback_data=f"admin_order_{order.id}")]
-    ])
-    
-    for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(admin_id, text, reply_markup=keyboard)
-        except Exception as e:
-            logger.error(f"Failed to notify admin {admin_id}: {e}")
+    await _send_to_admins(bot, order, text)
@@ -3,8 +3,10 @@ from aiogram.filters import CommandStart, Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database.db import get_db
-from database import crud
+from database.db import get_async_db
+from database import async_crud, catalog_cache
+from database.inventory import InsufficientStockError
+from database.pagination import InvalidCursor
 from utils.keyboards import (
     get_main_menu_keyboard, get_categories_keyboard, get_products_keyboard,
     get_product_keyboard, get_cart_keyboard, get_orders_keyboard,
@@ -12,8 +14,9 @@ from utils.keyboards import (
 )
 from utils.helpers import (
     check_subscription, is_admin, format_price, format_order_details,
-    format_product_details, get_or_create_user_from_telegram
+    format_product_details, format_stock_shortages, format_cart
 )
+from utils.middleware import CachedUser, invalidate_user
 from utils.error_handler import error_handler, ValidationError, validate_phone, sanitize_text
 import json
 
@@ -28,14 +31,12 @@ class CheckoutStates(StatesGroup):
 
 @router.message(CommandStart())
 @error_handler
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, db_user: CachedUser):
     """Start command handler"""
     await state.clear()
     
-    user = await get_or_create_user_from_telegram(message.from_user)
-    
     # Check if user is blocked
-    if user.is_blocked:
+    if db_user.is_blocked:
         await message.answer("❌ Ваш аккаунт заблокирован. Обратитесь к администратору.")
         return
     
@@ -59,22 +60,21 @@ async def cmd_start(message: Message, state: FSMContext):
     
     await message.answer(
         welcome_text,
-        reply_markup=get_main_menu_keyboard(is_admin(message.from_user.id), user.theme)
+        reply_markup=get_main_menu_keyboard(is_admin(message.from_user.id), db_user.theme)
     )
 
 
 @router.callback_query(F.data == "check_subscription")
 @error_handler
-async def check_sub_callback(callback: CallbackQuery):
+async def check_sub_callback(callback: CallbackQuery, db_user: CachedUser):
     """Check subscription callback"""
     subscribed = await check_subscription(callback.bot, callback.from_user.id)
     
     if subscribed:
-        user = await get_or_create_user_from_telegram(callback.from_user)
         await callback.message.edit_text(
             "✅ Отлично! Вы подписаны на канал.\n\n"
             "Выберите действие из меню:",
-            reply_markup=get_main_menu_keyboard(is_admin(callback.from_user.id), user.theme)
+            reply_markup=get_main_menu_keyboard(is_admin(callback.from_user.id), db_user.theme)
         )
     else:
         await callback.answer("❌ Вы еще не подписались на канал!", show_alert=True)
@@ -82,27 +82,25 @@ async def check_sub_callback(callback: CallbackQuery):
 
 @router.callback_query(F.data == "main_menu")
 @error_handler
-async def main_menu_callback(callback: CallbackQuery, state: FSMContext):
+async def main_menu_callback(callback: CallbackQuery, state: FSMContext, db_user: CachedUser):
     """Main menu callback"""
     await state.clear()
     
-    user = await get_or_create_user_from_telegram(callback.from_user)
-    
     await callback.message.edit_text(
         "🏠 Главное меню\n\nВыберите действие:",
-        reply_markup=get_main_menu_keyboard(is_admin(callback.from_user.id), user.theme)
+        reply_markup=get_main_menu_keyboard(is_admin(callback.from_user.id), db_user.theme)
     )
     await callback.answer()
 
 
 @router.callback_query(F.data == "toggle_theme")
 @error_handler
-async def toggle_theme_callback(callback: CallbackQuery):
+async def toggle_theme_callback(callback: CallbackQuery, db_user: CachedUser):
     """Toggle theme callback"""
-    with get_db() as db:
-        user = crud.get_user_by_telegram_id(db, callback.from_user.id)
-        new_theme = 'dark' if user.theme == 'light' else 'light'
-        crud.update_user_theme(db, callback.from_user.id, new_theme)
+    async with get_async_db() as db:
+        new_theme = 'dark' if db_user.theme == 'light' else 'light'
+        await async_crud.update_user_theme(db, callback.from_user.id, new_theme)
+        invalidate_user(callback.from_user.id)
         
         theme_name = "Темная" if new_theme == 'dark' else "Светлая"
         
@@ -140,17 +138,17 @@ async def about_callback(callback: CallbackQuery):
 @error_handler
 async def catalog_callback(callback: CallbackQuery):
     """Catalog callback"""
-    with get_db() as db:
-        categories = crud.get_categories(db, active_only=True)
-        
-        if not categories:
-            await callback.answer("❌ Каталог пуст", show_alert=True)
-            return
-        
-        await callback.message.edit_text(
-            "📁 <b>Категории товаров</b>\n\nВыберите категорию:",
-            reply_markup=get_categories_keyboard(categories)
-        )
+    snapshot = await catalog_cache.aget_snapshot()
+    categories = snapshot.get_categories(active_only=True)
+    
+    if not categories:
+        await callback.answer("❌ Каталог пуст", show_alert=True)
+        return
+    
+    await callback.message.edit_text(
+        "📁 <b>Категории товаров</b>\n\nВыберите категорию:",
+        reply_markup=get_categories_keyboard(categories)
+    )
     await callback.answer()
 
 
@@ -160,48 +158,48 @@ async def category_callback(callback: CallbackQuery):
     """Category callback"""
     category_id = int(callback.data.split("_")[1])
     
-    with get_db() as db:
-        category = crud.get_category(db, category_id)
-        if not category:
-            await callback.answer("❌ Категория не найдена", show_alert=True)
-            return
-        
-        products = crud.get_products(db, category_id=category_id, active_only=True)
-        
-        if not products:
-            await callback.answer("❌ В этой категории пока нет товаров", show_alert=True)
-            return
-        
-        await callback.message.edit_text(
-            f"🛍 <b>{category.name}</b>\n\n{category.description or 'Выберите товар:'}",
-            reply_markup=get_products_keyboard(products, category_id)
-        )
+    snapshot = await catalog_cache.aget_snapshot()
+    category = snapshot.categories.get(category_id)
+    if not category:
+        await callback.answer("❌ Категория не найдена", show_alert=True)
+        return
+    
+    products = snapshot.get_products(category_id)
+    
+    if not products:
+        await callback.answer("❌ В этой категории пока нет товаров", show_alert=True)
+        return
+    
+    await callback.message.edit_text(
+        f"🛍 <b>{category.name}</b>\n\n{category.description or 'Выберите товар:'}",
+        reply_markup=get_products_keyboard(products, category_id)
+    )
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("product_"))
 @error_handler
-async def product_callback(callback: CallbackQuery):
+async def product_callback(callback: CallbackQuery, db_user: CachedUser):
     """Product detail callback"""
     product_id = int(callback.data.split("_")[1])
     
-    with get_db() as db:
-        product = crud.get_product(db, product_id)
-        if not product:
-            await callback.answer("❌ Товар не найден", show_alert=True)
-            return
-        
+    snapshot = await catalog_cache.aget_snapshot()
+    product = snapshot.get_product(product_id)
+    if not product:
+        await callback.answer("❌ Товар не найден", show_alert=True)
+        return
+    product = (await catalog_cache.aget_stock()).apply(product)
+    
+    async with get_async_db() as db:
         # Check if product is in cart
-        user = crud.get_user_by_telegram_id(db, callback.from_user.id)
-        cart_items = crud.get_cart_items(db, user.id)
+        cart_items = await async_crud.get_cart_items(db, db_user.id)
         in_cart = any(item.product_id == product_id for item in cart_items)
         
         text = format_product_details(product)
         
         # Send photo if available
-        if product.photos:
-            photo_ids = product.photos.split(',')
-            first_photo = photo_ids[0].strip()
+        if product.photo_list:
+            first_photo = product.photo_list[0]
             await callback.message.delete()
             await callback.message.answer_photo(
                 photo=first_photo,
@@ -222,31 +220,34 @@ async def size_chart_callback(callback: CallbackQuery):
     """Size chart callback"""
     product_id = int(callback.data.split("_")[2])
     
-    with get_db() as db:
-        product = crud.get_product(db, product_id)
-        if not product or not product.size_chart:
-            await callback.answer("❌ Размерная сетка недоступна", show_alert=True)
-            return
-        
-        await callback.answer(product.size_chart, show_alert=True)
+    snapshot = await catalog_cache.aget_snapshot()
+    product = snapshot.get_product(product_id)
+    if not product or not product.size_chart:
+        await callback.answer("❌ Размерная сетка недоступна", show_alert=True)
+        return
+    
+    await callback.answer(product.size_chart, show_alert=True)
 
 
 @router.callback_query(F.data.startswith("add_to_cart_"))
-async def add_to_cart_callback(callback: CallbackQuery):
+async def add_to_cart_callback(callback: CallbackQuery, db_user: CachedUser):
     """Add to cart callback"""
     parts = callback.data.split("_")
     product_id = int(parts[3])
     size = parts[4] if parts[4] != "none" else None
     
-    with get_db() as db:
-        user = crud.get_user_by_telegram_id(db, callback.from_user.id)
-        product = crud.get_product(db, product_id)
+    async with get_async_db() as db:
+        product = await async_crud.get_product(db, product_id)
         
         if not product or product.stock <= 0:
             await callback.answer("❌ Товар недоступен", show_alert=True)
             return
         
-        crud.add_to_cart(db, user.id, product_id, quantity=1, size=size)
+        try:
+            await async_crud.add_to_cart(db, db_user.id, product_id, quantity=1, size=size)
+        except InsufficientStockError:
+            await callback.answer("❌ Недостаточно товара на складе", show_alert=True)
+            return
         
         size_text = f" (размер {size})" if size else ""
         await callback.answer(f"✅ {product.name}{size_text} добавлен в корзину!")
@@ -256,38 +257,26 @@ async def add_to_cart_callback(callback: CallbackQuery):
 @error_handler
 async def cart_callback(callback: CallbackQuery):
     """Cart callback"""
-    with get_db() as db:
-        user = crud.get_user_by_telegram_id(db, callback.from_user.id)
-        cart_items = crud.get_cart_items(db, user.id)
-        
-        if not cart_items:
-            await callback.message.edit_text(
-                "🛒 Ваша корзина пуста\n\nДобавьте товары из каталога!",
-                reply_markup=get_back_button("main_menu")
-            )
-            await callback.answer()
-            return
-        
-        total = sum(item.product.price * item.quantity for item in cart_items)
-        
-        items_text = "\n".join([
-            f"• {item.product.name} {f'({item.size})' if item.size else ''} x{item.quantity} - {format_price(item.product.price * item.quantity)}"
-            for item in cart_items
-        ])
-        
-        text = f"""
-🛒 <b>Ваша корзина</b>
+    async with get_async_db() as db:
+        view = await async_crud.get_cart_view(db, callback.from_user.id)
+    
+    await show_cart_view(callback, view)
+    await callback.answer()
 
-{items_text}
 
-<b>Итого:</b> {format_price(total)}
-"""
-        
+async def show_cart_view(callback: CallbackQuery, view):
+    """Render a cart view into the callback message"""
+    if view.is_empty:
         await callback.message.edit_text(
-            text,
-            reply_markup=get_cart_keyboard(cart_items, total)
+            "🛒 Ваша корзина пуста\n\nДобавьте товары из каталога!",
+            reply_markup=get_back_button("main_menu")
         )
-    await callback.answer()
+        return
+    
+    await callback.message.edit_text(
+        format_cart(view),
+        reply_markup=get_cart_keyboard(view.items, view.total)
+    )
 
 
 @router.callback_query(F.data.startswith("cart_increase_"))
@@ -295,16 +284,15 @@ async def cart_increase_callback(callback: CallbackQuery):
     """Increase cart item quantity"""
     cart_item_id = int(callback.data.split("_")[2])
     
-    with get_db() as db:
-        cart_item = db.query(crud.CartItem).filter(crud.CartItem.id == cart_item_id).first()
-        if cart_item and cart_item.product.stock > cart_item.quantity:
-            crud.update_cart_item(db, cart_item_id, cart_item.quantity + 1)
-            await callback.answer("✅ Количество увеличено")
-        else:
-            await callback.answer("❌ Недостаточно товара на складе", show_alert=True)
+    async with get_async_db() as db:
+        quantity = await async_crud.increase_cart_item(db, callback.from_user.id, cart_item_id)
+        view = await async_crud.get_cart_view(db, callback.from_user.id)
     
-    # Refresh cart
-    await cart_callback(callback)
+    if quantity is None:
+        await callback.answer("❌ Недостаточно товара на складе", show_alert=True)
+    else:
+        await callback.answer("✅ Количество увеличено")
+    await show_cart_view(callback, view)
 
 
 @router.callback_query(F.data.startswith("cart_decrease_"))
@@ -312,15 +300,13 @@ async def cart_decrease_callback(callback: CallbackQuery):
     """Decrease cart item quantity"""
     cart_item_id = int(callback.data.split("_")[2])
     
-    with get_db() as db:
-        cart_item = db.query(crud.CartItem).filter(crud.CartItem.id == cart_item_id).first()
-        if cart_item:
-            new_quantity = cart_item.quantity - 1
-            crud.update_cart_item(db, cart_item_id, new_quantity)
-            await callback.answer("✅ Количество уменьшено" if new_quantity > 0 else "✅ Товар удален")
+    async with get_async_db() as db:
+        quantity = await async_crud.decrease_cart_item(db, callback.from_user.id, cart_item_id)
+        view = await async_crud.get_cart_view(db, callback.from_user.id)
     
-    # Refresh cart
-    await cart_callback(callback)
+    if quantity is not None:
+        await callback.answer("✅ Количество уменьшено" if quantity > 0 else "✅ Товар удален")
+    await show_cart_view(callback, view)
 
 
 @router.callback_query(F.data.startswith("cart_remove_"))
@@ -328,25 +314,24 @@ async def cart_remove_callback(callback: CallbackQuery):
     """Remove item from cart"""
     cart_item_id = int(callback.data.split("_")[2])
     
-    with get_db() as db:
-        crud.update_cart_item(db, cart_item_id, 0)
-        await callback.answer("✅ Товар удален из корзины")
+    async with get_async_db() as db:
+        await async_crud.remove_user_cart_item(db, callback.from_user.id, cart_item_id)
+        view = await async_crud.get_cart_view(db, callback.from_user.id)
     
-    # Refresh cart
-    await cart_callback(callback)
+    await callback.answer("✅ Товар удален из корзины")
+    await show_cart_view(callback, view)
 
 
 @router.callback_query(F.data == "clear_cart")
 async def clear_cart_callback(callback: CallbackQuery):
     """Clear cart callback"""
-    with get_db() as db:
-        user = crud.get_user_by_telegram_id(db, callback.from_user.id)
-        crud.clear_cart(db, user.id)
-        
-        await callback.message.edit_text(
-            "✅ Корзина очищена",
-            reply_markup=get_back_button("main_menu")
-        )
+    async with get_async_db() as db:
+        await async_crud.clear_user_cart(db, callback.from_user.id)
+    
+    await callback.message.edit_text(
+        "✅ Корзина очищена",
+        reply_markup=get_back_button("main_menu")
+    )
     await callback.answer()
 
 
@@ -402,14 +387,13 @@ async def process_address(message: Message, state: FSMContext):
 
 @router.message(CheckoutStates.waiting_for_comment)
 @error_handler
-async def process_comment(message: Message, state: FSMContext):
+async def process_comment(message: Message, state: FSMContext, db_user: CachedUser):
     """Process comment and create order"""
     data = await state.get_data()
     comment = None if message.text == '-' else sanitize_text(message.text, max_length=500)
     
-    with get_db() as db:
-        user = crud.get_user_by_telegram_id(db, message.from_user.id)
-        cart_items = crud.get_cart_items(db, user.id)
+    async with get_async_db() as db:
+        cart_items = await async_crud.get_cart_items(db, db_user.id, profile='cart_with_products')
         
         if not cart_items:
             await message.answer(
@@ -420,17 +404,22 @@ async def process_comment(message: Message, state: FSMContext):
             return
         
         # Create order
-        order = crud.create_order(
-            db,
-            user_id=user.id,
-            cart_items=cart_items,
-            phone=data['phone'],
-            delivery_address=data['address'],
-            comment=comment
-        )
+        try:
+            order = await async_crud.create_order(
+                db,
+                user_id=db_user.id,
+                cart_items=cart_items,
+                phone=data['phone'],
+                delivery_address=data['address'],
+                comment=comment
+            )
+        except InsufficientStockError as e:
+            await message.answer(format_stock_shortages(e.shortages), reply_markup=get_back_button("cart"))
+            await state.clear()
+            return
         
         # Clear cart
-        crud.clear_cart(db, user.id)
+        await async_crud.clear_cart(db, db_user.id)
         
         order_text = format_order_details(order)
         
@@ -444,11 +433,15 @@ async def process_comment(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "my_orders")
-async def my_orders_callback(callback: CallbackQuery):
+@router.callback_query(F.data.startswith("my_orders_p_"))
+async def my_orders_callback(callback: CallbackQuery, db_user: CachedUser):
     """My orders callback"""
-    with get_db() as db:
-        user = crud.get_user_by_telegram_id(db, callback.from_user.id)
-        orders = crud.get_orders(db, user_id=user.id, limit=10)
+    cursor = callback.data.removeprefix("my_orders_p_") if callback.data != "my_orders" else None
+    async with get_async_db() as db:
+        try:
+            orders, next_cursor = await async_crud.get_orders_page(db, user_id=db_user.id, cursor=cursor, limit=10)
+        except InvalidCursor:
+            orders, next_cursor = await async_crud.get_orders_page(db, user_id=db_user.id, limit=10)
         
         if not orders:
             await callback.message.edit_text(
@@ -460,7 +453,7 @@ async def my_orders_callback(callback: CallbackQuery):
         
         await callback.message.edit_text(
             "📦 <b>Ваши заказы</b>\n\nВыберите заказ для просмотра:",
-            reply_markup=get_orders_keyboard(orders)
+            reply_markup=get_orders_keyboard(orders, next_cursor)
         )
     await callback.answer()
 
@@ -470,8 +463,8 @@ async def order_detail_callback(callback: CallbackQuery):
     """Order detail callback"""
     order_id = int(callback.data.split("_")[1])
     
-    with get_db() as db:
-        order = crud.get_order(db, order_id)
+    async with get_async_db() as db:
+        order = await async_crud.get_order(db, order_id, profile='order_with_items')
         if not order:
             await callback.answer("❌ Заказ не найден", show_alert=True)
             return
@@ -485,24 +478,6 @@ async def order_detail_callback(callback: CallbackQuery):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("cancel_order_"))
-async def cancel_order_callback(callback: CallbackQuery):
-    """Cancel order callback"""
-    order_id = int(callback.data.split("_")[2])
-    
-    with get_db() as db:
-        order = crud.update_order_status(db, order_id, 'cancelled')
-        
-        if order:
-            await callback.answer("✅ Заказ отменен")
-            await callback.message.edit_text(
-                f"❌ Заказ {order.order_number} отменен",
-                reply_markup=get_back_button("my_orders")
-            )
-        else:
-            await callback.answer("❌ Ошибка отмены заказа", show_alert=True)
-
-
 @router.callback_query(F.data == "noop")
 async def noop_callback(callback: CallbackQuery):
     """No operation callback"""
@@ -4,6 +4,7 @@ Runs both services in parallel with shared database
 """
 import asyncio
 import logging
+import signal
 import sys
 import os
 from threading import Thread
@@ -20,7 +21,7 @@ logger = logging.getLogger(__name__)
 
 
 def run_webapp():
-    """Run Flask web application"""
+    """Run Flask web application on the development server (WEBAPP_SERVER=flask)"""
     from webapp.app import app
     import config
     
@@ -35,14 +36,10 @@ def run_webapp():
 
 async def run_bot():
     """Run Telegram bot"""
-    from aiogram import Bot, Dispatcher
-    from aiogram.client.default import DefaultBotProperties
-    from aiogram.enums import ParseMode
-    from aiogram.fsm.storage.memory import MemoryStorage
-    
     import config
-    from database.db import init_db, check_db_connection
-    from handlers import user_handlers, admin_handlers, cart_handlers, order_handlers, payment_handlers
+    from database.db import init_db, check_db_connection, dispose_async_engine
+    from bot import create_bot, create_dispatcher, run_dispatcher
+    from utils.payment import payment_gateway
     
     logger.info("Initializing shared database...")
     try:
@@ -57,45 +54,106 @@ async def run_bot():
         sys.exit(1)
     
     # Initialize bot and dispatcher
-    bot = Bot(
-        token=config.BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-    )
-    
-    dp = Dispatcher(storage=MemoryStorage())
+    bot = create_bot()
+    dp = create_dispatcher()
     
-    # Register routers
-    dp.include_router(user_handlers.router)
-    dp.include_router(admin_handlers.router)
-    dp.include_router(cart_handlers.router)
-    dp.include_router(order_handlers.router)
-    dp.include_router(payment_handlers.router)
-    
-    logger.info("Telegram Bot started successfully!")
+    logger.info(f"Telegram Bot started successfully in {config.BOT_MODE} mode!")
     logger.info(f"Admin IDs: {config.ADMIN_IDS}")
     logger.info(f"Web App URL: {config.WEBAPP_URL}")
     
-    # Start polling
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        await run_dispatcher(bot, dp)
     finally:
+        await dp.storage.close()
+        await payment_gateway.close()
         await bot.session.close()
+        await dispose_async_engine()
+
+
+async def start_webapp_server():
+    """Start gunicorn with the Flask app in a separate process group of workers"""
+    import config
+    
+    cmd = [
+        sys.executable, "-m", "gunicorn",
+        "--bind", f"0.0.0.0:{config.WEBAPP_PORT}",
+        "--workers", str(config.WEBAPP_WORKERS),
+        "--threads", str(config.WEBAPP_THREADS),
+        "--worker-class", "gthread",
+        "--timeout", str(config.WEBAPP_TIMEOUT),
+        "--graceful-timeout", str(config.WEBAPP_GRACEFUL_TIMEOUT),
+        "--access-logfile", "-",
+        "webapp.app:app",
+    ]
+    logger.info(
+        f"Starting Web App on port {config.WEBAPP_PORT} with gunicorn "
+        f"({config.WEBAPP_WORKERS} workers x {config.WEBAPP_THREADS} threads)..."
+    )
+    return await asyncio.create_subprocess_exec(*cmd, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+async def stop_webapp_server(process):
+    """Ask gunicorn to finish in-flight requests, then kill it if it hangs"""
+    import config
+    
+    if process.returncode is not None:
+        return
+    
+    logger.info("Stopping Web App...")
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), timeout=config.WEBAPP_GRACEFUL_TIMEOUT + 5)
+    except asyncio.TimeoutError:
+        logger.warning("Web App did not stop in time, killing it")
+        process.kill()
+        await process.wait()
 
 
 async def main():
     """Main entry point - runs both bot and webapp"""
+    import config
+    
     logger.info("=" * 60)
     logger.info("Starting E-Commerce Telegram Bot System")
     logger.info("=" * 60)
     
-    # Start webapp in separate thread
-    webapp_thread = Thread(target=run_webapp, daemon=True)
-    webapp_thread.start()
+    if config.WEBAPP_SERVER == "flask":
+        # Start webapp in separate thread
+        webapp_thread = Thread(target=run_webapp, daemon=True)
+        webapp_thread.start()
+        
+        await asyncio.sleep(3)
+        
+        # Run bot in main thread
+        await run_bot()
+        return
+    
+    webapp = await start_webapp_server()
+    bot_task = asyncio.create_task(run_bot())
+    webapp_task = asyncio.create_task(webapp.wait())
     
-    await asyncio.sleep(3)
+    # SIGTERM (docker stop, Railway redeploy) shuts both services down cleanly
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, bot_task.cancel)
+        except NotImplementedError:
+            pass
     
-    # Run bot in main thread
-    await run_bot()
+    try:
+        done, _ = await asyncio.wait({bot_task, webapp_task}, return_when=asyncio.FIRST_COMPLETED)
+        if webapp_task in done:
+            logger.error(f"Web App exited with code {webapp.returncode}, stopping bot")
+            bot_task.cancel()
+            await asyncio.gather(bot_task, return_exceptions=True)
+            sys.exit(1)
+        if not bot_task.cancelled():
+            bot_task.result()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        webapp_task.cancel()
+        await stop_webapp_server(webapp)
 
 
 if __name__ == "__main__":
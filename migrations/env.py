@@ -0,0 +1,55 @@
+"""Alembic environment: migrations run against config.DATABASE_URL"""
+from logging.config import fileConfig
+
+from alembic import context
+
+from database.models import Base
+
+alembic_config = context.config
+target_metadata = Base.metadata
+
+# database.db.init_db passes its own connection and keeps the app's logging
+if alembic_config.config_file_name and 'connection' not in alembic_config.attributes:
+    fileConfig(alembic_config.config_file_name, disable_existing_loggers=False)
+
+
+def _configure(**kwargs):
+    context.configure(
+        target_metadata=target_metadata,
+        compare_type=True,
+        transaction_per_migration=True,
+        **kwargs
+    )
+
+
+def run_migrations_offline():
+    """Emit SQL to stdout (alembic upgrade head --sql)"""
+    import config
+
+    _configure(url=config.DATABASE_URL, literal_binds=True, dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connection = alembic_config.attributes.get('connection')
+    if connection is None:
+        from database.db import engine
+
+        with engine.connect() as connection:
+            _run(connection)
+    else:
+        _run(connection)
+
+
+def _run(connection):
+    # SQLite can only ALTER tables by copying them
+    _configure(connection=connection, render_as_batch=connection.dialect.name == 'sqlite')
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
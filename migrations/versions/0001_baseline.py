@@ -0,0 +1,146 @@
+"""Baseline schema: users, catalog, carts, orders and settings
+
+Matches the tables the bot used to create with Base.metadata.create_all.
+Databases created that way are stamped with this revision on first start.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('telegram_id', sa.BigInteger(), nullable=False),
+        sa.Column('username', sa.String(255)),
+        sa.Column('first_name', sa.String(255)),
+        sa.Column('last_name', sa.String(255)),
+        sa.Column('phone', sa.String(20)),
+        sa.Column('is_active', sa.Boolean()),
+        sa.Column('is_blocked', sa.Boolean()),
+        sa.Column('theme', sa.String(10)),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('last_activity', sa.DateTime()),
+    )
+    op.create_index('ix_users_telegram_id', 'users', ['telegram_id'], unique=True)
+    op.create_index('ix_users_created_at', 'users', ['created_at'])
+    op.create_index('ix_users_last_activity', 'users', ['last_activity'])
+    op.create_index('idx_user_active_created', 'users', ['is_active', 'created_at'])
+    op.create_index('idx_user_telegram_active', 'users', ['telegram_id', 'is_active'])
+
+    op.create_table(
+        'categories',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(255), nullable=False),
+        sa.Column('description', sa.Text()),
+        sa.Column('icon', sa.String(50)),
+        sa.Column('position', sa.Integer()),
+        sa.Column('is_active', sa.Boolean()),
+        sa.Column('created_at', sa.DateTime()),
+    )
+    op.create_index('ix_categories_name', 'categories', ['name'], unique=True)
+    op.create_index('ix_categories_position', 'categories', ['position'])
+    op.create_index('ix_categories_is_active', 'categories', ['is_active'])
+    op.create_index('idx_category_active_position', 'categories', ['is_active', 'position'])
+
+    op.create_table(
+        'products',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('category_id', sa.Integer(), sa.ForeignKey('categories.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('name', sa.String(255), nullable=False),
+        sa.Column('description', sa.Text()),
+        sa.Column('price', sa.Float(), nullable=False),
+        sa.Column('photos', sa.Text()),
+        sa.Column('stock', sa.Integer()),
+        sa.Column('brand', sa.String(255)),
+        sa.Column('sizes', sa.String(255)),
+        sa.Column('size_stock', sa.Text()),
+        sa.Column('size_chart', sa.Text()),
+        sa.Column('is_active', sa.Boolean()),
+        sa.Column('position', sa.Integer()),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('updated_at', sa.DateTime()),
+    )
+    op.create_index('ix_products_category_id', 'products', ['category_id'])
+    op.create_index('ix_products_name', 'products', ['name'])
+    op.create_index('ix_products_price', 'products', ['price'])
+    op.create_index('ix_products_stock', 'products', ['stock'])
+    op.create_index('ix_products_is_active', 'products', ['is_active'])
+    op.create_index('ix_products_created_at', 'products', ['created_at'])
+    op.create_index('idx_product_category_active', 'products', ['category_id', 'is_active', 'position'])
+    op.create_index('idx_product_active_price', 'products', ['is_active', 'price'])
+    op.create_index('idx_product_active_stock', 'products', ['is_active', 'stock'])
+
+    op.create_table(
+        'cart_items',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('quantity', sa.Integer()),
+        sa.Column('size', sa.String(10)),
+        sa.Column('created_at', sa.DateTime()),
+    )
+    op.create_index('ix_cart_items_user_id', 'cart_items', ['user_id'])
+    op.create_index('ix_cart_items_product_id', 'cart_items', ['product_id'])
+    op.create_index('idx_cart_user_product', 'cart_items', ['user_id', 'product_id', 'size'], unique=True)
+
+    op.create_table(
+        'orders',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('order_number', sa.String(50), nullable=False),
+        sa.Column('total_amount', sa.Float(), nullable=False),
+        sa.Column('status', sa.String(50)),
+        sa.Column('payment_id', sa.String(255)),
+        sa.Column('payment_status', sa.String(50)),
+        sa.Column('delivery_address', sa.Text()),
+        sa.Column('phone', sa.String(20)),
+        sa.Column('comment', sa.Text()),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('updated_at', sa.DateTime()),
+    )
+    op.create_index('ix_orders_user_id', 'orders', ['user_id'])
+    op.create_index('ix_orders_order_number', 'orders', ['order_number'], unique=True)
+    op.create_index('ix_orders_status', 'orders', ['status'])
+    op.create_index('ix_orders_payment_id', 'orders', ['payment_id'])
+    op.create_index('ix_orders_payment_status', 'orders', ['payment_status'])
+    op.create_index('ix_orders_created_at', 'orders', ['created_at'])
+    op.create_index('idx_order_user_created', 'orders', ['user_id', 'created_at'])
+    op.create_index('idx_order_status_created', 'orders', ['status', 'created_at'])
+    op.create_index('idx_order_payment_status', 'orders', ['payment_status', 'created_at'])
+
+    op.create_table(
+        'order_items',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('order_id', sa.Integer(), sa.ForeignKey('orders.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete='SET NULL')),
+        sa.Column('product_name', sa.String(255), nullable=False),
+        sa.Column('price', sa.Float(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('size', sa.String(10)),
+    )
+    op.create_index('ix_order_items_order_id', 'order_items', ['order_id'])
+    op.create_index('ix_order_items_product_id', 'order_items', ['product_id'])
+
+    op.create_table(
+        'settings',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('key', sa.String(255), nullable=False),
+        sa.Column('value', sa.Text()),
+        sa.Column('updated_at', sa.DateTime()),
+    )
+    op.create_index('ix_settings_key', 'settings', ['key'], unique=True)
+
+
+def downgrade():
+    for table in ('settings', 'order_items', 'orders', 'cart_items', 'products', 'categories', 'users'):
+        op.drop_table(table)
@@ -0,0 +1,91 @@
+"""Sales rollups, shared storage tables, product variants and order number sequence
+
+Tables are created with IF NOT EXISTS: databases that ran create_all after
+these models were added already have some of them.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'daily_sales_stats',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('orders_count', sa.Integer(), nullable=False),
+        sa.Column('completed_orders', sa.Integer(), nullable=False),
+        sa.Column('completed_revenue', sa.Float(), nullable=False),
+        sa.Column('paid_orders', sa.Integer(), nullable=False),
+        sa.Column('paid_revenue', sa.Float(), nullable=False),
+        sa.Column('units_sold', sa.Integer(), nullable=False),
+        sa.Column('new_users', sa.Integer(), nullable=False),
+        if_not_exists=True,
+    )
+
+    op.create_table(
+        'daily_product_sales',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('product_id', sa.Integer(), primary_key=True),
+        sa.Column('product_name', sa.String(255), nullable=False),
+        sa.Column('units_sold', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.Float(), nullable=False),
+        if_not_exists=True,
+    )
+    op.create_index(
+        'idx_daily_product_sales_product', 'daily_product_sales', ['product_id', 'day'], if_not_exists=True
+    )
+
+    op.create_table(
+        'rate_limit_counters',
+        sa.Column('key', sa.String(255), primary_key=True),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        if_not_exists=True,
+    )
+    op.create_index(
+        'ix_rate_limit_counters_expires_at', 'rate_limit_counters', ['expires_at'], if_not_exists=True
+    )
+
+    op.create_table(
+        'fsm_records',
+        sa.Column('key', sa.String(255), primary_key=True),
+        sa.Column('state', sa.String(255)),
+        sa.Column('data', sa.Text()),
+        sa.Column('updated_at', sa.DateTime()),
+        if_not_exists=True,
+    )
+
+    op.create_table(
+        'product_variants',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('size', sa.String(10), nullable=False),
+        sa.Column('stock', sa.Integer(), nullable=False),
+        sa.Column('position', sa.Integer()),
+        if_not_exists=True,
+    )
+    op.create_index(
+        'idx_variant_product_size', 'product_variants', ['product_id', 'size'], unique=True, if_not_exists=True
+    )
+    op.create_index(
+        'idx_variant_product_stock', 'product_variants', ['product_id', 'stock'], if_not_exists=True
+    )
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("CREATE SEQUENCE IF NOT EXISTS order_number_seq")
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP SEQUENCE IF EXISTS order_number_seq")
+    for table in ('product_variants', 'fsm_records', 'rate_limit_counters', 'daily_product_sales', 'daily_sales_stats'):
+        op.drop_table(table)
@@ -0,0 +1,64 @@
+"""Keyset pagination and search indexes, built online on PostgreSQL
+
+users and orders are the largest, hottest tables, so on PostgreSQL these
+indexes are built with CREATE INDEX CONCURRENTLY outside the migration
+transaction: reads and writes continue while they build. A concurrent
+build that fails leaves an INVALID index behind; it is dropped and rebuilt
+on the next run.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from database.models import PRODUCT_SEARCH_VECTOR_SQL
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('idx_user_created_id', 'users', ['created_at', 'id'], {}),
+    ('idx_order_created_id', 'orders', ['created_at', 'id'], {}),
+    ('idx_order_user_created_id', 'orders', ['user_id', 'created_at', 'id'], {}),
+]
+
+POSTGRESQL_INDEXES = [
+    ('idx_product_search_vector', 'products', [sa.text(f"({PRODUCT_SEARCH_VECTOR_SQL})")],
+     {'postgresql_using': 'gin'}),
+    ('idx_product_name_trgm', 'products', ['name'],
+     {'postgresql_using': 'gin', 'postgresql_ops': {'name': 'gin_trgm_ops'}}),
+]
+
+
+def _drop_invalid(name: str, table: str):
+    if op.get_context().as_sql:
+        return
+    invalid = op.get_bind().execute(sa.text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {'name': name}).first()
+    if invalid:
+        op.drop_index(name, table_name=table, postgresql_concurrently=True)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        for name, table, columns, kwargs in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True, **kwargs)
+        return
+
+    with op.get_context().autocommit_block():
+        for name, table, columns, kwargs in INDEXES + POSTGRESQL_INDEXES:
+            _drop_invalid(name, table)
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True, **kwargs)
+
+
+def downgrade():
+    is_postgresql = op.get_bind().dialect.name == 'postgresql'
+    indexes = INDEXES + POSTGRESQL_INDEXES if is_postgresql else INDEXES
+    for name, table, _, _ in indexes:
+        op.drop_index(name, table_name=table, if_exists=True)
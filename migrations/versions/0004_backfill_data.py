@@ -0,0 +1,36 @@
+"""Backfill data for revision 0002 tables
+
+- legacy JSON products.size_stock -> product_variants
+- sales rollups from existing orders and users
+- order_number_seq moved past numbers issued by the old COUNT(*) scheme
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+from sqlalchemy.orm import Session
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_context().as_sql:
+        # Data backfills need query results; run this revision online
+        return
+
+    from database import catalog_cache, inventory, order_numbers, stats
+
+    db = Session(bind=op.get_bind())
+    if inventory.convert_size_stock(db):
+        catalog_cache.bump_catalog_version(db)
+    stats.ensure_rollups(db)
+    order_numbers.sync_sequence(db)
+    db.flush()
+
+
+def downgrade():
+    pass
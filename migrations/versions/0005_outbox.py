@@ -0,0 +1,31 @@
+"""Outbox for notifications queued by the web app and delivered by the bot
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'outbox',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('kind', sa.String(50), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('available_at', sa.DateTime(), nullable=False),
+        sa.Column('processed_at', sa.DateTime()),
+    )
+    op.create_index('idx_outbox_pending', 'outbox', ['processed_at', 'available_at'])
+
+
+def downgrade():
+    op.drop_table('outbox')
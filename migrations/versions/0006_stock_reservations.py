@@ -0,0 +1,46 @@
+"""Stock reservations of unpaid orders
+
+Pending unpaid orders created before this revision get reservations for
+their items, expiring STOCK_RESERVATION_MINUTES after the order was placed.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'stock_reservations',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('order_id', sa.Integer(), sa.ForeignKey('orders.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete='SET NULL')),
+        sa.Column('size', sa.String(10)),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_stock_reservations_order_id', 'stock_reservations', ['order_id'])
+    op.create_index('idx_reservation_expires', 'stock_reservations', ['expires_at'])
+
+    if op.get_context().as_sql:
+        # The backfill needs query results; run this revision online
+        return
+
+    from database import reservations
+
+    db = Session(bind=op.get_bind())
+    reservations.backfill(db)
+    db.flush()
+
+
+def downgrade():
+    op.drop_table('stock_reservations')
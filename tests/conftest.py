@@ -0,0 +1,90 @@
+"""
+Shared test setup: a database migrated to head, emptied after every test.
+
+Tests run against TEST_DATABASE_URL (e.g. a scratch PostgreSQL database)
+or a throwaway SQLite file. config and database.db read the environment and
+build their engines at import time, so it is set before they are imported.
+"""
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+_db_dir = tempfile.mkdtemp(prefix='shop-tests-')
+os.environ.setdefault('BOT_TOKEN', '123456:test-token')
+os.environ.setdefault('ADMIN_IDS', '1')
+os.environ['DATABASE_URL'] = os.getenv('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ['DB_AUTO_MIGRATE'] = 'true'
+os.environ.pop('ASYNC_DATABASE_URL', None)
+
+from database.db import SessionLocal, dispose_async_engine, init_db  # noqa: E402
+from database import crud  # noqa: E402
+from database.models import Base  # noqa: E402
+
+init_db(max_retries=1)
+
+_ids = itertools.count(1)
+
+
+@pytest.fixture(autouse=True)
+def clean_tables():
+    """Every test starts from empty tables"""
+    yield
+    with SessionLocal() as session:
+        for table in reversed(Base.metadata.sorted_tables):
+            session.execute(table.delete())
+        session.commit()
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine on a fresh event loop, closing the async engine's connections with it"""
+    async def main(coro):
+        try:
+            return await coro
+        finally:
+            await dispose_async_engine()
+
+    return lambda coro: asyncio.run(main(coro))
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+class Shop:
+    """A fresh customer and a product with 50 in stock"""
+
+    def __init__(self, db):
+        self.db = db
+        n = next(_ids)
+        self.user = crud.get_or_create_user(db, telegram_id=1000 + n, username=f'buyer{n}')
+        category = crud.create_category(db, name=f'Футболки {n}')
+        self.product = crud.create_product(db, category.id, 'Футболка', 'Хлопок', 100.0, stock=50)
+
+    def place_order(self, quantity: int):
+        crud.add_to_cart(self.db, self.user.id, self.product.id, quantity)
+        items = crud.get_cart_items(self.db, self.user.id, profile='cart_with_products')
+        order = crud.create_order(self.db, self.user.id, items)
+        crud.clear_cart(self.db, self.user.id)
+        return order
+
+    def stock(self) -> int:
+        self.db.expire_all()
+        return crud.get_product(self.db, self.product.id).stock
+
+
+@pytest.fixture
+def shop(db):
+    return Shop(db)
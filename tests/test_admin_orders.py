@@ -0,0 +1,109 @@
+from types import SimpleNamespace
+
+from database import crud, stats
+from handlers import admin_handlers, order_handlers
+from utils.middleware import CachedUser
+
+ADMIN_ID = 1
+
+
+class FakeCallback:
+    """The parts of CallbackQuery the order handlers use"""
+
+    def __init__(self, telegram_id, data):
+        self.from_user = SimpleNamespace(id=telegram_id)
+        self.data = data
+        self.answers = []
+        self.rendered = []
+        self.message = SimpleNamespace(edit_text=self._edit_text)
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append(text)
+
+    async def _edit_text(self, text, reply_markup=None):
+        self.rendered.append((text, reply_markup))
+
+    def buttons(self):
+        _, markup = self.rendered[-1]
+        return {button.text: button.callback_data for row in markup.inline_keyboard for button in row}
+
+
+def _paid_order(db, shop):
+    order = shop.place_order(2)
+    assert crud.attach_payment(db, order.id, f'pay-{order.id}')
+    crud.update_order_payment_status(db, order.id, 'succeeded')
+    db.refresh(order)
+    assert order.status == 'paid'
+    return order
+
+
+def _db_user(db, telegram_id):
+    return CachedUser.from_model(crud.get_or_create_user(db, telegram_id=telegram_id))
+
+
+def _dispatch(run, db_user, data, telegram_id=ADMIN_ID):
+    """Route the tap like the dispatcher: the first admin handler whose filters match"""
+    callback = FakeCallback(telegram_id, data)
+
+    async def scenario():
+        for handler in admin_handlers.router.callback_query.handlers:
+            matched, _ = await handler.check(callback)
+            if matched:
+                await handler.callback(callback, db_user)
+                return handler.callback
+        raise AssertionError(f"no handler for {data}")
+
+    return run(scenario()), callback
+
+
+def test_paid_order_goes_through_processing_to_completed(db, shop, run):
+    order = _paid_order(db, shop)
+    admin = _db_user(db, ADMIN_ID)
+
+    handler, callback = _dispatch(run, admin, f'admin_order_{order.id}')
+    assert handler is admin_handlers.admin_order_details
+    assert '💳 Оплачен' in callback.rendered[-1][0]
+    assert callback.buttons()['В обработку'] == f'admin_order_status_{order.id}_processing'
+
+    handler, callback = _dispatch(run, admin, f'admin_order_status_{order.id}_processing')
+    assert handler is admin_handlers.admin_change_order_status
+    assert callback.answers == ['✅ Заказ переведен в статус: в обработку!']
+    assert '🔄 В обработке' in callback.rendered[-1][0]
+    assert callback.buttons()['Завершить'] == f'admin_order_status_{order.id}_completed'
+
+    _dispatch(run, admin, f'admin_order_status_{order.id}_completed')
+    db.expire_all()
+    order = crud.get_order(db, order.id)
+    assert (order.status, order.payment_status) == ('completed', 'succeeded')
+    day = stats.get_sales_summary(db)['all']
+    assert (day['paid_orders'], day['completed_orders']) == (1, 1)
+
+
+def test_paid_orders_are_labelled_in_every_list(db, shop, run):
+    order = _paid_order(db, shop)
+
+    _, callback = _dispatch(run, _db_user(db, ADMIN_ID), 'admin_orders')
+    text, markup = callback.rendered[-1]
+    assert f'💳 Заказ #{order.id}' in text
+    assert f'💳 #{order.id} • {order.total_amount}₽' in callback.buttons()
+
+    customer = CachedUser.from_model(shop.user)
+    for handler, data in ((order_handlers.show_orders, 'my_orders'),
+                          (order_handlers.show_order_details, f'order_{order.id}')):
+        callback = FakeCallback(shop.user.telegram_id, data)
+        run(handler(callback, customer))
+        assert '✅ Оплачен' in callback.rendered[-1][0]
+        assert '❓' not in callback.rendered[-1][0]
+
+
+def test_order_actions_are_admin_only(db, shop, run):
+    order = _paid_order(db, shop)
+    stranger = _db_user(db, shop.user.telegram_id)
+
+    for data in (f'admin_order_{order.id}', f'admin_order_status_{order.id}_completed'):
+        _, callback = _dispatch(run, stranger, data, telegram_id=shop.user.telegram_id)
+        assert callback.answers == ['Нет доступа']
+        assert callback.rendered == []
+
+    db.expire_all()
+    assert crud.get_order(db, order.id).status == 'paid'
@@ -0,0 +1,109 @@
+import asyncio
+import time
+from collections import Counter
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+import config
+from database import crud
+from database.models import User
+from utils import broadcast
+from utils.broadcast import Broadcaster, BroadcastProgress, RateLimiter
+
+
+class FakeBot:
+    """Accepts every message after latency seconds, except for the blocked chats"""
+
+    def __init__(self, blocked=(), flood_once=(), latency=0.0):
+        self.blocked = set(blocked)
+        self.flood_once = set(flood_once)
+        self.latency = latency
+        self.sent = Counter()
+        self.first_sent_at = self.last_sent_at = None
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        method = SendMessage(chat_id=chat_id, text=text)
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(method=method, message='Forbidden: bot was blocked by the user')
+        if chat_id in self.flood_once:
+            self.flood_once.discard(chat_id)
+            raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=0.2)
+        self.sent[chat_id] += 1
+        self.last_sent_at = time.monotonic()
+        self.first_sent_at = self.first_sent_at or self.last_sent_at
+
+    async def edit_message_text(self, *args, **kwargs):
+        pass
+
+
+def _users(db, count):
+    return [crud.get_or_create_user(db, telegram_id=5000 + n).telegram_id for n in range(count)]
+
+
+def _progress(total):
+    return BroadcastProgress(text='Скидки!', admin_chat_id=1, total=total)
+
+
+def test_broadcast_sends_once_and_deactivates_blocked_users(db, run):
+    chats = _users(db, 25)
+    bot = FakeBot(blocked=chats[3:6], flood_once=chats[10:12])
+    broadcaster = Broadcaster(bot, _progress(25), rate=1000, concurrency=4, batch_size=10, status_interval=0)
+
+    progress = run(broadcaster.run())
+
+    assert (progress.status, progress.sent, progress.blocked, progress.failed) == ('done', 22, 3, 0)
+    assert set(bot.sent) == set(chats) - set(chats[3:6])
+    assert max(bot.sent.values()) == 1
+    db.expire_all()
+    inactive = {user.telegram_id for user in db.query(User).filter(User.is_active == False)}
+    assert inactive == set(chats[3:6])
+    saved = run(broadcast.load_progress())
+    assert (saved.status, saved.last_user_id) == ('done', progress.last_user_id)
+
+
+def test_broadcast_keeps_to_the_rate_limit(db, run):
+    _users(db, 60)
+    bot = FakeBot(latency=0.005)
+    # A burst of 20, then 40 more at 100 messages per second
+    broadcaster = Broadcaster(bot, _progress(60), concurrency=10, batch_size=25, status_interval=0)
+    broadcaster.limiter = RateLimiter(rate=100, burst=20)
+
+    progress = run(broadcaster.run())
+
+    assert progress.sent == 60
+    assert bot.last_sent_at - bot.first_sent_at >= 0.35
+
+
+def test_interrupted_broadcast_resumes_where_it_stopped(db, run, monkeypatch):
+    monkeypatch.setattr(config, 'BROADCAST_BATCH_SIZE', 10)
+    monkeypatch.setattr(config, 'BROADCAST_RATE', 1000)
+    chats = _users(db, 30)
+    first, second = FakeBot(latency=0.01), FakeBot()
+
+    async def interrupt_after_first_batch():
+        assert await broadcast.start_broadcast(first, 'Скидки!', admin_chat_id=1)
+        while (await broadcast.load_progress()).last_user_id == 0:
+            await asyncio.sleep(0.01)
+        # The process stops: the task dies without marking the broadcast finished
+        broadcast._task.cancel()
+        await asyncio.gather(broadcast._task, return_exceptions=True)
+
+    async def resume():
+        assert await broadcast.resume_broadcast(second)
+        return await broadcast._task
+
+    run(interrupt_after_first_batch())
+    saved = run(broadcast.load_progress())
+    assert saved.status == 'running' and saved.last_user_id > 0
+    assert sum(first.sent.values()) < len(chats)
+
+    progress = run(resume())
+
+    assert progress.status == 'done'
+    delivered = first.sent + second.sent
+    assert set(delivered) == set(chats)
+    # Only the batch in flight at the interruption may be sent twice
+    assert sum(delivered.values()) - len(chats) <= 10
+    assert not run(broadcast.resume_broadcast(FakeBot()))
@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+from database import crud
+from database.db import async_engine
+from handlers import cart_handlers
+
+
+class FakeCallback:
+    """The parts of CallbackQuery the cart handlers use"""
+
+    def __init__(self, telegram_id, data):
+        self.from_user = SimpleNamespace(id=telegram_id)
+        self.data = data
+        self.answers = []
+        self.rendered = []
+        self.message = SimpleNamespace(edit_text=self._edit_text)
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append(text)
+
+    async def _edit_text(self, text, reply_markup=None):
+        self.rendered.append(text)
+
+
+@contextmanager
+def _statements():
+    counter = [0]
+
+    def count(*args):
+        counter[0] += 1
+
+    event.listen(async_engine.sync_engine, 'before_cursor_execute', count)
+    try:
+        yield counter
+    finally:
+        event.remove(async_engine.sync_engine, 'before_cursor_execute', count)
+
+
+def _cart(db, shop, lines):
+    items = []
+    for n in range(lines):
+        product = crud.create_product(db, shop.product.category_id, f'Товар {n}', 'Описание', 100.0 + n, stock=5)
+        items.append(crud.add_to_cart(db, shop.user.id, product.id, 2))
+    db.commit()
+    return [item.id for item in items]
+
+
+def _tap(run, handler, telegram_id, data):
+    callback = FakeCallback(telegram_id, data)
+    with _statements() as statements:
+        run(handler(callback))
+    return callback, statements[0]
+
+
+@pytest.mark.parametrize('lines', [1, 10])
+def test_each_tap_costs_two_statements(db, shop, run, lines):
+    item_ids = _cart(db, shop, lines)
+    telegram_id = shop.user.telegram_id
+
+    taps = [
+        (cart_handlers.show_cart, 'cart', 1),
+        (cart_handlers.increase_cart_item, f'cart_increase_{item_ids[0]}', 2),
+        (cart_handlers.decrease_cart_item, f'cart_decrease_{item_ids[0]}', 2),
+        (cart_handlers.remove_cart_item, f'cart_remove_{item_ids[-1]}', 2),
+    ]
+    for handler, data, expected in taps:
+        callback, statements = _tap(run, handler, telegram_id, data)
+        assert statements == expected, handler.__name__
+        assert callback.rendered
+
+    view = crud.get_cart_view(db, telegram_id)
+    assert len(view.items) == lines - 1
+    assert view.total == sum(2 * (100.0 + n) for n in range(lines - 1))
+
+
+def test_increase_stops_at_stock(db, shop, run):
+    item_id, = _cart(db, shop, 1)
+
+    # 2 in the cart, 5 in stock: the fourth tap is refused
+    for _ in range(4):
+        callback, _ = _tap(run, cart_handlers.increase_cart_item, shop.user.telegram_id, f'cart_increase_{item_id}')
+
+    assert callback.answers == ['Максимальное количество: 5']
+    assert crud.get_cart_view(db, shop.user.telegram_id).items[0].quantity == 5
+
+
+def test_taps_cannot_touch_another_users_cart(db, shop, run):
+    item_id, = _cart(db, shop, 1)
+    stranger = crud.get_or_create_user(db, telegram_id=shop.user.telegram_id + 10**6)
+
+    for handler, data in ((cart_handlers.increase_cart_item, f'cart_increase_{item_id}'),
+                          (cart_handlers.decrease_cart_item, f'cart_decrease_{item_id}')):
+        callback, _ = _tap(run, handler, stranger.telegram_id, data)
+        assert callback.answers == ['Товар не найден']
+
+    assert crud.get_cart_view(db, shop.user.telegram_id).items[0].quantity == 2
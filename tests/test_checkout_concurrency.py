@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from database import crud
+from database.db import SessionLocal
+from database.inventory import InsufficientStockError
+from database.models import Order, ProductVariant
+
+WORKERS = 12
+ATTEMPTS = 5
+
+
+def _checkout(user_id: int):
+    """ATTEMPTS orders from the same cart in this thread's own session"""
+    placed, refused = [], 0
+    session = SessionLocal()
+    try:
+        for _ in range(ATTEMPTS):
+            items = crud.get_cart_items(session, user_id, profile='cart_with_products')
+            try:
+                placed.append(crud.create_order(session, user_id, items).id)
+            except InsufficientStockError:
+                refused += 1
+    finally:
+        session.close()
+    return placed, refused
+
+
+def test_concurrent_checkouts_never_oversell(db, shop):
+    shirt = shop.product
+    shirt.stock = 30
+    db.commit()
+    hoodie = crud.create_product(db, shirt.category_id, 'Худи', 'Флис', 300.0,
+                                 sizes='M,L', size_stock='{"M": 10, "L": 10}')
+    buyers = []
+    for n in range(WORKERS):
+        user = crud.get_or_create_user(db, telegram_id=shop.user.telegram_id * 100 + n)
+        # Half of the carts list the products the other way round
+        lines = [(shirt.id, None), (hoodie.id, 'M')]
+        for product_id, size in (lines if n % 2 else lines[::-1]):
+            crud.add_to_cart(db, user.id, product_id, 1, size=size)
+        buyers.append(user.id)
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        # A deadlock would hang here; the timeout turns it into a failure
+        results = [future.result(timeout=60) for future in [pool.submit(_checkout, u) for u in buyers]]
+
+    placed = [order_id for orders, _ in results for order_id in orders]
+    refused = sum(count for _, count in results)
+    assert len(placed) + refused == WORKERS * ATTEMPTS
+    # Size M of the hoodie runs out first: exactly 10 orders fit
+    assert len(placed) == 10
+    db.expire_all()
+    assert db.query(Order).count() == 10
+    assert crud.get_product(db, shirt.id).stock == 20
+    sizes = dict(db.query(ProductVariant.size, ProductVariant.stock).filter(ProductVariant.product_id == hoodie.id))
+    assert sizes == {'M': 0, 'L': 10}
+    assert crud.get_product(db, hoodie.id).stock == 10
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from PIL import Image
+
+import config
+from database import catalog_cache, crud
+from webapp import app as webapp
+from webapp.image_cache import ImageCache
+
+PHOTO_ID = 'AgACAgIAAxkBAAIB' + 'x' * 40
+UNKNOWN_ID = 'AgACAgIAAxkBAAIB' + 'y' * 40
+
+
+def _png(width=1200, height=800):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class StubBotAPI:
+    """getFile and file downloads of the Bot API, for the files it was given"""
+
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                stub.requests.append(url.path.rsplit('/', 1)[-1])
+                if url.path == f"/bot{config.BOT_TOKEN}/getFile":
+                    file_id = parse_qs(url.query).get('file_id', [''])[0]
+                    if file_id in stub.files:
+                        body = {'ok': True, 'result': {'file_id': file_id, 'file_path': f"photos/{file_id}.png"}}
+                    else:
+                        body = {'ok': False, 'error_code': 400, 'description': 'Bad Request: invalid file_id'}
+                    self._send(200, json.dumps(body).encode(), 'application/json')
+                elif url.path.startswith(f"/file/bot{config.BOT_TOKEN}/photos/"):
+                    file_id = url.path.rsplit('/', 1)[-1][:-len('.png')]
+                    if file_id in stub.files:
+                        self._send(200, stub.files[file_id], 'image/png')
+                    else:
+                        self._send(404, b'Not Found', 'text/plain')
+                else:
+                    self._send(404, b'Not Found', 'text/plain')
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def bot_api():
+    with StubBotAPI({PHOTO_ID: _png(), UNKNOWN_ID: _png()}) as stub:
+        yield stub
+
+
+@pytest.fixture
+def client(db, shop, bot_api, tmp_path, monkeypatch):
+    crud.create_product(db, shop.product.category_id, 'Футболка с фото', 'Хлопок', 150.0,
+                        photos=PHOTO_ID, stock=5)
+    catalog_cache.invalidate()
+    cache = ImageCache(str(tmp_path), config.BOT_TOKEN, api_url=bot_api.url, widths=(320, 640), workers=1)
+    monkeypatch.setattr(webapp, 'image_cache', cache)
+    webapp.app.config['TESTING'] = True
+    yield webapp.app.test_client()
+    catalog_cache.invalidate()
+
+
+def test_photo_is_downloaded_once_and_served_from_disk(client, bot_api, tmp_path):
+    first = client.get(f'/img/{PHOTO_ID}')
+    assert first.status_code == 200
+    assert first.mimetype == 'image/png'
+    assert first.data == bot_api.files[PHOTO_ID]
+    assert 'immutable' in first.headers['Cache-Control']
+
+    again = client.get(f'/img/{PHOTO_ID}')
+    assert again.data == first.data
+    assert bot_api.requests == ['getFile', f'{PHOTO_ID}.png']
+    assert webapp.image_cache.get_stats()['downloads'] == 1
+    assert webapp.image_cache.get_stats()['hits'] == 1
+    assert len(list((tmp_path / 'originals').rglob('*'))) == 2  # the shard directory and the file
+
+
+def test_thumbnail_is_cached_on_disk(client, bot_api, tmp_path):
+    response = client.get(f'/img/{PHOTO_ID}?w=300')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    with Image.open(BytesIO(response.data)) as thumbnail:
+        assert thumbnail.size == (320, 213)
+    # Both configured widths are prefetched with the first download
+    digest = hashlib.sha256(bot_api.files[PHOTO_ID]).hexdigest()
+    assert webapp.image_cache.thumbnail(digest, 640) is not None
+    thumbnails = sorted(path.name for path in (tmp_path / 'thumbs').rglob('*.webp'))
+    assert [name.rsplit('-', 1)[1] for name in thumbnails] == ['320.webp', '640.webp']
+
+    cached = client.get(f'/img/{PHOTO_ID}?w=300', headers={'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+    assert webapp.image_cache.get_stats()['thumbnails'] == 2
+    assert webapp.image_cache.get_stats()['downloads'] == 1
+
+
+def test_unknown_ids_are_rejected(client, bot_api):
+    # A valid file_id, but not a photo of any catalog product: never looked up
+    assert client.get(f'/img/{UNKNOWN_ID}').status_code == 404
+    assert client.get('/img/not-a-file-id').status_code == 404
+    assert bot_api.requests == []
+
+
+def test_photo_missing_from_telegram_is_not_found(client, bot_api):
+    del bot_api.files[PHOTO_ID]
+
+    assert client.get(f'/img/{PHOTO_ID}').status_code == 404
+    assert bot_api.requests == ['getFile']
+    assert webapp.image_cache.get_stats()['downloads'] == 0
@@ -0,0 +1,106 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from database import crud
+from database.db import SessionLocal, engine
+from utils.helpers import format_order_details
+
+
+@contextmanager
+def _statements():
+    counter = [0]
+
+    def count(*args):
+        counter[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def _fill(db, shop, lines):
+    """Put lines different products into the shop customer's cart"""
+    for n in range(lines):
+        product = crud.create_product(db, shop.product.category_id, f'Товар {n}', 'Описание', 10.0 + n, stock=5)
+        crud.add_to_cart(db, shop.user.id, product.id, 1)
+
+
+def _order(db, shop, lines):
+    _fill(db, shop, lines)
+    order = crud.create_order(db, shop.user.id, crud.get_cart_items(db, shop.user.id, profile='cart_with_products'))
+    crud.clear_cart(db, shop.user.id)
+    return order.id
+
+
+def _count(view):
+    """Statements a view issues on a fresh session, from the lookup to the last attribute it renders"""
+    with SessionLocal() as session, _statements() as statements:
+        view(session)
+    return statements[0]
+
+
+def _cart_view(user_id):
+    def view(session):
+        for item in crud.get_cart_items(session, user_id, profile='cart_with_products'):
+            item.product.name, item.product.price
+    return view
+
+
+def _order_details_view(order_id):
+    def view(session):
+        format_order_details(crud.get_order(session, order_id, profile='order_with_items'))
+    return view
+
+
+def _admin_order_view(order_id):
+    def view(session):
+        order = crud.get_order(session, order_id, profile='order_with_items_and_user')
+        order.user.telegram_id
+        for item in order.items:
+            item.product.name
+    return view
+
+
+def _admin_orders_view(session):
+    orders, _ = crud.get_orders_page(session, limit=50, profile='order_with_user')
+    for order in orders:
+        order.user.username
+
+
+def _catalog_view(session):
+    for product in crud.get_products(session, active_only=False, profile='product_with_category'):
+        product.category.name, [variant.size for variant in product.variants]
+
+
+@pytest.mark.parametrize('lines', [1, 12])
+def test_cart_view_is_one_query(db, shop, lines):
+    _fill(db, shop, lines)
+
+    assert _count(_cart_view(shop.user.id)) == 1
+
+
+@pytest.mark.parametrize('lines', [1, 12])
+def test_order_views_do_not_grow_with_items(db, shop, lines):
+    order_id = _order(db, shop, lines)
+
+    assert _count(_order_details_view(order_id)) == 2
+    assert _count(_admin_order_view(order_id)) == 2
+
+
+@pytest.mark.parametrize('orders', [1, 8])
+def test_admin_order_list_is_one_query(db, shop, orders):
+    for _ in range(orders):
+        _order(db, shop, 1)
+
+    assert _count(_admin_orders_view) == 1
+
+
+@pytest.mark.parametrize('products', [1, 15])
+def test_catalog_view_does_not_grow_with_products(db, shop, products):
+    _fill(db, shop, products)
+
+    assert _count(_catalog_view) == 2
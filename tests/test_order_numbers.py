@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+from database import order_numbers
+from database.db import SessionLocal
+from database.order_numbers import TimeSortableIds, next_order_number
+
+
+def test_concurrent_order_numbers_are_unique():
+    def allocate(count):
+        session = SessionLocal()
+        try:
+            return [next_order_number(session) for _ in range(count)]
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        batches = list(pool.map(allocate, [625] * 16))
+
+    numbers = [number for batch in batches for number in batch]
+    assert len(numbers) == 10_000
+    assert len(set(numbers)) == len(numbers)
+    assert all(number.startswith('ORD-') and len(number) == len('ORD-YYYYMMDD-') + order_numbers.SUFFIX_WIDTH
+               for number in numbers)
+
+
+def test_orders_get_distinct_numbers(db, shop):
+    first, second = shop.place_order(1), shop.place_order(1)
+
+    assert first.order_number != second.order_number
+
+
+def test_numbers_sort_by_time_within_a_day():
+    ids = TimeSortableIds()
+    morning = ids.next(datetime(2026, 1, 5, 9, 0, 0))
+    noon = ids.next(datetime(2026, 1, 5, 12, 0, 0))
+    same_ms = ids.next(datetime(2026, 1, 5, 12, 0, 0))
+
+    assert morning[0] == noon[0] == '20260105'
+    assert morning[1] < noon[1] < same_ms[1]
+
+
+def test_counter_overflow_within_one_millisecond_is_reported():
+    ids = TimeSortableIds()
+    moment = datetime(2026, 1, 5, 12, 0, 0)
+    suffixes = {ids.next(moment)[1] for _ in range(1 << order_numbers.COUNTER_BITS)}
+
+    assert len(suffixes) == 1 << order_numbers.COUNTER_BITS
+    with pytest.raises(OverflowError):
+        ids.next(moment)
@@ -0,0 +1,168 @@
+import asyncio
+import base64
+from types import SimpleNamespace
+
+from aiohttp import web
+
+from utils.payment import CircuitBreaker, PaymentGateway
+
+
+class FakeYooKassa:
+    """aiohttp server for the YooKassa calls of PaymentGateway, with a switchable failure mode"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.status = 200
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._runner = None
+        self.url = None
+
+    async def _answer(self, request, body):
+        self.requests.append(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if self.status != 200:
+            return web.json_response({'type': 'error', 'description': 'Something went wrong'}, status=self.status)
+        return web.json_response(body)
+
+    async def get_payment(self, request):
+        return await self._answer(request, {
+            'id': request.match_info['payment_id'],
+            'status': 'succeeded',
+            'paid': True,
+            'amount': {'value': '300.00', 'currency': 'RUB'},
+            'metadata': {'order_id': '7'}
+        })
+
+    async def create_payment(self, request):
+        body = await request.json()
+        return await self._answer(request, {
+            'id': 'pay-new',
+            'status': 'pending',
+            'confirmation': {'type': 'redirect', 'confirmation_url': 'https://yookassa.test/pay-new'},
+            'amount': body['amount'],
+            'metadata': body['metadata']
+        })
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/v3/payments/{payment_id}', self.get_payment)
+        app.router.add_post('/v3/payments', self.create_payment)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}/v3"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+
+async def _with_gateway(fake, scenario, **options):
+    """Run scenario(gateway) against fake; returns its result and the gateway stats"""
+    async with fake:
+        settings = {'timeout': 2, 'max_concurrency': 4, 'failure_threshold': 3, 'reset_timeout': 30, **options}
+        gateway = PaymentGateway('shop', 'secret', fake.url, **settings)
+        try:
+            return await scenario(gateway), gateway.get_stats()
+        finally:
+            await gateway.close()
+
+
+def test_create_payment_sends_credentials_and_idempotence_key(run):
+    fake = FakeYooKassa()
+
+    payment, stats = run(_with_gateway(fake, lambda gateway: gateway.create_payment(300.0, 7, 'Заказ #7')))
+
+    assert payment == {'id': 'pay-new', 'status': 'pending', 'confirmation_url': 'https://yookassa.test/pay-new',
+                       'amount': 300.0, 'currency': 'RUB'}
+    request, = fake.requests
+    assert request.headers['Authorization'] == 'Basic ' + base64.b64encode(b'shop:secret').decode()
+    assert request.headers['Idempotence-Key']
+    assert stats['calls']['create_payment']['calls'] == 1
+
+
+def test_breaker_opens_and_recovers_after_reset_timeout(run):
+    fake = FakeYooKassa()
+    fake.status = 500
+    clock = SimpleNamespace(now=0.0)
+
+    async def scenario(gateway):
+        gateway.breaker = CircuitBreaker(3, 30, clock=lambda: clock.now)
+        failing = [await gateway.check_payment_status('pay-1') for _ in range(5)]
+        states = [gateway.breaker.state]
+        sent_while_open = len(fake.requests)
+
+        # The trial call after reset_timeout fails: open for another 30 seconds
+        clock.now += 30
+        states.append(gateway.breaker.state)
+        await gateway.check_payment_status('pay-1')
+        states.append(gateway.breaker.state)
+
+        fake.status = 200
+        clock.now += 30
+        recovered = await gateway.check_payment_status('pay-1')
+        states.append(gateway.breaker.state)
+        return failing, sent_while_open, states, recovered
+
+    (failing, sent_while_open, states, recovered), stats = run(_with_gateway(fake, scenario))
+
+    assert failing == [None] * 5
+    # Two calls were rejected without a request
+    assert sent_while_open == 3
+    assert states == ['open', 'half_open', 'open', 'closed']
+    assert recovered['status'] == 'succeeded'
+    assert len(fake.requests) == 5
+    assert stats['circuit_opened'] == 2
+    assert stats['calls']['get_payment']['rejected'] == 2
+
+
+def test_timeout_counts_as_a_failure(run):
+    fake = FakeYooKassa(delay=1.0)
+
+    async def scenario(gateway):
+        return [await gateway.check_payment_status('pay-1') for _ in range(2)]
+
+    results, stats = run(_with_gateway(fake, scenario, timeout=0.2, failure_threshold=2))
+
+    assert results == [None, None]
+    calls = stats['calls']['get_payment']
+    assert (calls['timeouts'], calls['failures']) == (2, 2)
+    assert calls['max_ms'] < 1000
+    assert stats['circuit'] == 'open'
+
+
+def test_client_errors_leave_the_circuit_closed(run):
+    fake = FakeYooKassa()
+    fake.status = 404
+
+    async def scenario(gateway):
+        return [await gateway.check_payment_status('pay-unknown') for _ in range(5)]
+
+    results, stats = run(_with_gateway(fake, scenario))
+
+    assert results == [None] * 5
+    assert len(fake.requests) == 5
+    assert stats['circuit'] == 'closed'
+    assert stats['calls']['get_payment']['failures'] == 5
+
+
+def test_concurrent_calls_are_bounded_by_max_concurrency(run):
+    fake = FakeYooKassa(delay=0.05)
+
+    async def scenario(gateway):
+        return await asyncio.gather(*(gateway.check_payment_status(f'pay-{n}') for n in range(12)))
+
+    results, stats = run(_with_gateway(fake, scenario, max_concurrency=3))
+
+    assert [payment['id'] for payment in results] == [f'pay-{n}' for n in range(12)]
+    assert fake.max_in_flight == 3
+    assert stats['calls']['get_payment']['calls'] == 12
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+from database import crud
+from database.models import Order, OutboxMessage, StockReservation
+from utils.payment import PaymentGateway
+from utils.payment_reconciler import PaymentReconciler
+
+
+class FakeYooKassa:
+    """aiohttp server answering GET /payments/{id} like the YooKassa API"""
+
+    def __init__(self):
+        self.payments = {}
+        self.requests = 0
+        self._runner = None
+        self.url = None
+
+    def add(self, order, status):
+        self.payments[order.payment_id] = {
+            'id': order.payment_id,
+            'status': status,
+            'paid': status == 'succeeded',
+            'amount': {'value': f"{order.total_amount:.2f}", 'currency': 'RUB'},
+            'metadata': {'order_id': str(order.id)}
+        }
+
+    async def get_payment(self, request):
+        self.requests += 1
+        payment = self.payments.get(request.match_info['payment_id'])
+        if payment is None:
+            return web.json_response({'type': 'error', 'description': 'Internal error'}, status=500)
+        return web.json_response(payment)
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/v3/payments/{payment_id}', self.get_payment)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}/v3"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+
+def _order_with_payment(db, shop, quantity, payment_id=None, age=None):
+    order = shop.place_order(quantity)
+    if payment_id:
+        assert crud.attach_payment(db, order.id, payment_id)
+    if age:
+        created_at = datetime.utcnow() - age
+        order.created_at = created_at
+        db.query(StockReservation).filter(StockReservation.order_id == order.id).update(
+            {'created_at': created_at, 'expires_at': created_at + timedelta(minutes=60)}
+        )
+    db.commit()
+    db.refresh(order)
+    return order
+
+
+async def _reconcile(fake, runs=1, batch_size=2, failure_threshold=5):
+    """Runs of a reconciler talking to fake; also returns the final circuit state"""
+    async with fake:
+        gateway = PaymentGateway('shop', 'secret', fake.url, timeout=2, max_concurrency=4,
+                                 failure_threshold=failure_threshold, reset_timeout=30)
+        reconciler = PaymentReconciler(gateway, interval=0, batch_size=batch_size, concurrency=2, expiry_minutes=60)
+        try:
+            return [await reconciler.run_once() for _ in range(runs)], gateway.breaker.state
+        finally:
+            await gateway.close()
+
+
+def test_reconciler_applies_lost_notifications(db, shop, run):
+    fake = FakeYooKassa()
+    paid = _order_with_payment(db, shop, 2, 'pay-paid')
+    canceled = _order_with_payment(db, shop, 3, 'pay-canceled')
+    waiting = _order_with_payment(db, shop, 1, 'pay-waiting')
+    overdue = _order_with_payment(db, shop, 1, 'pay-overdue', age=timedelta(hours=3))
+    broken = _order_with_payment(db, shop, 1, 'pay-broken')
+    abandoned = _order_with_payment(db, shop, 4, age=timedelta(hours=3))
+    fake.add(paid, 'succeeded')
+    fake.add(canceled, 'canceled')
+    fake.add(waiting, 'pending')
+    fake.add(overdue, 'pending')
+    assert shop.stock() == 38
+
+    (first, second), _ = run(_reconcile(fake, runs=2))
+
+    assert first['scanned'] == 5 and first['pages'] == 3
+    assert (first['checked'], first['check_errors']) == (4, 1)
+    assert (first['applied'], first['expired'], first['overdue']) == (2, 1, 1)
+    assert first['oldest_pending_s'] >= 3 * 3600 - 60
+    # Only the still-pending payments are looked up again, and nothing repeats
+    assert second['scanned'] == 3
+    assert (second['applied'], second['expired']) == (0, 0)
+    assert fake.requests == 8
+
+    db.expire_all()
+    statuses = {order.id: (order.status, order.payment_status) for order in db.query(Order)}
+    assert statuses == {
+        paid.id: ('paid', 'succeeded'),
+        canceled.id: ('cancelled', 'canceled'),
+        waiting.id: ('pending', 'pending'),
+        overdue.id: ('pending', 'pending'),
+        broken.id: ('pending', 'pending'),
+        abandoned.id: ('cancelled', 'pending'),
+    }
+    # The cancelled and expired orders gave back 3 + 4
+    assert shop.stock() == 45
+    assert db.query(OutboxMessage).count() == 1
+
+
+def test_reconciler_stops_checking_while_the_circuit_is_open(db, shop, run):
+    fake = FakeYooKassa()
+    for n in range(6):
+        _order_with_payment(db, shop, 1, f'pay-missing-{n}')
+
+    (result,), state = run(_reconcile(fake, batch_size=3, failure_threshold=3))
+
+    assert state == 'open'
+    assert result['scanned'] == 6
+    assert result['check_errors'] == 3
+    assert fake.requests == 3
@@ -0,0 +1,140 @@
+from datetime import datetime
+
+import pytest
+
+import config
+import handlers.payment_handlers  # noqa: F401  registers the outbox handlers
+from database import crud
+from database.models import Order, OutboxMessage
+from utils.outbox_worker import OutboxWorker
+from webapp import app as webapp
+
+YOOKASSA_IP = '185.71.76.1'
+
+
+class FakeYooKassa:
+    """Stands in for the payment lookup the webhook makes"""
+
+    def __init__(self):
+        self.payments = {}
+        self.lookups = 0
+
+    def add(self, order, status):
+        self.payments[order.payment_id] = {
+            'id': order.payment_id,
+            'status': status,
+            'paid': status == 'succeeded',
+            'amount': order.total_amount,
+            'currency': 'RUB',
+            'metadata': {'order_id': str(order.id)}
+        }
+
+    def check_payment_status(self, payment_id):
+        self.lookups += 1
+        payment = self.payments.get(payment_id)
+        return dict(payment) if payment else None
+
+
+class FakeBot:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        if self.fail:
+            raise ConnectionError("Telegram is unreachable")
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def yookassa(monkeypatch):
+    fake = FakeYooKassa()
+    monkeypatch.setattr(webapp, 'check_payment_status', fake.check_payment_status)
+    return fake
+
+
+@pytest.fixture
+def client():
+    webapp.app.config['TESTING'] = True
+    return webapp.app.test_client()
+
+
+def _notify(client, payment_id, event='payment.succeeded', ip=YOOKASSA_IP):
+    return client.post(
+        '/api/payments/yookassa',
+        json={'type': 'notification', 'event': event, 'object': {'id': payment_id, 'status': 'succeeded'}},
+        environ_base={'REMOTE_ADDR': ip}
+    )
+
+
+def _paid_order(db, shop, yookassa, status='succeeded'):
+    order = shop.place_order(2)
+    assert crud.attach_payment(db, order.id, f'pay-{order.id}')
+    db.refresh(order)
+    yookassa.add(order, status)
+    return order
+
+
+def test_replayed_notifications_apply_once(db, shop, yookassa, client):
+    order = _paid_order(db, shop, yookassa)
+
+    answers = [_notify(client, order.payment_id).get_json()['status'] for _ in range(3)]
+
+    assert answers == ['applied', 'ignored', 'ignored']
+    assert yookassa.lookups == 3
+    db.expire_all()
+    order = db.get(Order, order.id)
+    assert (order.status, order.payment_status) == ('paid', 'succeeded')
+    assert db.query(OutboxMessage).count() == 1
+
+
+def test_notification_status_is_not_trusted(db, shop, yookassa, client):
+    # The body says succeeded, YooKassa says the payment is still pending
+    order = _paid_order(db, shop, yookassa, status='pending')
+
+    assert _notify(client, order.payment_id).get_json()['status'] == 'ignored'
+    db.expire_all()
+    assert db.get(Order, order.id).status == 'pending'
+    assert db.query(OutboxMessage).count() == 0
+
+
+def test_notifications_from_other_addresses_are_rejected(db, shop, yookassa, client):
+    order = _paid_order(db, shop, yookassa)
+
+    assert _notify(client, order.payment_id, ip='203.0.113.7').status_code == 403
+    assert yookassa.lookups == 0
+
+
+def test_failed_lookup_asks_yookassa_to_retry(db, shop, yookassa, client):
+    assert _notify(client, 'pay-unknown').status_code == 503
+
+
+def test_outbox_retries_until_an_admin_is_notified(db, shop, yookassa, client, run):
+    order = _paid_order(db, shop, yookassa)
+    _notify(client, order.payment_id)
+    worker = OutboxWorker(interval=1, batch_size=10)
+
+    down = FakeBot(fail=True)
+    assert run(worker.run_once(down)) == 1
+    assert worker.failed == 1
+    db.expire_all()
+    message = db.query(OutboxMessage).one()
+    assert message.processed_at is None
+    assert message.available_at > datetime.utcnow()
+
+    # Not due yet: nothing is delivered twice while the backoff runs
+    up = FakeBot()
+    assert run(worker.run_once(up)) == 0
+
+    message.available_at = datetime.utcnow()
+    db.commit()
+    assert run(worker.run_once(up)) == 1
+    assert [chat_id for chat_id, _ in up.sent] == config.ADMIN_IDS
+    assert f"#{order.id}" in up.sent[0][1]
+    db.expire_all()
+    assert db.query(OutboxMessage).one().processed_at is not None
+
+    # A replayed notification after delivery queues nothing new
+    assert _notify(client, order.payment_id).get_json()['status'] == 'ignored'
+    assert run(worker.run_once(up)) == 0
+    assert len(up.sent) == len(config.ADMIN_IDS)
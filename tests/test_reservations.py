@@ -0,0 +1,149 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import crud
+from database.models import Order, OutboxMessage, StockReservation
+from database.payments import ORDER_PAID_EVENT, ORDER_REFUND_EVENT, OrderNotCancellable, needs_refund
+
+
+def _reservations(db, order_id):
+    return db.query(StockReservation).filter(StockReservation.order_id == order_id).count()
+
+
+def _events(db, order_id):
+    return [
+        message.kind for message in db.query(OutboxMessage).order_by(OutboxMessage.id)
+        if json.loads(message.payload)['order_id'] == order_id
+    ]
+
+
+def _succeeded(order, payment_id=None):
+    """A payment as returned by PaymentGateway.check_payment_status"""
+    return {
+        'id': payment_id or order.payment_id,
+        'status': 'succeeded',
+        'paid': True,
+        'amount': order.total_amount,
+        'currency': 'RUB',
+        'metadata': {'order_id': str(order.id)}
+    }
+
+
+def _start_payment(db, order):
+    assert crud.attach_payment(db, order.id, f'pay-{order.id}')
+    db.refresh(order)
+    return order
+
+
+def test_sweep_releases_stock_only_after_expiry(db, shop):
+    order = shop.place_order(4)
+    started = order.created_at
+    assert shop.stock() == 46
+
+    assert crud.sweep_reservations(db, started + timedelta(minutes=59)) == []
+    assert shop.stock() == 46
+
+    assert crud.sweep_reservations(db, started + timedelta(minutes=61)) == [order.id]
+    db.expire_all()
+    assert db.get(Order, order.id).status == 'cancelled'
+    assert _reservations(db, order.id) == 0
+    assert shop.stock() == 50
+
+    # A second sweep finds nothing left to give back
+    assert crud.sweep_reservations(db, started + timedelta(hours=2)) == []
+    assert shop.stock() == 50
+
+
+def test_sweep_skips_orders_with_a_started_payment(db, shop):
+    order = _start_payment(db, shop.place_order(3))
+
+    assert crud.sweep_reservations(db, datetime.utcnow() + timedelta(hours=2)) == []
+    db.expire_all()
+    assert db.get(Order, order.id).status == 'pending'
+    assert shop.stock() == 47
+
+
+def test_cancel_and_payment_keep_stock_consistent(db, shop):
+    cancelled = shop.place_order(2)
+    paid = _start_payment(db, shop.place_order(3))
+    assert shop.stock() == 45
+
+    crud.cancel_order(db, cancelled.id, user_id=shop.user.id)
+    assert shop.stock() == 47
+    with pytest.raises(OrderNotCancellable):
+        crud.cancel_order(db, cancelled.id, user_id=shop.user.id)
+    assert shop.stock() == 47
+
+    assert crud.apply_payment_status(db, _succeeded(paid)) is not None
+    assert _reservations(db, paid.id) == 0
+    assert shop.stock() == 47
+    assert _events(db, paid.id) == [ORDER_PAID_EVENT]
+
+
+def test_cancel_is_refused_while_payment_is_pending(db, shop):
+    order = _start_payment(db, shop.place_order(2))
+
+    with pytest.raises(OrderNotCancellable):
+        crud.cancel_order(db, order.id, user_id=shop.user.id)
+    with pytest.raises(OrderNotCancellable):
+        crud.cancel_order(db, order.id)
+    db.expire_all()
+    assert db.get(Order, order.id).status == 'pending'
+    assert shop.stock() == 48
+
+
+def test_cancel_checks_the_owner(db, shop):
+    order = shop.place_order(1)
+    stranger = crud.get_or_create_user(db, telegram_id=shop.user.telegram_id + 10**6)
+
+    with pytest.raises(OrderNotCancellable):
+        crud.cancel_order(db, order.id, user_id=stranger.id)
+    assert shop.stock() == 49
+
+
+def test_payment_after_cancel_takes_stock_again(db, shop):
+    order = _start_payment(db, shop.place_order(5))
+    # The sweeper or an admin got there first, e.g. before the payment was recorded
+    db.query(Order).filter(Order.id == order.id).update({'payment_id': None})
+    db.commit()
+    crud.cancel_order(db, order.id)
+    assert shop.stock() == 50
+
+    assert crud.apply_payment_status(db, _succeeded(order, f'pay-{order.id}')) is not None
+    db.expire_all()
+    order = db.get(Order, order.id)
+    assert (order.status, order.payment_status) == ('paid', 'succeeded')
+    assert shop.stock() == 45
+    assert _events(db, order.id) == [ORDER_PAID_EVENT]
+
+
+def test_payment_after_cancel_of_sold_out_stock_needs_refund(db, shop):
+    order = shop.place_order(5)
+    crud.cancel_order(db, order.id, user_id=shop.user.id)
+    rival = shop.place_order(48)
+    assert shop.stock() == 2
+
+    assert crud.apply_payment_status(db, _succeeded(order, f'pay-{order.id}')) is not None
+    db.expire_all()
+    order = db.get(Order, order.id)
+    assert (order.status, order.payment_status) == ('cancelled', 'succeeded')
+    assert needs_refund(order)
+    # Nothing was taken from the stock left for others
+    assert shop.stock() == 2
+    assert db.get(Order, rival.id).status == 'pending'
+    assert _events(db, order.id) == [ORDER_REFUND_EVENT]
+
+    # A repeated notification changes nothing
+    assert crud.apply_payment_status(db, _succeeded(order, f'pay-{order.id}')) is None
+    assert _events(db, order.id) == [ORDER_REFUND_EVENT]
+
+
+def test_attach_payment_refuses_a_cancelled_order(db, shop):
+    order = shop.place_order(1)
+    crud.cancel_order(db, order.id)
+
+    assert not crud.attach_payment(db, order.id, f'pay-{order.id}')
+    db.expire_all()
+    assert db.get(Order, order.id).payment_id is None
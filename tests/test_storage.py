@@ -0,0 +1,125 @@
+import time
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from utils import storage
+from utils.storage import MemoryRateLimiter, RedisRateLimiter, SQLLimiterStorage, SQLRateLimiter, SQLStorage
+
+WINDOW = 60
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Frozen time.time for the limiters, starting at a window boundary"""
+    now = SimpleNamespace(value=(int(time.time()) // WINDOW + 1) * WINDOW)
+    monkeypatch.setattr(storage, 'time', SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+@pytest.fixture(params=['memory', 'redis', 'sql'])
+def limiter(request):
+    if request.param == 'memory':
+        return MemoryRateLimiter(max_keys=100)
+    if request.param == 'redis':
+        return RedisRateLimiter(fakeredis.FakeAsyncRedis())
+    return SQLRateLimiter()
+
+
+def test_limit_applies_per_key(limiter, clock, run):
+    async def hits():
+        return (
+            [await limiter.hit('user:1', 3, WINDOW) for _ in range(4)],
+            await limiter.hit('user:2', 3, WINDOW),
+        )
+
+    assert run(hits()) == ([True, True, True, False], True)
+
+
+def test_previous_window_counts_by_its_overlap(limiter, clock, run):
+    async def hits_at(offset, count):
+        clock.value += offset
+        return [await limiter.hit('user:1', 4, WINDOW) for _ in range(count)]
+
+    assert run(hits_at(0, 4)) == [True] * 4
+    # Halfway through the next window half of the 4 previous calls still count
+    assert run(hits_at(WINDOW * 1.5, 3)) == [True, True, False]
+    # Two windows later the old calls are forgotten
+    assert run(hits_at(WINDOW * 1.5, 4)) == [True] * 4
+
+
+def test_sql_limiter_is_shared_between_instances(clock, run):
+    first, second = SQLRateLimiter(), SQLRateLimiter()
+
+    async def hits():
+        return [await limiter.hit('user:1', 3, WINDOW) for limiter in (first, second, first, second)]
+
+    assert run(hits()) == [True, True, True, False]
+
+
+def test_sql_limiter_storage_counts_fixed_windows():
+    limits_storage = SQLLimiterStorage()
+
+    assert [limits_storage.incr('LIMITER/ip/api', 60) for _ in range(3)] == [1, 2, 3]
+    assert limits_storage.get('LIMITER/ip/api') == 3
+    assert limits_storage.get_expiry('LIMITER/ip/api') > time.time() + 50
+    assert limits_storage.check()
+
+    limits_storage.clear('LIMITER/ip/api')
+    assert limits_storage.get('LIMITER/ip/api') == 0
+    assert limits_storage.incr('LIMITER/ip/api', 60) == 1
+    assert limits_storage.reset() == 1
+
+
+def test_sql_fsm_storage_round_trip(run):
+    key = StorageKey(bot_id=1, chat_id=42, user_id=42)
+    other = StorageKey(bot_id=1, chat_id=43, user_id=43)
+
+    async def scenario():
+        writer, reader = SQLStorage(), SQLStorage()
+        await writer.set_state(key, 'CheckoutStates:waiting_for_phone')
+        await writer.set_data(key, {'phone': '+79990000000', 'address': 'Москва'})
+        seen = (await reader.get_state(key), await reader.get_data(key), await reader.get_data(other))
+        await writer.set_state(key, None)
+        await writer.set_data(key, {})
+        return seen, await reader.get_state(key), await reader.get_data(key)
+
+    seen, state, data = run(scenario())
+
+    assert seen == ('CheckoutStates:waiting_for_phone', {'phone': '+79990000000', 'address': 'Москва'}, {})
+    assert (state, data) == (None, {})
+
+
+def test_memory_limiter_keeps_at_most_max_keys(clock, run):
+    limiter = MemoryRateLimiter(max_keys=100)
+
+    async def hits():
+        await limiter.hit('user:0', 1, WINDOW)
+        for n in range(1, 1000):
+            await limiter.hit(f'user:{n}', 1, WINDOW)
+            # user:0 stays the most recently used key
+            await limiter.hit('user:0', 1, WINDOW)
+        return await limiter.hit('user:0', 1, WINDOW), await limiter.hit('user:1', 1, WINDOW)
+
+    # user:0 is still limited; user:1 was evicted long ago and starts over
+    assert run(hits()) == (False, True)
+    stats = limiter.get_stats()
+    # 1000 keys plus user:1 coming back, 100 of them kept
+    assert (stats['keys'], stats['evicted']) == (100, 901)
+
+
+def test_memory_limiter_sweeps_idle_keys(clock, run):
+    limiter = MemoryRateLimiter(max_keys=10_000)
+
+    async def hits(prefix, count):
+        for n in range(count):
+            await limiter.hit(f'{prefix}:{n}', 5, WINDOW)
+
+    run(hits('idle', 500))
+    clock.value += WINDOW * 2
+    run(hits('active', MemoryRateLimiter.SWEEP_INTERVAL))
+
+    assert limiter.get_stats()['keys'] == MemoryRateLimiter.SWEEP_INTERVAL
+    assert limiter.evicted == 500
@@ -0,0 +1,126 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from aiogram.types import User as TelegramUser
+from sqlalchemy import event
+
+from database import async_crud
+from database.db import async_engine
+from database.models import User
+from utils import middleware
+from utils.middleware import UserCache, UserMiddleware
+
+
+@contextmanager
+def _statements():
+    counter = [0]
+
+    def count(*args):
+        counter[0] += 1
+
+    event.listen(async_engine.sync_engine, 'before_cursor_execute', count)
+    try:
+        yield counter
+    finally:
+        event.remove(async_engine.sync_engine, 'before_cursor_execute', count)
+
+
+def _sender(telegram_id, username='anna'):
+    return TelegramUser(id=telegram_id, is_bot=False, first_name='Анна', username=username)
+
+
+async def _handle(user_middleware, sender):
+    """Pass one update through the middleware; returns the db_user the handler got"""
+    async def handler(event, data):
+        return data['db_user']
+    return await user_middleware(handler, SimpleNamespace(), {'event_from_user': sender})
+
+
+def test_returning_users_cost_no_queries(db, run):
+    cache = UserCache(ttl=60, max_size=10)
+    user_middleware = UserMiddleware(cache, flush_interval=60)
+
+    first = run(_handle(user_middleware, _sender(777)))
+    with _statements() as statements:
+        again = [run(_handle(user_middleware, _sender(777))) for _ in range(5)]
+
+    assert statements[0] == 0
+    assert all(user == first for user in again)
+    assert db.query(User).filter(User.telegram_id == 777).one().id == first.id
+    stats = cache.get_stats()
+    assert (stats['misses'], stats['hits'], stats['writes_avoided']) == (1, 5, 5)
+    assert stats['pending_activity'] == 1
+
+
+def test_changed_profile_and_expired_entries_are_reloaded(db, run, monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(middleware, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    cache = UserCache(ttl=60, max_size=10)
+    user_middleware = UserMiddleware(cache, flush_interval=60)
+
+    run(_handle(user_middleware, _sender(777)))
+    renamed = run(_handle(user_middleware, _sender(777, username='anna_k')))
+    assert renamed.username == 'anna_k'
+    db.expire_all()
+    assert db.query(User).filter(User.telegram_id == 777).one().username == 'anna_k'
+
+    # Blocked by an admin in another process: seen once the entry expires
+    db.query(User).filter(User.telegram_id == 777).update({'is_blocked': True})
+    db.commit()
+    assert not run(_handle(user_middleware, _sender(777, username='anna_k'))).is_blocked
+    clock.now += 61
+    assert run(_handle(user_middleware, _sender(777, username='anna_k'))).is_blocked
+    # Only the one unchanged, unexpired lookup skipped the database
+    assert cache.writes_avoided == 1
+
+
+def test_least_recently_used_user_is_evicted(db, run):
+    cache = UserCache(ttl=60, max_size=2)
+    user_middleware = UserMiddleware(cache, flush_interval=60)
+
+    for telegram_id in (1, 2, 1, 3):
+        run(_handle(user_middleware, _sender(telegram_id)))
+
+    assert cache.get(2) is None
+    assert cache.get(1) is not None and cache.get(3) is not None
+    assert cache.evicted == 1
+
+
+def test_activity_is_flushed_in_one_update(db, run):
+    cache = UserCache(ttl=60, max_size=100)
+    user_middleware = UserMiddleware(cache, flush_interval=60)
+    ids = [run(_handle(user_middleware, _sender(500 + n))).id for n in range(20)]
+    db.query(User).update({'last_activity': datetime(2020, 1, 1)})
+    db.commit()
+    for _ in range(3):
+        for n in range(20):
+            run(_handle(user_middleware, _sender(500 + n)))
+
+    with _statements() as statements:
+        assert run(user_middleware.stop()) is None
+
+    assert statements[0] == 1
+    assert (cache.flushes, cache.flushed_rows) == (1, 20)
+    db.expire_all()
+    recent = datetime.utcnow() - timedelta(minutes=1)
+    assert all(user.last_activity > recent for user in db.query(User).filter(User.id.in_(ids)))
+    assert run(cache.flush()) == 0
+
+
+def test_failed_flush_keeps_activity_for_the_next_one(db, run, monkeypatch):
+    cache = UserCache(ttl=60, max_size=100)
+    user_middleware = UserMiddleware(cache, flush_interval=60)
+    user = run(_handle(user_middleware, _sender(900)))
+    cache.touch(user.id)
+
+    async def unavailable(db, activity):
+        raise ConnectionError("database is unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(async_crud, 'touch_users', unavailable)
+        assert run(cache.flush()) == 0
+    assert cache.get_stats()['pending_activity'] == 1
+
+    assert run(cache.flush()) == 1
+    assert cache.get_stats()['pending_activity'] == 0
@@ -0,0 +1,86 @@
+from datetime import timedelta
+
+import pytest
+
+from database import crud, inventory
+from database.inventory import InsufficientStockError
+from database.models import Product, ProductVariant
+
+
+def _sizes(db, product_id):
+    db.expire_all()
+    return dict(db.query(ProductVariant.size, ProductVariant.stock).filter(ProductVariant.product_id == product_id))
+
+
+def _hoodie(db, shop):
+    return crud.create_product(db, shop.product.category_id, 'Худи', 'Флис', 300.0,
+                               sizes='S,M,L', size_stock='{"S": 2, "M": 5, "L": 0}')
+
+
+def _order(db, shop, product, size, quantity):
+    crud.add_to_cart(db, shop.user.id, product.id, quantity, size=size)
+    items = crud.get_cart_items(db, shop.user.id, profile='cart_with_products')
+    order = crud.create_order(db, shop.user.id, items)
+    crud.clear_cart(db, shop.user.id)
+    return order
+
+
+def test_size_stock_becomes_variants(db, shop):
+    hoodie = _hoodie(db, shop)
+
+    assert _sizes(db, hoodie.id) == {'S': 2, 'M': 5, 'L': 0}
+    assert [variant.size for variant in crud.get_product(db, hoodie.id).variants] == ['S', 'M', 'L']
+    assert crud.get_product(db, hoodie.id).stock == 7
+    assert crud.get_available_stock(db, hoodie.id, 'M') == 5
+    assert crud.get_available_stock(db, hoodie.id, 'XL') == 0
+
+
+def test_cart_checks_the_size_not_the_total(db, shop):
+    hoodie = _hoodie(db, shop)
+
+    with pytest.raises(InsufficientStockError) as error:
+        crud.add_to_cart(db, shop.user.id, hoodie.id, 3, size='S')
+    assert error.value.shortages[0].size == 'S'
+    assert error.value.shortages[0].available == 2
+    with pytest.raises(InsufficientStockError):
+        crud.add_to_cart(db, shop.user.id, hoodie.id, 1, size='L')
+
+
+def test_cancel_gives_the_size_back(db, shop):
+    hoodie = _hoodie(db, shop)
+    order = _order(db, shop, hoodie, 'M', 4)
+    assert _sizes(db, hoodie.id) == {'S': 2, 'M': 1, 'L': 0}
+    assert db.get(Product, hoodie.id).stock == 3
+
+    crud.cancel_order(db, order.id, user_id=shop.user.id)
+
+    assert _sizes(db, hoodie.id) == {'S': 2, 'M': 5, 'L': 0}
+    assert db.get(Product, hoodie.id).stock == 7
+
+
+def test_expired_reservation_gives_the_size_back(db, shop):
+    hoodie = _hoodie(db, shop)
+    order = _order(db, shop, hoodie, 'S', 2)
+    assert _sizes(db, hoodie.id)['S'] == 0
+
+    assert crud.sweep_reservations(db, order.created_at + timedelta(hours=2)) == [order.id]
+
+    assert _sizes(db, hoodie.id) == {'S': 2, 'M': 5, 'L': 0}
+    assert db.get(Product, hoodie.id).stock == 7
+
+
+def test_legacy_size_stock_is_converted(db, shop):
+    product = db.get(Product, shop.product.id)
+    product.sizes = 'M,S'
+    product.size_stock = '{"S": 3, "M": "4", "XL": "много"}'
+    db.commit()
+
+    assert inventory.convert_size_stock(db) == 1
+    db.commit()
+
+    assert _sizes(db, product.id) == {'S': 3, 'M': 4}
+    assert [variant.size for variant in db.get(Product, product.id).variants] == ['M', 'S']
+    # The old total still caps the sizes
+    assert db.get(Product, product.id).stock == 50
+    assert db.get(Product, product.id).size_stock is None
+    assert inventory.convert_size_stock(db) == 0
@@ -0,0 +1,312 @@
+"""
+Admin broadcast engine.
+
+Recipients are streamed from the database in keyset batches on users.id,
+so no session stays open while messages are being sent. Each batch is
+delivered by a pool of workers that share one token-bucket rate limiter
+(Telegram allows about 30 messages per second per bot); RetryAfter pauses
+the whole pool. Users who blocked the bot are deactivated with one UPDATE
+per batch.
+
+Progress is saved in the settings table after every batch, and
+resume_broadcast() continues an interrupted broadcast on the next start.
+After a crash, at most one batch is sent twice.
+"""
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, asdict, field
+from typing import List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from database.db import get_async_db
+from database import async_crud
+from utils.keyboards import get_back_to_admin_keyboard, get_broadcast_progress_keyboard
+import config
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_STATE_KEY = 'broadcast_state'
+MAX_SEND_ATTEMPTS = 5
+
+
+@dataclass
+class BroadcastProgress:
+    text: str
+    admin_chat_id: int
+    status_message_id: Optional[int] = None
+    status: str = 'running'
+    last_user_id: int = 0
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str) -> 'BroadcastProgress':
+        return cls(**json.loads(data))
+
+
+class RateLimiter:
+    """Token bucket shared by all broadcast workers"""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a message may be sent"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens; RetryAfter applies to the whole bot, not one chat"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class Broadcaster:
+    """Deliver one broadcast, batch by batch, with a bounded worker pool"""
+
+    def __init__(self, bot: Bot, progress: BroadcastProgress,
+                 rate: float = None, concurrency: int = None, batch_size: int = None,
+                 status_interval: float = None):
+        self.bot = bot
+        self.progress = progress
+        self.limiter = RateLimiter(rate or config.BROADCAST_RATE)
+        self.concurrency = concurrency or config.BROADCAST_CONCURRENCY
+        self.batch_size = batch_size or config.BROADCAST_BATCH_SIZE
+        self.status_interval = config.BROADCAST_STATUS_INTERVAL if status_interval is None else status_interval
+        self.cancelled = False
+        self._blocked_ids: List[int] = []
+        self._reported_at = 0.0
+
+    async def run(self) -> BroadcastProgress:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        try:
+            while not self.cancelled:
+                async with get_async_db() as db:
+                    batch = await async_crud.get_broadcast_recipients(
+                        db, after_id=self.progress.last_user_id, limit=self.batch_size
+                    )
+                if not batch:
+                    break
+
+                for user_id, telegram_id in batch:
+                    await queue.put((user_id, telegram_id))
+                await queue.join()
+                await self._finish_batch(batch[-1][0])
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        self.progress.status = 'cancelled' if self.cancelled else 'done'
+        self.progress.finished_at = time.time()
+        await save_progress(self.progress)
+        await self._report(final=True)
+        return self.progress
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            user_id, telegram_id = await queue.get()
+            try:
+                if not self.cancelled:
+                    await self._deliver(user_id, telegram_id)
+            finally:
+                queue.task_done()
+
+    async def _deliver(self, user_id: int, telegram_id: int):
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(telegram_id, self.progress.text)
+                self.progress.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Broadcast flood limit hit, pausing for {e.retry_after}s")
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                self.progress.blocked += 1
+                self._blocked_ids.append(user_id)
+                return
+            except TelegramBadRequest as e:
+                logger.info(f"Broadcast to {telegram_id} rejected: {e}")
+                self.progress.failed += 1
+                return
+            except Exception as e:
+                logger.warning(f"Broadcast to {telegram_id} failed: {e}")
+                self.progress.failed += 1
+                return
+        self.progress.failed += 1
+
+    async def _finish_batch(self, last_user_id: int):
+        blocked_ids, self._blocked_ids = self._blocked_ids, []
+        if blocked_ids:
+            async with get_async_db() as db:
+                await async_crud.deactivate_users(db, blocked_ids)
+
+        self.progress.last_user_id = last_user_id
+        await save_progress(self.progress)
+
+        if time.monotonic() - self._reported_at >= self.status_interval:
+            await self._report()
+
+    async def _report(self, final: bool = False):
+        self._reported_at = time.monotonic()
+        if not self.progress.status_message_id:
+            return
+
+        try:
+            await self.bot.edit_message_text(
+                format_progress(self.progress),
+                chat_id=self.progress.admin_chat_id,
+                message_id=self.progress.status_message_id,
+                reply_markup=get_back_to_admin_keyboard() if final else get_broadcast_progress_keyboard()
+            )
+        except Exception as e:
+            logger.debug(f"Failed to update broadcast status: {e}")
+
+
+def format_progress(progress: BroadcastProgress) -> str:
+    """Status message text for the admin"""
+    if progress.status == 'done':
+        header = "✅ Рассылка завершена!"
+    elif progress.status == 'cancelled':
+        header = "⏹ Рассылка остановлена"
+    else:
+        header = f"📤 Отправка... {progress.processed}/{progress.total}"
+
+    return (
+        f"{header}\n\n"
+        f"Отправлено: {progress.sent}\n"
+        f"Заблокировали бота: {progress.blocked}\n"
+        f"Не доставлено: {progress.failed}"
+    )
+
+
+async def save_progress(progress: BroadcastProgress):
+    async with get_async_db() as db:
+        await async_crud.set_setting(db, BROADCAST_STATE_KEY, progress.to_json())
+
+
+async def load_progress() -> Optional[BroadcastProgress]:
+    async with get_async_db() as db:
+        data = await async_crud.get_setting(db, BROADCAST_STATE_KEY)
+    if not data:
+        return None
+    try:
+        return BroadcastProgress.from_json(data)
+    except (TypeError, ValueError) as e:
+        logger.error(f"Corrupted broadcast state, ignoring: {e}")
+        return None
+
+
+_current: Optional[Broadcaster] = None
+_task: Optional[asyncio.Task] = None
+
+
+def is_running() -> bool:
+    return _task is not None and not _task.done()
+
+
+def _launch(bot: Bot, progress: BroadcastProgress):
+    global _current, _task
+    _current = Broadcaster(bot, progress)
+    _task = asyncio.create_task(_current.run())
+    _task.add_done_callback(_on_done)
+
+
+def _on_done(task: asyncio.Task):
+    if task.cancelled():
+        logger.info("Broadcast task cancelled; it will resume on next start")
+    elif task.exception():
+        logger.error(f"Broadcast failed: {task.exception()}")
+    else:
+        progress = task.result()
+        logger.info(
+            f"Broadcast {progress.status}: sent={progress.sent} "
+            f"blocked={progress.blocked} failed={progress.failed}"
+        )
+
+
+async def start_broadcast(bot: Bot, text: str, admin_chat_id: int,
+                          status_message_id: int = None) -> bool:
+    """
+    Start a broadcast in the background
+
+    Args:
+        bot: Bot instance used for sending
+        text: Message text
+        admin_chat_id: Chat that receives progress updates
+        status_message_id: Message edited with progress
+
+    Returns:
+        bool: False if another broadcast is still running
+    """
+    if is_running():
+        return False
+
+    async with get_async_db() as db:
+        total = await async_crud.count_broadcast_recipients(db)
+
+    progress = BroadcastProgress(
+        text=text,
+        admin_chat_id=admin_chat_id,
+        status_message_id=status_message_id,
+        total=total
+    )
+    await save_progress(progress)
+    _launch(bot, progress)
+    return True
+
+
+async def resume_broadcast(bot: Bot) -> bool:
+    """Continue a broadcast interrupted by a restart"""
+    if is_running():
+        return False
+
+    progress = await load_progress()
+    if not progress or progress.status != 'running':
+        return False
+
+    logger.info(f"Resuming broadcast after user id {progress.last_user_id} "
+                f"({progress.processed}/{progress.total} processed)")
+    _launch(bot, progress)
+    return True
+
+
+def cancel_broadcast() -> bool:
+    """Stop the running broadcast after in-flight messages are sent"""
+    if not is_running():
+        return False
+    _current.cancelled = True
+    return True
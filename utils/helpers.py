@@ -1,7 +1,4 @@
 from aiogram import Bot
-from aiogram.types import User as TelegramUser
-from database.models import User
-from database.db import get_db
 from database import crud
 import config
 import logging
@@ -64,7 +61,7 @@ def format_order_details(order) -> str:
         return "❌ Заказ пуст"
     
     items_text = "\n".join([
-        f"  • {item.product_name} {f'({item.size})' if item.size else ''} x{item.quantity} - {format_price(item.product_price * item.quantity)}"
+        f"  • {item.product_name} {f'({item.size})' if item.size else ''} x{item.quantity} - {format_price(item.price * item.quantity)}"
         for item in order.items
     ])
     
@@ -90,8 +87,36 @@ def format_order_details(order) -> str:
     return text.strip()
 
 
+def format_cart(view) -> str:
+    """Format a database.cart.CartView for display"""
+    items_text = "\n".join([
+        f"• {item.name} {f'({item.size})' if item.size else ''} x{item.quantity} - {format_price(item.line_total)}"
+        for item in view.items
+    ])
+    
+    return f"""
+🛒 <b>Ваша корзина</b>
+
+{items_text}
+
+<b>Итого:</b> {format_price(view.total)}
+""".strip()
+
+
+def format_stock_shortages(shortages) -> str:
+    """Explain which cart items are out of stock"""
+    lines = ["❌ Недостаточно товара на складе:\n"]
+    for shortage in shortages:
+        name = shortage.name or "Товар недоступен"
+        if shortage.size:
+            name += f" ({shortage.size})"
+        lines.append(f"• {name}: в корзине {shortage.requested}, доступно {shortage.available}")
+    lines.append("\nИзмените количество в корзине и оформите заказ снова.")
+    return "\n".join(lines)
+
+
 def format_product_details(product) -> str:
-    """Format product details for display"""
+    """Format catalog snapshot product details for display"""
     if not product:
         return "❌ Товар не найден"
     
@@ -104,34 +129,16 @@ def format_product_details(product) -> str:
 <b>В наличии:</b> {product.stock} шт.
 """
     
-    if product.sizes:
-        import json
-        try:
-            sizes = json.loads(product.sizes)
-            if sizes:
-                text += f"\n<b>Размеры:</b> {', '.join(sizes)}"
-        except json.JSONDecodeError:
-            logger.warning(f"Failed to parse sizes for product {product.id}")
+    if product.size_list:
+        sizes = [
+            f"{size} ({product.size_stock_map[size]} шт.)" if size in product.size_stock_map else size
+            for size in product.size_list
+        ]
+        text += f"\n<b>Размеры:</b> {', '.join(sizes)}"
     
     return text.strip()
 
 
-async def get_or_create_user_from_telegram(telegram_user: TelegramUser) -> User:
-    """Get or create user from Telegram user object"""
-    if not telegram_user or not telegram_user.id:
-        raise ValueError("Invalid telegram user")
-    
-    with get_db() as db:
-        user = crud.get_or_create_user(
-            db,
-            telegram_id=telegram_user.id,
-            username=telegram_user.username,
-            first_name=telegram_user.first_name,
-            last_name=telegram_user.last_name
-        )
-        return user
-
-
 def get_user_theme(db, telegram_id: int) -> str:
     """Get user's theme preference"""
     try:
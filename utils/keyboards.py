@@ -1,9 +1,9 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from typing import List
+from typing import List, Optional
 from database.models import Category, Product, Order
+from database.catalog_cache import ProductView
 import config
-import json
 
 
 def get_main_menu_keyboard(is_admin: bool = False, theme: str = 'light') -> InlineKeyboardMarkup:
@@ -71,14 +71,13 @@ def get_products_keyboard(products: List[Product], category_id: int) -> InlineKe
     return builder.as_markup()
 
 
-def get_product_keyboard(product: Product, in_cart: bool = False) -> InlineKeyboardMarkup:
+def get_product_keyboard(product: ProductView, in_cart: bool = False) -> InlineKeyboardMarkup:
     """Product detail keyboard"""
     builder = InlineKeyboardBuilder()
     
     if product.stock > 0:
-        if product.sizes:
-            sizes = json.loads(product.sizes)
-            for size in sizes:
+        if product.available_sizes:
+            for size in product.available_sizes:
                 builder.add(
                     InlineKeyboardButton(
                         text=f"Размер {size}",
@@ -111,7 +110,7 @@ def get_product_keyboard(product: Product, in_cart: bool = False) -> InlineKeybo
 
 
 def get_cart_keyboard(cart_items: List, total: float) -> InlineKeyboardMarkup:
-    """Cart keyboard"""
+    """Cart keyboard for database.cart.CartLine items"""
     builder = InlineKeyboardBuilder()
     
     if cart_items:
@@ -123,7 +122,7 @@ def get_cart_keyboard(cart_items: List, total: float) -> InlineKeyboardMarkup:
                     callback_data=f"cart_decrease_{item.id}"
                 ),
                 InlineKeyboardButton(
-                    text=f"{item.product.name}{size_text} x{item.quantity}",
+                    text=f"{item.name}{size_text} x{item.quantity}",
                     callback_data="noop"
                 ),
                 InlineKeyboardButton(
@@ -164,7 +163,7 @@ def get_checkout_keyboard(order_id: int) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_orders_keyboard(orders: List[Order]) -> InlineKeyboardMarkup:
+def get_orders_keyboard(orders: List[Order], next_cursor: Optional[str] = None) -> InlineKeyboardMarkup:
     """Orders list keyboard"""
     builder = InlineKeyboardBuilder()
     
@@ -175,6 +174,7 @@ def get_orders_keyboard(orders: List[Order]) -> InlineKeyboardMarkup:
             'processing': '📦',
             'shipped': '🚚',
             'delivered': '✅',
+            'completed': '✅',
             'cancelled': '❌'
         }.get(order.status, '❓')
         
@@ -185,6 +185,11 @@ def get_orders_keyboard(orders: List[Order]) -> InlineKeyboardMarkup:
             )
         )
     
+    if next_cursor:
+        builder.row(
+            InlineKeyboardButton(text="Далее ▶️", callback_data=f"my_orders_p_{next_cursor}")
+        )
+    
     builder.row(
         InlineKeyboardButton(text="◀️ Главное меню", callback_data="main_menu")
     )
@@ -279,12 +284,14 @@ def get_admin_category_actions_keyboard(category_id: int, theme: str = 'light')
     return builder.as_markup()
 
 
-def get_admin_products_keyboard(categories: List[Category], theme: str = 'light') -> InlineKeyboardMarkup:
+def get_admin_products_keyboard(categories: List[Category], product_counts: dict = None,
+                                theme: str = 'light') -> InlineKeyboardMarkup:
     """Admin products management - select category"""
     builder = InlineKeyboardBuilder()
+    product_counts = product_counts or {}
     
     for category in categories:
-        product_count = len(category.products)
+        product_count = product_counts.get(category.id, {}).get('total', 0)
         builder.row(
             InlineKeyboardButton(
                 text=f"📂 {category.name} ({product_count})",
@@ -325,13 +332,15 @@ def get_admin_product_actions_keyboard(product_id: int, theme: str = 'light') ->
     return builder.as_markup()
 
 
-def get_admin_orders_keyboard(orders: List[Order], theme: str = 'light') -> InlineKeyboardMarkup:
+def get_admin_orders_keyboard(orders: List[Order], theme: str = 'light',
+                              next_cursor: Optional[str] = None) -> InlineKeyboardMarkup:
     """Admin orders management"""
     builder = InlineKeyboardBuilder()
     
     for order in orders:
         status_emoji = {
             'pending': '⏳',
+            'paid': '💳',
             'processing': '🔄',
             'completed': '✅',
             'cancelled': '❌'
@@ -344,6 +353,11 @@ def get_admin_orders_keyboard(orders: List[Order], theme: str = 'light') -> Inli
             )
         )
     
+    if next_cursor:
+        builder.row(
+            InlineKeyboardButton(text="Далее ▶️", callback_data=f"admin_orders_p_{next_cursor}")
+        )
+    
     builder.row(
         InlineKeyboardButton(text="◀️ Админ-панель", callback_data="back_to_admin")
     )
@@ -355,7 +369,7 @@ def get_admin_order_actions_keyboard(order_id: int, status: str, theme: str = 'l
     """Admin order actions"""
     builder = InlineKeyboardBuilder()
     
-    if status == 'pending':
+    if status in ('pending', 'paid'):
         builder.row(
             InlineKeyboardButton(text="В обработку", callback_data=f"admin_order_status_{order_id}_processing")
         )
@@ -376,7 +390,8 @@ def get_admin_order_actions_keyboard(order_id: int, status: str, theme: str = 'l
     return builder.as_markup()
 
 
-def get_admin_users_keyboard(users: List, theme: str = 'light') -> InlineKeyboardMarkup:
+def get_admin_users_keyboard(users: List, theme: str = 'light',
+                             next_cursor: Optional[str] = None) -> InlineKeyboardMarkup:
     """Admin users management"""
     builder = InlineKeyboardBuilder()
     
@@ -390,6 +405,11 @@ def get_admin_users_keyboard(users: List, theme: str = 'light') -> InlineKeyboar
             )
         )
     
+    if next_cursor:
+        builder.row(
+            InlineKeyboardButton(text="Далее ▶️", callback_data=f"admin_users_p_{next_cursor}")
+        )
+    
     builder.row(
         InlineKeyboardButton(text="◀️ Админ-панель", callback_data="back_to_admin")
     )
@@ -435,6 +455,15 @@ def get_back_to_admin_keyboard(theme: str = 'light') -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def get_broadcast_progress_keyboard(theme: str = 'light') -> InlineKeyboardMarkup:
+    """Running broadcast status keyboard"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="⏹ Остановить рассылку", callback_data="admin_broadcast_cancel")
+    )
+    return builder.as_markup()
+
+
 def get_confirm_keyboard(action: str, item_id: int, theme: str = 'light') -> InlineKeyboardMarkup:
     """Confirmation keyboard"""
     builder = InlineKeyboardBuilder()
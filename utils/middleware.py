@@ -0,0 +1,215 @@
+"""
+Telegram user resolution for bot handlers.
+
+UserMiddleware resolves the sender of every handled message and callback
+to an internal user record and passes it to handlers as ``db_user``.
+Records are cached per process (TTL + LRU on telegram_id), so a returning
+user costs no database round trip: only a cache miss or a changed Telegram
+profile goes through get_or_create_user. last_activity is kept in memory
+and written for every active user with one UPDATE per flush interval.
+
+A user changed by another process (the webapp, another webhook worker) is
+seen at most USER_CACHE_TTL seconds later; changes made in this process
+drop the cached record right away through invalidate_user().
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User as TelegramUser
+
+from database.db import get_async_db
+from database.models import User
+from database import async_crud
+import config
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    id: int
+    telegram_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    is_active: bool
+    is_blocked: bool
+    theme: str
+
+    @classmethod
+    def from_model(cls, user: User) -> 'CachedUser':
+        return cls(
+            id=user.id,
+            telegram_id=user.telegram_id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            is_active=bool(user.is_active),
+            is_blocked=bool(user.is_blocked),
+            theme=user.theme or 'light',
+        )
+
+    def matches(self, telegram_user: TelegramUser) -> bool:
+        """False if get_or_create_user would write a changed profile field"""
+        for name in PROFILE_FIELDS:
+            value = getattr(telegram_user, name)
+            if value and value != getattr(self, name):
+                return False
+        return True
+
+
+class UserCache:
+    """
+    Bounded TTL cache of user records with pending last_activity updates
+
+    Entries are kept in access order and the least recently used one is
+    dropped once max_size is reached.
+    """
+
+    def __init__(self, ttl: float = None, max_size: int = None):
+        self.ttl = ttl if ttl is not None else config.USER_CACHE_TTL
+        self.max_size = max_size or config.USER_CACHE_MAX_SIZE
+        # telegram_id -> (record, expires at (monotonic time))
+        self._users: "OrderedDict[int, Tuple[CachedUser, float]]" = OrderedDict()
+        # user id -> last seen
+        self._activity: Dict[int, datetime] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.writes_avoided = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def get(self, telegram_id: int) -> Optional[CachedUser]:
+        entry = self._users.get(telegram_id)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self._users[telegram_id]
+            self.misses += 1
+            return None
+        self._users.move_to_end(telegram_id)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, user: CachedUser):
+        if user.telegram_id not in self._users and len(self._users) >= self.max_size:
+            self._users.popitem(last=False)
+            self.evicted += 1
+        self._users[user.telegram_id] = (user, time.monotonic() + self.ttl)
+        self._users.move_to_end(user.telegram_id)
+
+    def invalidate(self, telegram_id: int):
+        self._users.pop(telegram_id, None)
+
+    def touch(self, user_id: int):
+        """Record activity to be written by the next flush"""
+        self._activity[user_id] = datetime.utcnow()
+
+    async def flush(self) -> int:
+        """Write pending last_activity values in one UPDATE; returns updated rows"""
+        if not self._activity:
+            return 0
+        pending, self._activity = self._activity, {}
+        try:
+            async with get_async_db() as db:
+                rows = await async_crud.touch_users(db, pending)
+        except Exception as e:
+            logger.warning(f"Failed to flush activity of {len(pending)} users: {e}")
+            # Keep newer activity recorded while the flush was running
+            for user_id, seen in pending.items():
+                self._activity.setdefault(user_id, seen)
+            return 0
+        self.flushes += 1
+        self.flushed_rows += rows
+        return rows
+
+    def get_stats(self) -> dict:
+        return {
+            'size': len(self._users),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evicted': self.evicted,
+            'writes_avoided': self.writes_avoided,
+            'pending_activity': len(self._activity),
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+        }
+
+
+user_cache = UserCache()
+
+
+def invalidate_user(telegram_id: int):
+    """Drop a cached user after changing it in the database"""
+    user_cache.invalidate(telegram_id)
+
+
+class UserMiddleware(BaseMiddleware):
+    """Inject the sender's cached user record into handlers as db_user"""
+
+    def __init__(self, cache: UserCache = None, flush_interval: float = None):
+        self.cache = cache or user_cache
+        self.flush_interval = flush_interval or config.USER_ACTIVITY_FLUSH_INTERVAL
+        self._task: Optional[asyncio.Task] = None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        telegram_user = data.get('event_from_user')
+        if telegram_user is not None:
+            data['db_user'] = await self.resolve(telegram_user)
+        return await handler(event, data)
+
+    async def resolve(self, telegram_user: TelegramUser) -> CachedUser:
+        user = self.cache.get(telegram_user.id)
+        if user is not None and user.matches(telegram_user):
+            # get_or_create_user would have committed a last_activity UPDATE here
+            self.cache.writes_avoided += 1
+            self.cache.touch(user.id)
+            return user
+
+        async with get_async_db() as db:
+            record = await async_crud.get_or_create_user(
+                db,
+                telegram_id=telegram_user.id,
+                username=telegram_user.username,
+                first_name=telegram_user.first_name,
+                last_name=telegram_user.last_name
+            )
+            user = CachedUser.from_model(record)
+        self.cache.put(user)
+        return user
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.cache.flush()
+
+    async def start(self):
+        """Start periodic activity flushes (dispatcher startup hook)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop flushing and write what is still pending (dispatcher shutdown hook)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.cache.flush()
+        logger.info(f"User cache stats: {self.cache.get_stats()}")
@@ -0,0 +1,103 @@
+"""
+Bot-side delivery of database.outbox messages.
+
+Modules register a coroutine per message kind with @handler(kind); the
+worker claims due messages in batches, runs their handlers and marks them
+processed. A failing handler is retried with backoff (see
+database.outbox.retry_later), so handlers must tolerate running twice.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot
+
+from database.db import get_async_db
+from database import async_crud
+import config
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL = 3600
+
+_handlers: Dict[str, Callable[[Bot, dict], Awaitable[None]]] = {}
+
+
+def handler(kind: str):
+    """Register the delivery coroutine for a message kind"""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+class OutboxWorker:
+    """Polls the outbox and delivers messages from the bot process"""
+
+    def __init__(self, interval: float = None, batch_size: int = None):
+        self.interval = interval or config.OUTBOX_POLL_INTERVAL
+        self.batch_size = batch_size or config.OUTBOX_BATCH_SIZE
+        self._task: Optional[asyncio.Task] = None
+        self._purged_at = 0.0
+        self.delivered = 0
+        self.failed = 0
+
+    async def run_once(self, bot: Bot) -> int:
+        """Deliver one batch; returns the number of claimed messages"""
+        async with get_async_db() as db:
+            messages = await async_crud.claim_outbox_messages(db, limit=self.batch_size)
+        
+        done = []
+        for message in messages:
+            deliver = _handlers.get(message.kind)
+            if deliver is None:
+                logger.error(f"No outbox handler for {message.kind!r}; dropping message {message.id}")
+                done.append(message.id)
+                continue
+            try:
+                await deliver(bot, message.payload)
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Outbox message {message.id} ({message.kind}) failed, attempt {message.attempts}: {e}")
+                async with get_async_db() as db:
+                    await async_crud.retry_outbox_message(db, message.id, message.attempts)
+                continue
+            done.append(message.id)
+        
+        if done:
+            async with get_async_db() as db:
+                await async_crud.complete_outbox_messages(db, done)
+            self.delivered += len(done)
+        return len(messages)
+
+    async def _run(self, bot: Bot):
+        while True:
+            try:
+                claimed = await self.run_once(bot)
+                if time.monotonic() - self._purged_at > PURGE_INTERVAL:
+                    async with get_async_db() as db:
+                        await async_crud.purge_outbox(db)
+                    self._purged_at = time.monotonic()
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}")
+                claimed = 0
+            # A full batch means there may be more waiting
+            if claimed < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    async def start(self, bot: Bot):
+        """Start polling (dispatcher startup hook)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        """Stop polling (dispatcher shutdown hook); leased messages are retried after the lease"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.info(f"Outbox worker stopped: delivered={self.delivered} failed={self.failed}")
@@ -1,6 +1,25 @@
+"""
+YooKassa payments.
+
+The module-level functions call the synchronous YooKassa SDK and block the
+calling thread; they are meant for scripts and the web app. Bot handlers
+use payment_gateway instead: an aiohttp client for the same API calls with
+a per-call timeout, a concurrency limit, latency metrics and a circuit
+breaker, so a slow or failing provider never stalls the event loop.
+"""
+import asyncio
+import base64
+import time
 import uuid
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import aiohttp
 from yookassa import Configuration, Payment
-from config import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, BOT_URL
+from config import (
+    YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, YOOKASSA_API_URL, BOT_URL,
+    PAYMENT_TIMEOUT, PAYMENT_MAX_CONCURRENCY, PAYMENT_BREAKER_THRESHOLD, PAYMENT_BREAKER_RESET
+)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -8,6 +27,37 @@ logger = logging.getLogger(__name__)
 # Configure YooKassa
 Configuration.account_id = YOOKASSA_SHOP_ID
 Configuration.secret_key = YOOKASSA_SECRET_KEY
+Configuration.api_url = YOOKASSA_API_URL
+
+
+def payment_request(amount: float, order_id: int, description: str, return_url: str = None) -> dict:
+    """
+    Body of a YooKassa create-payment request
+    
+    Args:
+        amount: Payment amount in rubles
+        order_id: Order ID stored in the payment metadata
+        description: Payment description
+        return_url: URL to return after payment
+    
+    Returns:
+        dict ready to be sent as JSON
+    """
+    return {
+        "amount": {
+            "value": f"{amount:.2f}",
+            "currency": "RUB"
+        },
+        "confirmation": {
+            "type": "redirect",
+            "return_url": return_url or f"{BOT_URL}/payment/success"
+        },
+        "capture": True,
+        "description": description,
+        "metadata": {
+            "order_id": order_id
+        }
+    }
 
 
 def create_payment(amount: float, order_id: int, description: str, return_url: str = None) -> dict:
@@ -26,21 +76,7 @@ def create_payment(amount: float, order_id: int, description: str, return_url: s
     try:
         idempotence_key = str(uuid.uuid4())
         
-        payment_data = {
-            "amount": {
-                "value": f"{amount:.2f}",
-                "currency": "RUB"
-            },
-            "confirmation": {
-                "type": "redirect",
-                "return_url": return_url or f"{BOT_URL}/payment/success"
-            },
-            "capture": True,
-            "description": description,
-            "metadata": {
-                "order_id": order_id
-            }
-        }
+        payment_data = payment_request(amount, order_id, description, return_url)
         
         payment = Payment.create(payment_data, idempotence_key)
         
@@ -144,3 +180,247 @@ def refund_payment(payment_id: str, amount: float = None) -> bool:
     except Exception as e:
         logger.error(f"Error refunding payment: {e}")
         return False
+
+
+# ============= ASYNC GATEWAY =============
+
+class PaymentError(Exception):
+    """YooKassa rejected the request"""
+
+
+class PaymentUnavailable(PaymentError):
+    """YooKassa did not answer in time, failed, or the circuit is open"""
+
+
+def payment_info(payment: dict) -> dict:
+    """Status dict (as returned by check_payment_status) from a YooKassa payment object"""
+    return {
+        "id": payment["id"],
+        "status": payment["status"],
+        "paid": payment.get("paid", False),
+        "amount": float(payment["amount"]["value"]),
+        "currency": payment["amount"]["currency"],
+        "metadata": payment.get("metadata") or {}
+    }
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing provider for a while
+    
+    After failure_threshold consecutive failures the circuit opens and calls
+    are rejected without a request for reset_timeout seconds. Then a single
+    trial call is let through (another one if it has not finished after
+    reset_timeout): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_started: Optional[float] = None
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        now = self._clock()
+        if state == 'half_open' and (self._trial_started is None or now - self._trial_started >= self.reset_timeout):
+            self._trial_started = now
+            return True
+        return False
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial_started = None
+
+    def record_failure(self):
+        self._failures += 1
+        if self._trial_started is not None or self._failures >= self.failure_threshold:
+            if self._opened_at is None or self._trial_started is not None:
+                self.opened += 1
+            self._opened_at = self._clock()
+            self._trial_started = None
+
+
+@dataclass
+class CallStats:
+    calls: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    rejected: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    def record(self, elapsed_ms: float):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def to_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'avg_ms': round(self.total_ms / self.calls, 1) if self.calls else None,
+            'max_ms': round(self.max_ms, 1),
+        }
+
+
+class PaymentGateway:
+    """Non-blocking YooKassa client for bot handlers"""
+
+    def __init__(self, shop_id: str = None, secret_key: str = None, api_url: str = None,
+                 timeout: float = None, max_concurrency: int = None,
+                 failure_threshold: int = None, reset_timeout: float = None):
+        self.shop_id = shop_id or YOOKASSA_SHOP_ID
+        self.secret_key = secret_key or YOOKASSA_SECRET_KEY
+        self.api_url = (api_url or YOOKASSA_API_URL).rstrip('/')
+        self.timeout = timeout or PAYMENT_TIMEOUT
+        self.max_concurrency = max_concurrency or PAYMENT_MAX_CONCURRENCY
+        self.breaker = CircuitBreaker(
+            failure_threshold or PAYMENT_BREAKER_THRESHOLD,
+            reset_timeout if reset_timeout is not None else PAYMENT_BREAKER_RESET
+        )
+        self.stats: Dict[str, CallStats] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            credentials = base64.b64encode(f"{self.shop_id}:{self.secret_key}".encode()).decode()
+            self._session = aiohttp.ClientSession(
+                headers={'Authorization': f"Basic {credentials}"},
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def _send(self, method: str, path: str, body: Optional[dict], headers: dict):
+        session = self._get_session()
+        async with self._semaphore:
+            async with session.request(method, f"{self.api_url}{path}", json=body, headers=headers) as response:
+                return await response.json(content_type=None), response.status
+
+    async def _request(self, name: str, method: str, path: str, body: dict = None) -> dict:
+        stats = self.stats.setdefault(name, CallStats())
+        if not self.breaker.allow():
+            stats.rejected += 1
+            raise PaymentUnavailable(f"{name}: circuit open")
+        
+        headers = {'Idempotence-Key': str(uuid.uuid4())} if method == 'POST' else {}
+        started = time.perf_counter()
+        try:
+            # Waiting for a free slot counts towards the timeout
+            data, status = await asyncio.wait_for(self._send(method, path, body, headers), self.timeout)
+            if not isinstance(data, dict):
+                raise ValueError(f"unexpected response body {data!r}")
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            stats.failures += 1
+            self.breaker.record_failure()
+            raise PaymentUnavailable(f"{name}: no response in {self.timeout}s")
+        except (aiohttp.ClientError, ValueError) as e:
+            stats.failures += 1
+            self.breaker.record_failure()
+            raise PaymentUnavailable(f"{name}: {e}") from e
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats.record(elapsed_ms)
+            logger.debug(f"YooKassa {name} took {elapsed_ms:.0f} ms")
+        
+        if status >= 500 or status == 429:
+            stats.failures += 1
+            self.breaker.record_failure()
+            raise PaymentUnavailable(f"{name}: HTTP {status}")
+        # 4xx answers mean the provider is up: the request itself was wrong
+        self.breaker.record_success()
+        if status != 200:
+            stats.failures += 1
+            raise PaymentError(f"{name}: HTTP {status}: {data.get('description')}")
+        return data
+
+    async def create_payment(self, amount: float, order_id: int, description: str,
+                             return_url: str = None) -> Optional[dict]:
+        """Async create_payment; None on failure"""
+        try:
+            payment = await self._request(
+                'create_payment', 'POST', '/payments',
+                payment_request(amount, order_id, description, return_url)
+            )
+            return {
+                "id": payment["id"],
+                "status": payment["status"],
+                "confirmation_url": payment["confirmation"]["confirmation_url"],
+                "amount": amount,
+                "currency": "RUB"
+            }
+        except (PaymentError, KeyError) as e:
+            logger.error(f"Error creating payment: {e}")
+            return None
+
+    async def check_payment_status(self, payment_id: str) -> Optional[dict]:
+        """Async check_payment_status; None on failure"""
+        try:
+            return payment_info(await self._request('get_payment', 'GET', f"/payments/{payment_id}"))
+        except (PaymentError, KeyError) as e:
+            logger.error(f"Error checking payment status: {e}")
+            return None
+
+    async def cancel_payment(self, payment_id: str) -> bool:
+        """Async cancel_payment"""
+        try:
+            payment = await self._request('get_payment', 'GET', f"/payments/{payment_id}")
+            if payment["status"] != "pending":
+                return False
+            await self._request('cancel_payment', 'POST', f"/payments/{payment_id}/cancel", {})
+            return True
+        except (PaymentError, KeyError) as e:
+            logger.error(f"Error cancelling payment: {e}")
+            return False
+
+    async def refund_payment(self, payment_id: str, amount: float = None) -> bool:
+        """Async refund_payment"""
+        try:
+            payment = await self._request('get_payment', 'GET', f"/payments/{payment_id}")
+            if payment["status"] != "succeeded":
+                return False
+            refund_amount = amount or float(payment["amount"]["value"])
+            refund = await self._request('create_refund', 'POST', '/refunds', {
+                "amount": {
+                    "value": f"{refund_amount:.2f}",
+                    "currency": "RUB"
+                },
+                "payment_id": payment_id
+            })
+            return refund["status"] == "succeeded"
+        except (PaymentError, KeyError) as e:
+            logger.error(f"Error refunding payment: {e}")
+            return False
+
+    def get_stats(self) -> dict:
+        return {
+            'circuit': self.breaker.state,
+            'circuit_opened': self.breaker.opened,
+            'calls': {name: stats.to_dict() for name, stats in self.stats.items()},
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+payment_gateway = PaymentGateway()
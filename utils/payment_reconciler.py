@@ -0,0 +1,143 @@
+"""
+Background reconciliation of pending payments.
+
+Orders only learn about their payment when YooKassa notifies the web app
+or the user presses "check payment"; a lost notification leaves the order
+pending for good. The reconciler walks pending orders with a started
+payment oldest first in keyset pages, fetches the status of each page's
+payments concurrently (at most PAYMENT_RECONCILE_CONCURRENCY requests,
+inside the gateway's own limit and circuit breaker) and applies the whole
+page in one transaction through database.payments, so repeats and races
+with the webhook are harmless.
+
+Each run also sweeps expired stock reservations (database.reservations),
+cancelling orders that never started a payment. Orders whose payment is
+still pending at YooKassa after STOCK_RESERVATION_MINUTES are left to it:
+a pending payment cannot be cancelled through the API and YooKassa cancels
+it itself, which the next run applies like any other status. Such orders
+are counted as overdue.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from database.db import get_async_db
+from database import async_crud, reservations
+from utils.payment import PaymentGateway, payment_gateway
+import config
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('scanned', 'checked', 'check_errors', 'applied', 'expired', 'overdue')
+
+
+class PaymentReconciler:
+    """Periodically settles pending orders against YooKassa"""
+
+    def __init__(self, gateway: PaymentGateway = None, interval: float = None, batch_size: int = None,
+                 concurrency: int = None, expiry_minutes: float = None,
+                 clock: Callable[[], datetime] = datetime.utcnow):
+        self.gateway = gateway or payment_gateway
+        self.interval = interval if interval is not None else config.PAYMENT_RECONCILE_INTERVAL
+        self.batch_size = batch_size or config.PAYMENT_RECONCILE_BATCH
+        self.expiry = timedelta(minutes=expiry_minutes if expiry_minutes is not None else config.STOCK_RESERVATION_MINUTES)
+        self._semaphore = asyncio.Semaphore(concurrency or config.PAYMENT_RECONCILE_CONCURRENCY)
+        self._clock = clock
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.totals = dict.fromkeys(COUNTERS, 0)
+        self.last_run: Optional[dict] = None
+
+    async def _check(self, payment_id: str) -> Optional[dict]:
+        async with self._semaphore:
+            return await self.gateway.check_payment_status(payment_id)
+
+    async def run_once(self) -> dict:
+        """
+        Reconcile every pending order once
+
+        Returns:
+            dict: Counters of the run plus pages, duration_s, checks_per_s and
+            oldest_pending_s (age of the oldest pending order, i.e. the lag)
+        """
+        started = time.perf_counter()
+        now = self._clock()
+        cutoff = now - self.expiry
+        checks_enabled = bool(self.gateway.shop_id and self.gateway.secret_key)
+        run = dict.fromkeys(COUNTERS, 0)
+        run.update(pages=0, oldest_pending_s=0.0)
+
+        cursor = None
+        while True:
+            async with get_async_db() as db:
+                rows, cursor = await async_crud.get_pending_payments_page(db, cursor, self.batch_size)
+            if not rows:
+                break
+            if run['pages'] == 0:
+                run['oldest_pending_s'] = round((now - rows[0].created_at).total_seconds(), 1)
+            run['pages'] += 1
+            run['scanned'] += len(rows)
+
+            # While the circuit is open every check would be rejected anyway
+            if checks_enabled and self.gateway.breaker.state != 'open':
+                results = await asyncio.gather(*(self._check(row.payment_id) for row in rows))
+                fetched = [payment for payment in results if payment is not None]
+                run['checked'] += len(fetched)
+                run['check_errors'] += len(results) - len(fetched)
+                if fetched:
+                    async with get_async_db() as db:
+                        run['applied'] += len(await async_crud.apply_payment_statuses(db, fetched))
+                run['overdue'] += sum(
+                    1 for row, payment in zip(rows, results)
+                    if payment is not None and payment['status'] == 'pending' and row.created_at < cutoff
+                )
+
+            if cursor is None:
+                break
+
+        while True:
+            async with get_async_db() as db:
+                expired = await async_crud.sweep_reservations(db, now)
+            run['expired'] += len(expired)
+            if len(expired) < reservations.SWEEP_BATCH:
+                break
+
+        duration = time.perf_counter() - started
+        run['duration_s'] = round(duration, 3)
+        run['checks_per_s'] = round(run['checked'] / duration, 1) if duration else 0.0
+        self.runs += 1
+        for name in COUNTERS:
+            self.totals[name] += run[name]
+        self.last_run = run
+        return run
+
+    async def _run(self):
+        while True:
+            try:
+                run = await self.run_once()
+                if run['scanned'] or run['expired']:
+                    logger.info(f"Payment reconciliation: {run}")
+            except Exception as e:
+                logger.error(f"Payment reconciliation failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        """Start periodic runs (dispatcher startup hook); an interval of 0 disables them"""
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop periodic runs (dispatcher shutdown hook)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.info(f"Payment reconciler stopped: {self.get_stats()}")
+
+    def get_stats(self) -> dict:
+        return {'runs': self.runs, **self.totals, 'last_run': self.last_run}
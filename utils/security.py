@@ -3,13 +3,12 @@ import hashlib
 import hmac
 import time
 from functools import wraps
-from typing import Dict, Optional
+from typing import Optional
 import logging
 
-logger = logging.getLogger(__name__)
+from utils.storage import get_rate_limiter
 
-# Rate limiting storage (in production, use Redis)
-_rate_limit_storage: Dict[str, list] = {}
+logger = logging.getLogger(__name__)
 
 
 def sanitize_input(text: str, max_length: int = 1000) -> str:
@@ -96,7 +95,7 @@ def validate_quantity(quantity: str) -> Optional[int]:
 
 def rate_limit(max_calls: int = 5, time_window: int = 60):
     """
-    Rate limiting decorator
+    Rate limiting decorator (sliding window, shared per STORAGE_BACKEND)
     
     Args:
         max_calls: Maximum calls allowed
@@ -116,19 +115,9 @@ def rate_limit(max_calls: int = 5, time_window: int = 60):
                 return await func(*args, **kwargs)
             
             key = f"{func.__name__}:{user_id}"
-            current_time = time.time()
-            
-            # Initialize or clean old entries
-            if key not in _rate_limit_storage:
-                _rate_limit_storage[key] = []
             
-            _rate_limit_storage[key] = [
-                t for t in _rate_limit_storage[key]
-                if current_time - t < time_window
-            ]
-            
-            # Check rate limit
-            if len(_rate_limit_storage[key]) >= max_calls:
+            # Check and count the call
+            if not await get_rate_limiter().hit(key, max_calls, time_window):
                 logger.warning(f"Rate limit exceeded for user {user_id} on {func.__name__}")
                 
                 # Try to answer if it's a callback
@@ -142,9 +131,6 @@ def rate_limit(max_calls: int = 5, time_window: int = 60):
                 
                 return
             
-            # Add current call
-            _rate_limit_storage[key].append(current_time)
-            
             return await func(*args, **kwargs)
         
         return wrapper
@@ -0,0 +1,315 @@
+"""
+Shared storage backends for rate limits and FSM state.
+
+STORAGE_BACKEND selects where the web limiter (flask-limiter), the bot's
+rate_limit decorator and aiogram FSM keep their state:
+
+- memory: per-process dictionaries (single process, lost on restart)
+- redis:  REDIS_URL, shared by every bot and gunicorn worker
+- sql:    tables in the application database, for deployments without Redis
+
+Rate limits use a sliding-window counter: two fixed-window counters (the
+current and the previous window), with the previous one weighted by how
+much of it still overlaps the sliding window. Each check is O(1) whatever
+the call rate.
+"""
+import json
+import logging
+import random
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from limits.storage import Storage
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database.db import SessionLocal, get_async_db
+from database.models import RateLimitCounter, FSMRecord
+import config
+
+logger = logging.getLogger(__name__)
+
+# Share of SQL counter writes that also purge expired rows
+SQL_PURGE_PROBABILITY = 0.001
+
+
+def window_weight(now: float, window: float) -> float:
+    """Share of the previous fixed window still covered by the sliding window"""
+    return 1 - (now % window) / window
+
+
+# ============= SQL COUNTERS =============
+
+def _sql_incr(db: Session, key: str, expiry: float, amount: int = 1) -> int:
+    """Increment a fixed-window counter, starting a new window if it expired"""
+    now = datetime.utcnow()
+    row = db.query(RateLimitCounter).filter(RateLimitCounter.key == key).with_for_update().first()
+    if row is None:
+        try:
+            with db.begin_nested():
+                row = RateLimitCounter(key=key, count=amount, expires_at=now + timedelta(seconds=expiry))
+                db.add(row)
+            return amount
+        except IntegrityError:
+            row = db.query(RateLimitCounter).filter(RateLimitCounter.key == key).with_for_update().one()
+
+    if row.expires_at <= now:
+        row.count = amount
+        row.expires_at = now + timedelta(seconds=expiry)
+    else:
+        row.count += amount
+
+    if random.random() < SQL_PURGE_PROBABILITY:
+        db.query(RateLimitCounter).filter(RateLimitCounter.expires_at < now).delete(synchronize_session=False)
+    return row.count
+
+
+def _sql_get(db: Session, key: str) -> int:
+    count = db.query(RateLimitCounter.count).filter(
+        RateLimitCounter.key == key,
+        RateLimitCounter.expires_at > datetime.utcnow()
+    ).scalar()
+    return count or 0
+
+
+def _sql_sliding_hit(db: Session, key: str, limit: int, window: float, now: float) -> bool:
+    index = int(now // window)
+    current = db.query(RateLimitCounter).filter(
+        RateLimitCounter.key == f"{key}:{index}"
+    ).with_for_update().first()
+    current_count = current.count if current and current.expires_at > datetime.utcnow() else 0
+    previous_count = _sql_get(db, f"{key}:{index - 1}")
+
+    if previous_count * window_weight(now, window) + current_count >= limit:
+        return False
+    _sql_incr(db, f"{key}:{index}", window * 2)
+    return True
+
+
+class SQLLimiterStorage(Storage):
+    """flask-limiter (limits) storage on the rate_limit_counters table; storage_uri shopdb://"""
+
+    STORAGE_SCHEME = ["shopdb"]
+
+    def __init__(self, uri: str = None, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return Exception
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        with SessionLocal() as db:
+            count = _sql_incr(db, key, expiry, amount)
+            db.commit()
+            return count
+
+    def get(self, key: str) -> int:
+        with SessionLocal() as db:
+            return _sql_get(db, key)
+
+    def get_expiry(self, key: str) -> float:
+        with SessionLocal() as db:
+            expires_at = db.query(RateLimitCounter.expires_at).filter(RateLimitCounter.key == key).scalar()
+        if not expires_at:
+            return time.time()
+        return (expires_at - datetime(1970, 1, 1)).total_seconds()
+
+    def check(self) -> bool:
+        try:
+            with SessionLocal() as db:
+                db.query(RateLimitCounter.key).first()
+            return True
+        except Exception:
+            return False
+
+    def reset(self) -> Optional[int]:
+        with SessionLocal() as db:
+            deleted = db.query(RateLimitCounter).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+
+    def clear(self, key: str) -> None:
+        with SessionLocal() as db:
+            db.query(RateLimitCounter).filter(RateLimitCounter.key == key).delete(synchronize_session=False)
+            db.commit()
+
+
+def limiter_storage_uri() -> str:
+    """storage_uri for flask-limiter matching STORAGE_BACKEND"""
+    if config.STORAGE_BACKEND == "redis":
+        return config.REDIS_URL
+    if config.STORAGE_BACKEND == "sql":
+        return "shopdb://"
+    return "memory://"
+
+
+# ============= SLIDING-WINDOW LIMITERS =============
+
+class MemoryRateLimiter:
+    """
+    Per-process sliding-window counters with bounded memory
+    
+    Entries are kept in access order; keys idle for two full windows are
+    swept from the front, and the least recently used keys are dropped
+    once max_keys is reached, so memory stays O(max_keys) however many
+    distinct users pass through.
+    """
+
+    SWEEP_INTERVAL = 1000
+
+    def __init__(self, max_keys: int = None):
+        self.max_keys = max_keys or config.RATE_LIMIT_MAX_KEYS
+        # key -> [window index, current count, previous count, idle after (unix time)]
+        self._windows: "OrderedDict[str, list]" = OrderedDict()
+        self._calls = 0
+        self.evicted = 0
+
+    def _sweep(self, now: float):
+        while self._windows:
+            key, entry = next(iter(self._windows.items()))
+            if entry[3] > now:
+                break
+            del self._windows[key]
+            self.evicted += 1
+
+    async def hit(self, key: str, limit: int, window: float) -> bool:
+        """Count a call; False if it exceeds limit calls per window seconds"""
+        now = time.time()
+        index = int(now // window)
+
+        self._calls += 1
+        if self._calls % self.SWEEP_INTERVAL == 0:
+            self._sweep(now)
+
+        entry = self._windows.get(key)
+        if entry is None:
+            if len(self._windows) >= self.max_keys:
+                self._windows.popitem(last=False)
+                self.evicted += 1
+            entry = self._windows[key] = [index, 0, 0, 0.0]
+        else:
+            self._windows.move_to_end(key)
+            if entry[0] != index:
+                entry[2] = entry[1] if entry[0] == index - 1 else 0
+                entry[1] = 0
+                entry[0] = index
+
+        if entry[2] * window_weight(now, window) + entry[1] >= limit:
+            return False
+        entry[1] += 1
+        # Both windows have rolled out of the sliding window after this moment
+        entry[3] = (index + 2) * window
+        return True
+
+    def get_stats(self) -> dict:
+        return {'keys': len(self._windows), 'max_keys': self.max_keys, 'evicted': self.evicted}
+
+
+class RedisRateLimiter:
+    """Sliding-window counters in Redis, checked and incremented atomically by a Lua script"""
+
+    SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * tonumber(ARGV[3]) + current >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self._script = redis.register_script(self.SCRIPT)
+
+    async def hit(self, key: str, limit: int, window: float) -> bool:
+        now = time.time()
+        index = int(now // window)
+        allowed = await self._script(
+            keys=[f"rl:{key}:{index}", f"rl:{key}:{index - 1}"],
+            args=[limit, int(window * 2) + 1, window_weight(now, window)]
+        )
+        return bool(allowed)
+
+
+class SQLRateLimiter:
+    """Sliding-window counters in the rate_limit_counters table"""
+
+    async def hit(self, key: str, limit: int, window: float) -> bool:
+        async with get_async_db() as db:
+            return await db.run_sync(_sql_sliding_hit, f"rl:{key}", limit, window, time.time())
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter():
+    """Process-wide limiter for STORAGE_BACKEND"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        if config.STORAGE_BACKEND == "redis":
+            from redis.asyncio import Redis
+            _rate_limiter = RedisRateLimiter(Redis.from_url(config.REDIS_URL))
+        elif config.STORAGE_BACKEND == "sql":
+            _rate_limiter = SQLRateLimiter()
+        else:
+            _rate_limiter = MemoryRateLimiter()
+    return _rate_limiter
+
+
+# ============= FSM =============
+
+class SQLStorage(BaseStorage):
+    """aiogram FSM storage on the fsm_records table"""
+
+    def __init__(self, key_builder: DefaultKeyBuilder = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def _get(self, key: StorageKey) -> Optional[FSMRecord]:
+        async with get_async_db() as db:
+            return await db.get(FSMRecord, self.key_builder.build(key))
+
+    async def _upsert(self, key: StorageKey, **values):
+        async with get_async_db() as db:
+            record_key = self.key_builder.build(key)
+            record = await db.get(FSMRecord, record_key, with_for_update=True)
+            if record is None:
+                db.add(FSMRecord(key=record_key, **values))
+            else:
+                for name, value in values.items():
+                    setattr(record, name, value)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._upsert(key, state=state.state if hasattr(state, "state") else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._upsert(key, data=json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._get(key)
+        if not record or not record.data:
+            return {}
+        return json.loads(record.data)
+
+    async def close(self) -> None:
+        pass
+
+
+def create_fsm_storage() -> BaseStorage:
+    """aiogram FSM storage for STORAGE_BACKEND"""
+    if config.STORAGE_BACKEND == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(config.REDIS_URL)
+    if config.STORAGE_BACKEND == "sql":
+        return SQLStorage()
+    return MemoryStorage()
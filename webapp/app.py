@@ -1,12 +1,20 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, make_response, send_file
 from flask_cors import CORS
+from functools import wraps
+from werkzeug.http import is_resource_modified
+import ipaddress
 import sys
 import os
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from database.db import get_db
-from database import crud
+from database import crud, catalog_cache, inventory, search
+from database.pagination import InvalidCursor
+from webapp.payload_cache import PayloadCache, build_payload
+from webapp.image_cache import ImageCache, ImageNotFound, ImageUnavailable, is_file_id
+from utils.storage import limiter_storage_uri
+from utils.payment import check_payment_status
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_talisman import Talisman
@@ -14,7 +22,7 @@ from datetime import datetime
 import config
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor'])
 
 app.config['SECRET_KEY'] = config.SECRET_KEY
 
@@ -28,14 +36,152 @@ Talisman(app,
     }
 )
 
+# Serialized catalog responses, per worker process
+payload_cache = PayloadCache(max_bytes=config.PAYLOAD_CACHE_MAX_BYTES)
+
+# Catalog photos resolved from Telegram file_ids, shared on disk by all workers
+image_cache = ImageCache(
+    config.IMAGE_CACHE_DIR,
+    config.BOT_TOKEN,
+    api_url=config.TELEGRAM_API_URL,
+    widths=config.IMAGE_THUMBNAIL_WIDTHS,
+    workers=config.IMAGE_THUMBNAIL_WORKERS
+)
+
 # Rate limiting
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    storage_uri=limiter_storage_uri()
 )
 
+def paginated_json(items, next_cursor=None):
+    """JSON list response with the keyset cursor of the next page in X-Next-Cursor"""
+    response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+def page_limit(default=None, maximum=200):
+    """Read ?limit= clamped to [1, maximum]; None means no pagination requested"""
+    limit = request.args.get('limit', type=int)
+    if limit is None:
+        return default
+    return min(max(limit, 1), maximum)
+
+
+YOOKASSA_NETWORKS = [ipaddress.ip_network(network, strict=False) for network in config.YOOKASSA_WEBHOOK_IPS]
+
+
+def client_ip() -> str:
+    """Peer address, or the one the outermost of WEBHOOK_TRUSTED_PROXIES proxies saw"""
+    if config.WEBHOOK_TRUSTED_PROXIES:
+        forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+        if len(forwarded) >= config.WEBHOOK_TRUSTED_PROXIES:
+            return forwarded[-config.WEBHOOK_TRUSTED_PROXIES]
+    return request.remote_addr
+
+
+def is_yookassa_address(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in YOOKASSA_NETWORKS)
+
+
+def photo_url(photo: str, width: int = None) -> str:
+    """Browser URL of a product photo; Telegram file_ids go through /img"""
+    if not is_file_id(photo):
+        return photo
+    return f"/img/{photo}?w={width}" if width else f"/img/{photo}"
+
+
+def product_images(product) -> dict:
+    """Full-size and thumbnail URLs of a product's photos"""
+    thumb_width = image_cache.widths[0] if image_cache.widths else None
+    return {
+        'photo_urls': [photo_url(photo) for photo in product.photo_list],
+        'thumbnail_urls': [photo_url(photo, thumb_width) for photo in product.photo_list],
+    }
+
+
+def payload_response(payload):
+    """Response for a cached payload, pre-compressed when the client accepts it"""
+    body, encoding = payload.encoded(request.accept_encodings)
+    response = app.response_class(body, mimetype='application/json', headers=payload.headers)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def catalog_cached(with_stock: bool = False):
+    """
+    Conditional GET and payload caching for endpoints served from the catalog snapshot
+    
+    The ETag is the catalog version, which database.crud bumps on every
+    category/product edit, so a matching If-None-Match (or an
+    If-Modified-Since not older than the last bump) is answered with 304
+    before the view builds any JSON. Endpoints showing stock (with_stock)
+    add the token of the current catalog_cache.StockLevels, which changes
+    at most once per CATALOG_STOCK_TTL, and send no Last-Modified.
+    
+    Views get the snapshot and stock levels (None without with_stock) the
+    ETag and cache key were built from as their first arguments, so a
+    payload is always stored under the versions it was built from. They
+    return plain data (optionally with a headers dict); it is serialized
+    once per catalog version and stock token and served from payload_cache.
+    Error responses pass through uncached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            return catalog_response(view, with_stock, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def catalog_response(view, with_stock: bool, *args, **kwargs):
+    """Body of catalog_cached"""
+    snapshot = catalog_cache.get_snapshot()
+    stock = catalog_cache.get_stock() if with_stock else None
+    etag = f"catalog-v{snapshot.version}"
+    last_modified = snapshot.updated_at.replace(microsecond=0) if snapshot.updated_at else None
+    if stock is not None:
+        etag += f"-s{stock.token}"
+        last_modified = None
+    
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response('', 304)
+    else:
+        key = (request.path, tuple(sorted(request.args.items(multi=True))), stock.token if stock else None)
+        payload = payload_cache.get(key, snapshot.version)
+        if payload is None:
+            rv = view(snapshot, stock, *args, **kwargs)
+            data, headers = rv if isinstance(rv, tuple) and isinstance(rv[-1], dict) else (rv, {})
+            if not isinstance(data, (list, dict)):
+                return make_response(rv)
+            payload = build_payload(data, headers)
+            payload_cache.put(key, snapshot.version, payload)
+        response = payload_response(payload)
+    
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = config.CATALOG_HTTP_MAX_AGE
+    response.cache_control.stale_while_revalidate = config.CATALOG_HTTP_STALE_WHILE_REVALIDATE
+    return response
+
+
+@app.errorhandler(InvalidCursor)
+def invalid_cursor(e):
+    return jsonify({'error': 'Invalid cursor'}), 400
+
+
 @app.route('/')
 def index():
     """Main page"""
@@ -63,69 +209,80 @@ def admin_products():
 
 @app.route('/api/categories')
 @limiter.limit("30 per minute")
-def get_categories():
+@catalog_cached()
+def get_categories(snapshot, stock):
     """Get all categories"""
     try:
-        with get_db() as db:
-            categories = crud.get_categories(db, active_only=True)
-            
-            return jsonify([{
-                'id': cat.id,
-                'name': cat.name,
-                'description': cat.description,
-                'icon': cat.icon,
-                'product_count': len([p for p in cat.products if p.is_active])
-            } for cat in categories])
+        categories = snapshot.get_categories(active_only=True)
+        
+        return [{
+            'id': cat.id,
+            'name': cat.name,
+            'description': cat.description,
+            'icon': cat.icon,
+            'product_count': cat.active_product_count
+        } for cat in categories]
     except Exception as e:
         app.logger.error(f"Error fetching categories: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/products')
 @limiter.limit("30 per minute")
-def get_products():
+@catalog_cached(with_stock=True)
+def get_products(snapshot, stock):
     """Get products by category"""
     try:
         category_id = request.args.get('category_id', type=int)
-        with get_db() as db:
-            products = crud.get_products(db, category_id=category_id, active_only=True)
-            
-            return jsonify([{
-                'id': prod.id,
-                'name': prod.name,
-                'description': prod.description,
-                'price': prod.price,
-                'stock': prod.stock,
-                'sizes': prod.sizes,
-                'photos': prod.photos.split(',') if prod.photos else [],
-                'category_id': prod.category_id
-            } for prod in products])
+        cursor = request.args.get('cursor')
+        limit = page_limit(default=50 if cursor else None)
+        
+        next_cursor = None
+        if limit:
+            products, next_cursor = snapshot.get_products_page(category_id, cursor=cursor, limit=limit)
+        else:
+            products = snapshot.get_products(category_id)
+        
+        return [{
+            'id': prod.id,
+            'name': prod.name,
+            'description': prod.description,
+            'price': prod.price,
+            'stock': stock.stock_of(prod),
+            'sizes': prod.sizes,
+            'photos': list(prod.photo_list),
+            **product_images(prod),
+            'category_id': prod.category_id
+        } for prod in products], {'X-Next-Cursor': next_cursor} if next_cursor else {}
+    except InvalidCursor:
+        raise
     except Exception as e:
         app.logger.error(f"Error fetching products: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/product/<int:product_id>')
 @limiter.limit("60 per minute")
-def get_product(product_id):
+@catalog_cached(with_stock=True)
+def get_product(snapshot, stock, product_id):
     """Get single product"""
     try:
-        with get_db() as db:
-            product = crud.get_product(db, product_id)
-            
-            if not product:
-                return jsonify({'error': 'Product not found'}), 404
-            
-            return jsonify({
-                'id': product.id,
-                'name': product.name,
-                'description': product.description,
-                'price': product.price,
-                'stock': product.stock,
-                'sizes': product.sizes,
-                'size_chart': product.size_chart,
-                'photos': product.photos.split(',') if product.photos else [],
-                'category_id': product.category_id,
-                'category_name': product.category.name
-            })
+        product = snapshot.get_product(product_id)
+        
+        if not product:
+            return jsonify({'error': 'Product not found'}), 404
+        
+        return {
+            'id': product.id,
+            'name': product.name,
+            'description': product.description,
+            'price': product.price,
+            'stock': stock.stock_of(product),
+            'sizes': product.sizes,
+            'size_chart': product.size_chart,
+            'photos': list(product.photo_list),
+            **product_images(product),
+            'category_id': product.category_id,
+            'category_name': product.category_name
+        }
     except Exception as e:
         app.logger.error(f"Error fetching product {product_id}: {e}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -140,29 +297,108 @@ def search_products():
         if not query or len(query) < 2:
             return jsonify([])
         
-        query = query[:100]  # Limit length
+        category_id = request.args.get('category_id', type=int)
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 50)
+        offset = max(request.args.get('offset', 0, type=int), 0)
         
         with get_db() as db:
-            from database.models import Product
-            products = db.query(Product).filter(
-                Product.is_active == True,
-                (Product.name.ilike(f'%{query}%') | Product.description.ilike(f'%{query}%'))
-            ).limit(20).all()
-            
-            return jsonify([{
-                'id': prod.id,
-                'name': prod.name,
-                'description': prod.description,
-                'price': prod.price,
-                'stock': prod.stock,
-                'photos': prod.photos.split(',') if prod.photos else [],
-                'category_id': prod.category_id,
-                'category_name': prod.category.name
-            } for prod in products])
+            product_ids = search.search_products(
+                db, query, category_id=category_id, limit=limit, offset=offset
+            )
+        
+        snapshot = catalog_cache.get_snapshot()
+        stock = catalog_cache.get_stock()
+        products = [snapshot.get_product(pid) for pid in product_ids]
+        
+        return jsonify([{
+            'id': prod.id,
+            'name': prod.name,
+            'description': prod.description,
+            'price': prod.price,
+            'stock': stock.stock_of(prod),
+            'photos': list(prod.photo_list),
+            **product_images(prod),
+            'category_id': prod.category_id,
+            'category_name': prod.category_name
+        } for prod in products if prod])
     except Exception as e:
         app.logger.error(f"Error searching products: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/img/<file_id>')
+@limiter.limit("600 per minute")
+def product_image(file_id):
+    """Catalog photo by Telegram file_id, as a WebP thumbnail when ?w= is given"""
+    # Only photos of catalog products are proxied
+    if not is_file_id(file_id) or file_id not in catalog_cache.get_snapshot().photo_ids:
+        return jsonify({'error': 'Image not found'}), 404
+    
+    try:
+        digest, mimetype = image_cache.resolve(file_id)
+    except ImageNotFound as e:
+        app.logger.warning(f"Image {file_id} not found: {e}")
+        return jsonify({'error': 'Image not found'}), 404
+    except ImageUnavailable as e:
+        app.logger.warning(f"Image {file_id} unavailable: {e}")
+        response = jsonify({'error': 'Image temporarily unavailable'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    
+    path, etag, immutable = image_cache.original_path(digest), digest, True
+    width = request.args.get('w', type=int)
+    if width:
+        thumb_width = image_cache.thumbnail_width(width)
+        thumb_path = image_cache.thumbnail(digest, thumb_width) if thumb_width else None
+        if thumb_path:
+            path, mimetype, etag = thumb_path, 'image/webp', f"{digest}-{thumb_width}"
+        elif thumb_width:
+            # Still rendering: serve the original without pinning it to this URL
+            immutable = False
+    
+    # Content never changes for a file_id, so the URL can be cached for good;
+    # send_file also answers If-None-Match and Range requests
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=etag,
+        max_age=config.IMAGE_HTTP_MAX_AGE if immutable else 60
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = immutable
+    return response
+
+@app.route('/api/payments/yookassa', methods=['POST'])
+@limiter.exempt
+def yookassa_webhook():
+    """YooKassa HTTP notification: settle the order of a payment"""
+    if not is_yookassa_address(client_ip()):
+        app.logger.warning(f"Rejected YooKassa notification from {client_ip()}")
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    notification = request.get_json(silent=True) or {}
+    payment_id = (notification.get('object') or {}).get('id')
+    if notification.get('type') != 'notification' or not payment_id:
+        return jsonify({'error': 'Invalid notification'}), 400
+    if not str(notification.get('event', '')).startswith('payment.'):
+        return jsonify({'status': 'ignored'})
+    
+    # Notifications are not signed: use the payment as YooKassa reports it now
+    payment = check_payment_status(payment_id)
+    if payment is None:
+        # Non-2xx makes YooKassa deliver the notification again later
+        return jsonify({'error': 'Payment lookup failed'}), 503
+    
+    try:
+        with get_db() as db:
+            order = crud.apply_payment_status(db, payment)
+    except Exception as e:
+        app.logger.error(f"Error applying payment {payment_id}: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    return jsonify({'status': 'applied' if order else 'ignored'})
+
 @app.route('/api/admin/categories', methods=['GET', 'POST'])
 @limiter.limit("30 per minute")
 def admin_categories_api():
@@ -171,6 +407,7 @@ def admin_categories_api():
         if request.method == 'GET':
             with get_db() as db:
                 categories = crud.get_categories(db, active_only=False)
+                counts = crud.get_category_product_counts(db)
                 return jsonify([{
                     'id': cat.id,
                     'name': cat.name,
@@ -178,7 +415,7 @@ def admin_categories_api():
                     'icon': cat.icon,
                     'position': cat.position,
                     'is_active': cat.is_active,
-                    'product_count': len(cat.products)
+                    'product_count': counts.get(cat.id, {}).get('total', 0)
                 } for cat in categories])
         
         elif request.method == 'POST':
@@ -188,12 +425,9 @@ def admin_categories_api():
                     db,
                     name=data['name'],
                     description=data.get('description'),
-                    icon=data.get('icon')
+                    icon=data.get('icon'),
+                    is_active=data.get('is_active', True)
                 )
-                if 'is_active' in data:
-                    category.is_active = data['is_active']
-                    db.commit()
-                    db.refresh(category)
                 return jsonify({
                     'id': category.id,
                     'name': category.name,
@@ -243,9 +477,19 @@ def admin_products_api():
     try:
         if request.method == 'GET':
             category_id = request.args.get('category_id', type=int)
+            cursor = request.args.get('cursor')
+            limit = page_limit(default=100 if cursor else None)
             with get_db() as db:
-                products = crud.get_products(db, category_id=category_id, active_only=False)
-                return jsonify([{
+                next_cursor = None
+                if limit:
+                    products, next_cursor = crud.get_products_page(
+                        db, category_id=category_id, active_only=False,
+                        cursor=cursor, limit=limit, profile='product_with_category'
+                    )
+                else:
+                    products = crud.get_products(db, category_id=category_id, active_only=False,
+                                                 profile='product_with_category')
+                return paginated_json([{
                     'id': prod.id,
                     'name': prod.name,
                     'description': prod.description,
@@ -253,13 +497,13 @@ def admin_products_api():
                     'stock': prod.stock,
                     'brand': prod.brand,
                     'sizes': prod.sizes,
-                    'size_stock': prod.size_stock,
+                    'size_stock': inventory.size_stock_json(prod),
                     'photos': prod.photos.split(',') if prod.photos else [],
                     'category_id': prod.category_id,
                     'category_name': prod.category.name,
                     'is_active': prod.is_active,
                     'position': prod.position
-                } for prod in products])
+                } for prod in products], next_cursor)
         
         elif request.method == 'POST':
             data = request.json
@@ -273,15 +517,10 @@ def admin_products_api():
                     stock=int(data.get('stock', 0)),
                     sizes=data.get('sizes'),
                     photos=data.get('photos'),
-                    size_chart=data.get('size_chart')
+                    size_chart=data.get('size_chart'),
+                    brand=data.get('brand'),
+                    size_stock=data.get('size_stock')
                 )
-                # Update brand and size_stock if provided
-                if 'brand' in data:
-                    product.brand = data['brand']
-                if 'size_stock' in data:
-                    product.size_stock = data['size_stock']
-                db.commit()
-                db.refresh(product)
                 
                 return jsonify({
                     'id': product.id,
@@ -291,11 +530,13 @@ def admin_products_api():
                     'stock': product.stock,
                     'brand': product.brand,
                     'sizes': product.sizes,
-                    'size_stock': product.size_stock,
+                    'size_stock': inventory.size_stock_json(product),
                     'photos': product.photos.split(',') if product.photos else [],
                     'category_id': product.category_id,
                     'is_active': product.is_active
                 }), 201
+    except InvalidCursor:
+        raise
     except Exception as e:
         app.logger.error(f"Error in admin products API: {e}")
         return jsonify({'error': str(e)}), 500
@@ -319,7 +560,7 @@ def admin_product_detail(product_id):
                     'stock': product.stock,
                     'brand': product.brand,
                     'sizes': product.sizes,
-                    'size_stock': product.size_stock,
+                    'size_stock': inventory.size_stock_json(product),
                     'photos': product.photos.split(',') if product.photos else [],
                     'category_id': product.category_id,
                     'is_active': product.is_active
@@ -364,23 +605,35 @@ def admin_stats():
 def admin_orders():
     """Get recent orders for admin"""
     try:
-        limit = request.args.get('limit', 10, type=int)
+        limit = page_limit(default=10, maximum=100)
+        cursor = request.args.get('cursor')
         with get_db() as db:
-            from database.models import Order
+            orders, next_cursor = crud.get_orders_page(
+                db, cursor=cursor, limit=limit, profile='order_with_user'
+            )
             
-            orders = db.query(Order).order_by(Order.created_at.desc()).limit(limit).all()
-            
-            return jsonify([{
+            return paginated_json([{
                 'id': order.id,
                 'user_name': order.user.username if order.user else None,
                 'total_amount': order.total_amount,
                 'status': order.status,
                 'created_at': order.created_at.isoformat()
-            } for order in orders])
+            } for order in orders], next_cursor)
+    except InvalidCursor:
+        raise
     except Exception as e:
         app.logger.error(f"Error fetching admin orders: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/admin/cache-stats')
+@limiter.limit("10 per minute")
+def admin_cache_stats():
+    """Get in-process cache counters"""
+    return jsonify({
+        'catalog': catalog_cache.get_stats(),
+        'payloads': payload_cache.get_stats()
+    })
+
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
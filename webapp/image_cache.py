@@ -0,0 +1,236 @@
+"""
+On-disk cache of catalog photos stored as Telegram file_ids.
+
+A file_id is resolved through the Bot API (getFile, then a download) once;
+the bytes are stored content-addressed under their SHA-256 and an index
+file maps the file_id to that digest, so every gunicorn worker and every
+restart shares the same copy. Resized WebP thumbnails are rendered with
+Pillow in a small thread pool, prefetched for all configured widths as
+soon as an original is downloaded.
+
+Files are written to a temporary name and renamed into place, so
+concurrent workers never see partial files; at worst two of them download
+the same photo once.
+
+Layout under the cache root:
+
+    ids/<sha256(file_id)>             "<digest> <mimetype>"
+    originals/<digest[:2]>/<digest>   original bytes
+    thumbs/<digest[:2]>/<digest>-<width>.webp
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from io import BytesIO
+from typing import Dict, Optional, Sequence, Tuple
+
+import requests
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+FILE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{16,255}$')
+LOCK_STRIPES = 64
+# Bot API getFile only serves files up to 20 MB
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+THUMBNAIL_QUALITY = 80
+
+
+class ImageNotFound(Exception):
+    """The file_id is unknown to the Bot API or is not an image"""
+
+
+class ImageUnavailable(Exception):
+    """The Bot API could not be reached; the request may be retried"""
+
+
+def is_file_id(photo: str) -> bool:
+    return bool(FILE_ID_RE.match(photo))
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class ImageCache:
+    """Telegram photos and their thumbnails, cached on disk"""
+
+    def __init__(self, root: str, bot_token: str, api_url: str = "https://api.telegram.org",
+                 widths: Sequence[int] = (), workers: int = 2, timeout: float = 10):
+        self.root = root
+        self.widths = tuple(sorted(widths))
+        self.timeout = timeout
+        self._api_url = api_url.rstrip('/')
+        self._bot_token = bot_token
+        self._http = requests.Session()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._pending: Dict[str, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._stats = {'hits': 0, 'downloads': 0, 'download_bytes': 0, 'thumbnails': 0, 'thumbnail_timeouts': 0}
+
+    # ----- paths -----
+
+    def _index_path(self, file_id: str) -> str:
+        return os.path.join(self.root, 'ids', hashlib.sha256(file_id.encode()).hexdigest())
+
+    def original_path(self, digest: str) -> str:
+        return os.path.join(self.root, 'originals', digest[:2], digest)
+
+    def thumbnail_path(self, digest: str, width: int) -> str:
+        return os.path.join(self.root, 'thumbs', digest[:2], f"{digest}-{width}.webp")
+
+    def thumbnail_width(self, requested: int) -> Optional[int]:
+        """Smallest configured width covering the requested one; None for the original"""
+        for width in self.widths:
+            if width >= requested:
+                return width
+        return None
+
+    # ----- originals -----
+
+    def _read_index(self, file_id: str) -> Optional[Tuple[str, str]]:
+        try:
+            with open(self._index_path(file_id)) as f:
+                digest, mimetype = f.read().split()
+        except (FileNotFoundError, ValueError):
+            return None
+        if not os.path.exists(self.original_path(digest)):
+            return None
+        return digest, mimetype
+
+    def _api_get(self, url: str, **kwargs) -> requests.Response:
+        try:
+            response = self._http.get(url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise ImageUnavailable(f"Bot API request failed: {e}") from e
+        if response.status_code >= 500 or response.status_code == 429:
+            raise ImageUnavailable(f"Bot API returned {response.status_code}")
+        return response
+
+    def _download(self, file_id: str) -> bytes:
+        response = self._api_get(f"{self._api_url}/bot{self._bot_token}/getFile", params={'file_id': file_id})
+        try:
+            result = response.json()
+        except ValueError as e:
+            raise ImageUnavailable("Bot API returned invalid JSON") from e
+        if not result.get('ok') or not result.get('result', {}).get('file_path'):
+            raise ImageNotFound(result.get('description') or 'file not found')
+
+        file_path = result['result']['file_path']
+        with self._api_get(f"{self._api_url}/file/bot{self._bot_token}/{file_path}", stream=True) as response:
+            if response.status_code != 200:
+                raise ImageNotFound(f"Bot API file download returned {response.status_code}")
+            data = bytearray()
+            try:
+                for chunk in response.iter_content(64 * 1024):
+                    data += chunk
+                    if len(data) > MAX_DOWNLOAD_BYTES:
+                        raise ImageNotFound("file is too large")
+            except requests.RequestException as e:
+                raise ImageUnavailable(f"Bot API download failed: {e}") from e
+        return bytes(data)
+
+    def resolve(self, file_id: str) -> Tuple[str, str]:
+        """
+        Make sure the photo is on disk
+
+        Returns:
+            Tuple[str, str]: (content digest, mimetype) of the original
+        """
+        cached = self._read_index(file_id)
+        if cached:
+            self._stats['hits'] += 1
+            return cached
+
+        with self._locks[hash(file_id) % LOCK_STRIPES]:
+            cached = self._read_index(file_id)
+            if cached:
+                self._stats['hits'] += 1
+                return cached
+
+            data = self._download(file_id)
+            try:
+                with Image.open(BytesIO(data)) as image:
+                    mimetype = Image.MIME.get(image.format)
+            except UnidentifiedImageError as e:
+                raise ImageNotFound("file is not an image") from e
+            if not mimetype:
+                raise ImageNotFound("unsupported image format")
+
+            digest = hashlib.sha256(data).hexdigest()
+            if not os.path.exists(self.original_path(digest)):
+                _write_atomic(self.original_path(digest), data)
+            _write_atomic(self._index_path(file_id), f"{digest} {mimetype}".encode())
+            self._stats['downloads'] += 1
+            self._stats['download_bytes'] += len(data)
+
+        for width in self.widths:
+            self._schedule_thumbnail(digest, width)
+        return digest, mimetype
+
+    # ----- thumbnails -----
+
+    def _render_thumbnail(self, digest: str, width: int):
+        with Image.open(self.original_path(digest)) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.Resampling.LANCZOS)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            buffer = BytesIO()
+            image.save(buffer, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+        _write_atomic(self.thumbnail_path(digest, width), buffer.getvalue())
+        self._stats['thumbnails'] += 1
+
+    def _schedule_thumbnail(self, digest: str, width: int) -> Optional[Future]:
+        key = f"{digest}-{width}"
+        with self._pending_lock:
+            future = self._pending.get(key)
+            if future is None:
+                if os.path.exists(self.thumbnail_path(digest, width)):
+                    return None
+                future = self._pool.submit(self._render_thumbnail, digest, width)
+                self._pending[key] = future
+                future.add_done_callback(lambda f: self._finish_thumbnail(key, f))
+            return future
+
+    def _finish_thumbnail(self, key: str, future: Future):
+        with self._pending_lock:
+            self._pending.pop(key, None)
+        if not future.cancelled() and future.exception():
+            logger.warning(f"Thumbnail {key} failed: {future.exception()}")
+
+    def thumbnail(self, digest: str, width: int, wait: float = 5) -> Optional[str]:
+        """Path of the WebP thumbnail, rendering it if needed; None if not ready within wait seconds"""
+        path = self.thumbnail_path(digest, width)
+        if os.path.exists(path):
+            return path
+        future = self._schedule_thumbnail(digest, width)
+        if future is not None:
+            try:
+                future.result(timeout=wait)
+            except FutureTimeoutError:
+                self._stats['thumbnail_timeouts'] += 1
+                return None
+            except Exception:
+                return None
+        return path if os.path.exists(path) else None
+
+    def get_stats(self) -> dict:
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {**self._stats, 'pending_thumbnails': pending, 'widths': list(self.widths)}
@@ -0,0 +1,136 @@
+"""
+Pre-serialized response cache for catalog API endpoints.
+
+Payloads are encoded once per catalog version (with orjson when installed)
+and stored as bytes together with gzip and, if the brotli package is
+available, brotli variants. A hot request is then a dictionary lookup plus
+a write. Entries live in an LRU bounded by total bytes; the whole cache is
+dropped when the catalog version changes.
+"""
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+ENTRY_OVERHEAD = 256
+
+
+def dumps(data) -> bytes:
+    """Encode data as compact UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+@dataclass(frozen=True)
+class CachedPayload:
+    body: bytes
+    gzip: Optional[bytes] = None
+    br: Optional[bytes] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzip or b'') + len(self.br or b'') + ENTRY_OVERHEAD
+
+    def encoded(self, accept_encodings) -> tuple:
+        """Best (body, content-encoding) for a werkzeug Accept-Encoding header"""
+        if self.br is not None and accept_encodings['br']:
+            return self.br, 'br'
+        if self.gzip is not None and accept_encodings['gzip']:
+            return self.gzip, 'gzip'
+        return self.body, None
+
+
+def build_payload(data, headers: Dict[str, str] = None) -> CachedPayload:
+    """Serialize data and pre-compress it"""
+    body = dumps(data)
+    if len(body) < MIN_COMPRESS_SIZE:
+        return CachedPayload(body=body, headers=headers or {})
+    return CachedPayload(
+        body=body,
+        gzip=gzip.compress(body, compresslevel=6),
+        br=brotli.compress(body, quality=9) if brotli is not None else None,
+        headers=headers or {}
+    )
+
+
+class PayloadCache:
+    """Thread-safe LRU of CachedPayload objects capped by total size in bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.version = None
+        self._entries: "OrderedDict[Hashable, CachedPayload]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self._stats['invalidations'] += 1
+            self._entries.clear()
+            self._bytes = 0
+            self.version = version
+
+    def get(self, key: Hashable, version) -> Optional[CachedPayload]:
+        with self._lock:
+            self._check_version(version)
+            payload = self._entries.get(key)
+            if payload is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return payload
+
+    def put(self, key: Hashable, version, payload: CachedPayload):
+        size = payload.size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = payload
+            self._bytes += size
+            self._stats['stores'] += 1
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else None,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'version': self.version,
+                'encoder': 'orjson' if orjson is not None else 'json',
+                'brotli': brotli is not None,
+            }